@@ -1,16 +1,41 @@
 import streamlit as st
-import pandas as pd
 import os
+import sys
 import time
-import random
-from research_agent import enrich_lead
-from copywriter_agent import generate_email_content
-from gmail_service import authenticate_gmail, create_message, send_email, get_user_email
-from database import init_db, get_machine_id, check_user_status, increment_trial, validate_access_code
-
-# Initialize DB
-init_db()
-MACHINE_ID = get_machine_id()
+import uuid
+import threading
+import subprocess
+import metrics
+import tracing
+from dispatcher import (SendDispatcher, schedule_campaign, daily_limit as dispatcher_daily_limit,
+                        pacing_enabled as dispatcher_pacing_enabled)
+from database import (init_db, get_machine_id, check_user_status, increment_trial, validate_access_code,
+                      enqueue_jobs, run_status, set_setting, cancel_sends, outbox_status, sends_in_window,
+                      update_lead, lead_counts, lead_lists, add_run, recent_runs, span_stages, lead_timings)
+
+@st.cache_resource(show_spinner=False)
+def setup():
+    """
+    Creates the schema and fingerprints the machine once per app process, not on every rerun.
+    Also serves /metrics for Prometheus when LEADFLOW_METRICS_PORT is set.
+    """
+    init_db()
+    tracing.start_exporter()
+    return get_machine_id()
+
+MACHINE_ID = setup()
+
+# Leads are read from the lead store a page at a time, only the columns on screen
+LEADS_PAGE_SIZE = 50
+PREVIEW_COLUMNS = ['Founder Name', 'Email', 'Domain', 'Location', 'Status']
+REVIEW_COLUMNS = ['Founder Name', 'Subject', 'Opener', 'Body', 'Closing']
+# Ready leads offered in the email preview picker
+REVIEW_LIMIT = 200
+# Slowest leads listed under Run diagnostics
+DIAGNOSTIC_LEADS = 50
+# Queuing a background run starts a local worker unless one from this session is still alive;
+# set to 0 when workers run elsewhere
+AUTOSTART_WORKER = os.getenv("LEADFLOW_AUTOSTART_WORKER", "1") != "0"
 
 # Set page config
 st.set_page_config(page_title="LeadFlow AI", page_icon="🚀", layout="wide")
@@ -123,62 +148,28 @@ if 'phase' not in st.session_state:
 if 'leads' not in st.session_state:
     st.session_state['leads'] = None
 
-def clean_data(df):
-    mapping = {
-        'first_name': ['first name', 'fname', 'first', 'given name', 'f.name'],
-        'last_name': ['last name', 'lname', 'last', 'surname', 'family name', 'l.name'],
-        'name': ['name', 'founder', 'contact', 'person', 'full name', 'founder name', 'lead name'],
-        'email': ['email', 'e-mail', 'mail', 'contact email', 'email address'],
-        'domain': ['domain', 'website', 'url', 'company website', 'company url', 'site'],
-        'linkedin': ['linkedin', 'linkedin url', 'profile', 'linkedin profile', 'li url'],
-        'position': ['position', 'title', 'job title', 'role', 'designation'],
-        'location': ['location', 'city', 'country', 'state', 'address', 'hq']
-    }
-    
-    temp_df = df.copy()
-    temp_df.columns = [c.lower().strip() for c in temp_df.columns]
-    
-    extracted = {}
-    for target, patterns in mapping.items():
-        for col in temp_df.columns:
-            if col in patterns:
-                extracted[target] = df.iloc[:, temp_df.columns.get_loc(col)]
-                break
-    
-    cleaned_df = pd.DataFrame()
-    
-    # Logic for Founder Name (Flexible)
-    if 'first_name' in extracted and 'last_name' in extracted:
-        # Combine if both exist
-        cleaned_df['Founder Name'] = extracted['first_name'].fillna('').astype(str).str.strip() + " " + extracted['last_name'].fillna('').astype(str).str.strip()
-    elif 'name' in extracted:
-        cleaned_df['Founder Name'] = extracted['name']
-    elif 'first_name' in extracted:
-        cleaned_df['Founder Name'] = extracted['first_name']
-    else:
-        cleaned_df['Founder Name'] = ""
-        
-    # Map other fields with default empty values if not found
-    field_map = {
-        'email': 'Email',
-        'domain': 'Domain',
-        'linkedin': 'Linkedin',
-        'position': 'Position',
-        'location': 'Location'
-    }
-    
-    for key, label in field_map.items():
-        if key in extracted:
-            cleaned_df[label] = extracted[key]
-        else:
-            cleaned_df[label] = ""
-            
-    return cleaned_df.reset_index(drop=True)
+def user_status():
+    """(trial_uses, is_pro), read once per session; call forget_user_status() after anything that changes it."""
+    if 'user_status' not in st.session_state:
+        st.session_state['user_status'] = check_user_status(MACHINE_ID)
+    return st.session_state['user_status']
+
+def forget_user_status():
+    st.session_state.pop('user_status', None)
+
+def use_trial():
+    increment_trial(MACHINE_ID)
+    forget_user_status()
 
 # --- NAVIGATION ---
 def main():
+    # Emails queued before a restart keep going out as soon as any page is opened,
+    # not only once someone reaches the send section with a list loaded
+    if outbox_status().get('scheduled'):
+        get_dispatcher()
+
     # Load user status
-    trial_uses, is_pro = check_user_status(MACHINE_ID)
+    trial_uses, is_pro = user_status()
     
     st.sidebar.title("🚀 LeadFlow AI")
     
@@ -207,6 +198,7 @@ def main():
                 code_input = st.text_input("Enter Access Code")
                 if st.button("Activate Code"):
                     if validate_access_code(MACHINE_ID, code_input):
+                        forget_user_status()
                         st.success("Access Granted! Welcome to Pro.")
                         st.rerun()
                     else:
@@ -250,9 +242,6 @@ def main():
     elif st.session_state.page == "About Us":
         show_about()
 
-import plotly.express as px
-import plotly.graph_objects as go
-
 def show_home(is_pro, trial_uses):
     st.title("Elite Agentic Prospecting")
     
@@ -274,16 +263,13 @@ def show_home(is_pro, trial_uses):
     
     with col_main:
         st.markdown("### 📊 Performance Ecosystem")
-        # Mock analytics for visual "wow" factor
-        df_plot = pd.DataFrame({
-            'Stage': ['Enriched', 'Drafted', 'Sent', 'Replied'],
-            'Count': [150, 120, 100, 18]
-        })
-        fig = px.bar(df_plot, x='Stage', y='Count', 
-                     color='Stage', 
-                     color_discrete_sequence=['#8b5cf6', '#a78bfa', '#c4b5fd', '#10b981'],
-                     template="plotly_dark")
-        fig.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', showlegend=False)
+        # Mock analytics for visual "wow" factor (graph_objects needs no pandas, so Home stays light)
+        import plotly.graph_objects as go
+
+        fig = go.Figure(go.Bar(x=['Enriched', 'Drafted', 'Sent', 'Replied'], y=[150, 120, 100, 18],
+                               marker_color=['#8b5cf6', '#a78bfa', '#c4b5fd', '#10b981']))
+        fig.update_layout(template="plotly_dark", plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)',
+                          showlegend=False, xaxis_title='Stage', yaxis_title='Count')
         st.plotly_chart(fig, use_container_width=True)
 
     with col_side:
@@ -338,49 +324,185 @@ def show_about():
         - **Skills**: AI Workflow Automation, Data Engineering, Python, Lead Generation Strategy.
         """)
 
+def start_local_worker(openrouter_api_key, tavily_api_key):
+    """Starts a detached worker process on this machine using the sidebar API keys."""
+    env = {**os.environ, "OPENROUTER_API_KEY": openrouter_api_key or "", "TAVILY_API_KEY": tavily_api_key or ""}
+    worker_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+    return subprocess.Popen([sys.executable, worker_path], env=env, start_new_session=True)
+
+@st.fragment(run_every="3s")
+def show_run_status(run_id):
+    """Polls the job queue; the workers do the work and finished jobs write their leads into the lead store."""
+    counts = run_status(run_id)
+    total = sum(counts.values())
+    finished = counts.get('done', 0) + counts.get('failed', 0)
+    st.progress(finished / total if total else 0.0)
+    st.caption(f"Queued: `{counts.get('queued', 0)}` | Running: `{counts.get('running', 0)}` | "
+               f"Done: `{counts.get('done', 0)}` | Failed: `{counts.get('failed', 0)}`")
+
+    if total and finished == total:
+        st.success("Personalization Complete!")
+        if not st.session_state.get('run_done'):
+            st.session_state['run_done'] = True
+            st.rerun()
+    elif counts.get('queued') and not counts.get('running'):
+        st.info("Waiting for a worker. Start one with `python worker.py` or the button below.")
+
+def show_run_diagnostics(runs):
+    """Where a traced run's (or campaign's) time went: per span name, then per lead for the slowest leads."""
+    import pandas as pd
+
+    labels = {run_id: f"{kind.title()} · {time.strftime('%b %d %H:%M', time.localtime(started_at))}"
+              for run_id, kind, _, started_at in runs}
+    run_id = st.selectbox("Run", list(labels), format_func=labels.get, key="diagnostics_run")
+    stages = span_stages(run_id)
+    if not stages:
+        st.caption("No timings recorded for this run yet.")
+        return
+    st.dataframe(pd.DataFrame(stages, columns=["span", "count", "total_s", "p50_s", "p95_s", "failed",
+                                               "input_tokens", "output_tokens"]).round(3),
+                 use_container_width=True, hide_index=True)
+
+    # Queue waits, stages and sends follow each other within a lead, so they add up to its wall-clock time;
+    # searches and LLM calls happen inside the stages and are listed alongside
+    names = [name for name, *_ in stages if name.split('.', 1)[0] in ('queue', 'stage', 'send')]
+    details = [name for name, *_ in stages if name not in names]
+    index, wall, seconds = lead_timings(run_id, names + details, DIAGNOSTIC_LEADS)
+    per_lead = pd.DataFrame({'wall_s': wall, **seconds}, index=pd.Index(index, name='lead')).round(3)
+    st.caption(f"Slowest {len(index)} leads: wall-clock seconds by stage")
+    st.bar_chart(per_lead[names], horizontal=True)
+    st.dataframe(per_lead, use_container_width=True)
+
+@st.cache_resource
+def get_dispatcher():
+    """One send dispatcher thread per app process, shared by every session."""
+    dispatcher = SendDispatcher()
+    dispatcher.start()
+    return dispatcher
+
+@st.fragment(run_every="5s")
+def show_send_status(campaign_id):
+    """Polls the outbox; the dispatcher does the sending and each outcome is written to its lead in the lead store."""
+    counts = outbox_status(campaign_id)
+    total = sum(counts.values())
+    settled = counts.get('sent', 0) + counts.get('failed', 0) + counts.get('cancelled', 0)
+    sent_today, next_at = sends_in_window()
+    limit = dispatcher_daily_limit()
+
+    st.progress(settled / total if total else 0.0)
+    st.markdown(f"**⚡ Progress:** `{settled} / {total}` | Sent: `{counts.get('sent', 0)}` | "
+                f"Failed: `{counts.get('failed', 0)}` | Waiting: `{counts.get('scheduled', 0) + counts.get('sending', 0)}`")
+    st.caption(f"Sent in the last 24h (all campaigns): `{sent_today} / {limit}`")
+
+    if counts.get('scheduled'):
+        if sent_today >= limit:
+            st.warning(f"🛑 Daily safe limit of {limit} reached. Sending resumes automatically as the 24h window frees up.")
+        elif next_at:
+            st.caption(f"**Human Jitter:** next email in `{max(0, int(next_at - time.time()))}`s")
+        dispatcher = get_dispatcher()
+        if dispatcher.last_error:
+            st.error(f"Sending paused: {dispatcher.last_error}")
+        if st.button("🛑 Stop Campaign", help="Cancels every email of this campaign that has not gone out yet."):
+            cancel_sends(campaign_id)
+    elif total and settled == total:
+        cancelled = f", Cancelled: {counts['cancelled']}" if counts.get('cancelled') else ""
+        st.success(f"Campaign Finished! Sent: {counts.get('sent', 0)}, Failed: {counts.get('failed', 0)}{cancelled}")
+        if not st.session_state.get('campaign_done'):
+            st.session_state['campaign_done'] = True
+            st.rerun()
+
+@st.cache_resource(show_spinner=False)
+def warm_agents():
+    """Loads the LLM and graph stack once per process, on a background thread so the page isn't held up."""
+    from pipeline import warm_up
+
+    thread = threading.Thread(target=warm_up, daemon=True, name="leadflow-warm-up")
+    thread.start()
+    return thread
+
 def show_app(openrouter_api_key, tavily_api_key, is_pro):
+    # Loaded on the first visit to this page, not before Home draws; LangChain/LangGraph load on first use
+    import pandas as pd
+    from pipeline import run_pipeline, personalization_stages, preview_lead, needs_processing, DEFAULT_CONCURRENCY
+    from research_agent import SEARCH_DEADLINE_S, normalize_domain, max_batch_size
+    from ingest import ingest_file, load_leads, iter_leads
+    from clients import MODEL_TIERS, stage_model
+
     st.title("🎯 LeadFlow Control Center")
+
+    # Deliverability Shield Sidebar Section
+    with st.sidebar:
+        st.divider()
+        with st.expander("🛡️ Safety & Anti-Ban Monitor", expanded=True):
+            st.metric("Risk Level", "Low", "Safe Mode Active")
+            
+            saved_limit = dispatcher_daily_limit()
+            daily_limit = st.slider("Daily Send Limit", min_value=1, max_value=50, value=saved_limit,
+                                    help="Keep this under 50 to stay under Google's radar. Applies to every session.")
+            if daily_limit != saved_limit:
+                set_setting('daily_send_limit', daily_limit)
+
+            saved_pacing = dispatcher_pacing_enabled()
+            pacing = st.checkbox("Human Jitter", value=saved_pacing,
+                                 help="Untick only for warmed-up accounts: new campaigns then go out in Gmail batches, still under the daily limit.")
+            if pacing != saved_pacing:
+                set_setting('send_pacing', int(pacing))
+            
+            st.markdown(f"""
+            **Safety Protocols Active:**
+            - {'✅' if pacing else '⚠️'} **Human Jitter**: {'Randomized delays [30s-90s].' if pacing else 'Off (batched sends).'}
+            - ✅ **Volume Cap**: Hard stop at limit per rolling 24h.
+            - ✅ **Reply-First**: Whitelisting strategy.
+            """)
     
     # --- PHASE 1: INGESTION ---
     st.markdown("### 1. Upload Your Lead List")
     uploaded_file = st.file_uploader("Choose a CSV, Excel, or Text file", type=["csv", "xlsx", "txt"])
     
-    if uploaded_file:
-        # Load and clean data
-        try:
-            if uploaded_file.name.endswith('.csv'):
-                df = pd.read_csv(uploaded_file)
-            elif uploaded_file.name.endswith('.xlsx'):
-                df = pd.read_excel(uploaded_file)
-            else:
-                df = pd.read_csv(uploaded_file, sep='\t' if '\t' in uploaded_file.getvalue().decode() else ',')
-                
-            leads_df = clean_data(df)
-            
-            # Add internal tracking columns
-            if 'Status' not in leads_df.columns:
-                leads_df['Status'] = 'Pending'
-                leads_df['Enriched Data'] = ''
-                leads_df['Subject'] = ''
-                leads_df['Opener'] = ''
-                leads_df['Body'] = ''
-                leads_df['Closing'] = ''
-
-            st.success(f"Matched {len(leads_df)} leads. Using mapped headers: Name, Email, Domain, Position, Location.")
-            
-            # Display Data Preview in a luxurious card
-            with st.expander("🔍 Preview Leads", expanded=False):
-                st.dataframe(leads_df[['Founder Name', 'Email', 'Domain', 'Location', 'Status']])
+    saved_lists = lead_lists()
 
-            st.divider()
-            st.session_state['leads_df'] = leads_df
-        except Exception as e:
-            st.error(f"Error processing file: {e}")
-            st.session_state['leads_df'] = None
+    if uploaded_file:
+        # Stream the file into the lead store once per upload, not on every rerun
+        if st.session_state.get('lead_file_id') != uploaded_file.file_id:
+            try:
+                list_id, rows, dropped = ingest_file(uploaded_file, uploaded_file.name)
+                st.session_state['lead_file_id'] = uploaded_file.file_id
+                st.session_state['list_id'] = list_id
+                st.session_state['ingest_dropped'] = dropped
+            except Exception as e:
+                st.error(f"Error processing file: {e}")
+                st.session_state['list_id'] = None
+    elif saved_lists:
+        # Lists and their results live in leadflow.db, so earlier uploads can be reopened after a restart
+        names = {list_id: f"{name} ({rows} leads, {time.strftime('%Y-%m-%d %H:%M', time.localtime(created_at))})"
+                 for list_id, name, rows, created_at in saved_lists}
+        current = st.session_state.get('list_id')
+        choices = [None] + list(names)
+        choice = st.selectbox("Or reopen a saved list", choices, index=choices.index(current) if current in names else 0,
+                              format_func=lambda i: names.get(i, "—"))
+        if choice and choice != current:
+            st.session_state['list_id'] = choice
+            st.session_state['ingest_dropped'] = None
+
+    list_id = st.session_state.get('list_id')
+    if list_id:
+        counts = lead_counts(list_id)
+        total_leads = sum(counts.values())
+        st.success(f"Matched {total_leads} leads. Using mapped headers: Name, Email, Domain, Position, Location.")
+        dropped = st.session_state.get('ingest_dropped') or {}
+        if dropped.get('invalid') or dropped.get('duplicate'):
+            st.caption(f"Skipped {dropped.get('invalid', 0)} rows without a valid email and "
+                       f"{dropped.get('duplicate', 0)} repeated emails.")
+
+        # Display Data Preview in a luxurious card
+        with st.expander("🔍 Preview Leads", expanded=False):
+            pages = max(1, -(-total_leads // LEADS_PAGE_SIZE))
+            page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key="leads_page")
+            st.dataframe(load_leads(list_id, (page - 1) * LEADS_PAGE_SIZE, LEADS_PAGE_SIZE, PREVIEW_COLUMNS))
+            st.caption(" | ".join(f"{status}: {n}" for status, n in counts.items()))
 
+        st.divider()
 
-    if st.session_state['leads_df'] is not None:
-        leads_df = st.session_state['leads_df']
         # --- PHASE 2 & 3: AGENTIC WORKFLOW ---
         st.markdown("### 2. Personalization Strategy")
         
@@ -388,44 +510,220 @@ def show_app(openrouter_api_key, tavily_api_key, is_pro):
                                  placeholder="e.g., I build high-converting landing pages for Series A fintechs.",
                                  help="Lawrence's AI will weave this into the email using specialized creative hooks.")
 
+        with st.expander("⚡ Pipeline Settings", expanded=False):
+            c_search, c_summarize, c_copy = st.columns(3)
+            concurrency = {
+                "search": c_search.number_input("Search workers", min_value=1, max_value=32, value=DEFAULT_CONCURRENCY["search"]),
+                "summarize": c_summarize.number_input("Summarize workers", min_value=1, max_value=16, value=DEFAULT_CONCURRENCY["summarize"]),
+                "copywrite": c_copy.number_input("Copywriting workers", min_value=1, max_value=16, value=DEFAULT_CONCURRENCY["copywrite"]),
+            }
+            search_deadline = st.number_input("Search deadline per lead (s)", min_value=1.0, max_value=60.0, value=SEARCH_DEADLINE_S, step=1.0,
+                                              help="Tavily, DuckDuckGo and RSS are queried in parallel; sources slower than this are dropped.")
+            force_refresh = st.checkbox("Force refresh research", value=False,
+                                        help="Ignore cached search results and summaries from earlier uploads.")
+            incremental = st.checkbox("Only new, failed or changed leads", value=True,
+                                      help="Skip Ready leads whose email was already written from the same offer, research, "
+                                           "lead details and model. Scheduled and Sent leads are never redone.")
+            group_by_domain = st.checkbox("Research each company once", value=True,
+                                          help="Leads sharing a Domain reuse one company-level search and summary.")
+            st.markdown("**Models**")
+            tier_names = {model: f"{tier} ({model.split('/')[-1]})" for tier, model in MODEL_TIERS.items()}
+            models = {}
+            for column, stage, label in zip(st.columns(5), ["summarize", "copywrite", "fused", "repair", "escalate"],
+                                            ["Summarize", "Copywrite", "Research + copy", "Repair", "Escalate to"]):
+                choices = list(MODEL_TIERS.values()) + ([""] if stage == "escalate" else [])
+                default = stage_model(stage)
+                if default not in choices:
+                    choices.append(default)
+                models[stage] = column.selectbox(label, choices, index=choices.index(default),
+                                                 format_func=lambda m: tier_names.get(m, m) if m else "off")
+            st.caption("Repair re-requests email fields that failed validation. A summary or repair that still fails "
+                       "is retried once on the Escalate model.")
+            requested_batch = st.number_input("Leads per summarize request", min_value=1, max_value=20, value=1,
+                                              help="Pack several leads' search results into one summarization call.")
+            summary_batch_size = max_batch_size(models["summarize"], requested_batch)
+            if summary_batch_size < requested_batch:
+                st.caption(f"Batch size capped at {summary_batch_size} to fit the model's context window.")
+            fused = st.checkbox("Research + copy in one call", value=False,
+                                help="One LLM request per lead returns both the research summary and the email. "
+                                     "Fastest when most leads are at different companies; ignores the summarize batch size.")
+            run_mode = st.radio("Run on", ["Background workers", "This session"], horizontal=True,
+                                help="Background workers (`python worker.py`) keep going if this tab closes or reruns. "
+                                     "This session runs inside the page and shows live throughput.")
+
+        with st.expander("⚡ Live Preview (single lead)", expanded=False):
+            # Picks from the page open in the leads preview; Scheduled and Sent leads are
+            # left out, since writing a fresh draft back would queue them to be emailed again
+            page_df = load_leads(list_id, (st.session_state.get('leads_page', 1) - 1) * LEADS_PAGE_SIZE, LEADS_PAGE_SIZE)
+            page_status = page_df['Status'].fillna('Pending').astype(str)
+            page_df = page_df[page_status.isin(['Pending', 'Ready']) | page_status.str.startswith('Error')]
+            preview_index = st.selectbox("Lead to preview", page_df.index.tolist(),
+                                         format_func=lambda i: f"{page_df.at[i, 'Founder Name']} ({page_df.at[i, 'Domain']})")
+            if page_df.empty:
+                st.caption("Every lead on this page is already Scheduled or Sent.")
+            if st.button("Stream Preview", disabled=page_df.empty):
+                if not openrouter_api_key or not tavily_api_key:
+                    st.error("API Keys missing. Please configure them in the sidebar.")
+                else:
+                    summary_area = st.empty()
+                    email_area = st.empty()
+                    timing_text = st.empty()
+                    started = time.time()
+                    first_token = {}
+
+                    def stream_into(area, label):
+                        def on_token(text):
+                            first_token.setdefault(label, time.time() - started)
+                            area.markdown(f"**{label}**\n\n{text}")
+                        return on_token
+
+                    try:
+                        summary_area.markdown("**Researching...**")
+                        lead = preview_lead(page_df.loc[preview_index].to_dict(), openrouter_api_key, tavily_api_key,
+                                            user_offer, search_deadline, force_refresh, group_by_domain,
+                                            stream_into(summary_area, "Research"), stream_into(email_area, "Email Draft"), fused,
+                                            models)
+                        update_lead(list_id, preview_index, {field: lead[field] for field in
+                                                             ['Enriched Data', 'Subject', 'Opener', 'Body', 'Closing', 'Status']})
+                        first_paint = min(first_token.values()) if first_token else time.time() - started
+                        timing_text.caption(f"First token after {first_paint:.1f}s | Done in {time.time() - started:.1f}s")
+                    except Exception as e:
+                        st.error(f"Preview failed: {e}")
+
         if st.button("🪄 Generate Personalization"):
+            # One pass over the store picks the leads to run; they are read again page by page as they run.
+            # Scheduled and Sent leads are never redone, or a fresh Ready status would email them twice.
+            locked = ('Scheduled', 'Sent')
+            run_indexes, companies = set(), set()
+            for index, lead in iter_leads(list_id):
+                if lead['Status'] not in locked and (not incremental or needs_processing(lead, user_offer, models, fused)):
+                    run_indexes.add(index)
+                    companies.add(normalize_domain(lead['Domain']))
+            companies.discard('')
+            # Checked again on the second read, for both the in-session run and the queued background jobs
+            run_leads = lambda: ((index, lead) for index, lead in iter_leads(list_id)
+                                 if index in run_indexes and lead['Status'] not in locked)
             if not openrouter_api_key or not tavily_api_key:
                 st.error("API Keys missing. Please configure them in the sidebar.")
+            elif not run_indexes:
+                st.info("Every lead is up to date with this offer and these settings.")
+            elif run_mode == "Background workers":
+                run_id = uuid.uuid4().hex
+                options = {"concurrency": concurrency, "search_deadline": search_deadline, "force_refresh": force_refresh,
+                           "group_by_domain": group_by_domain, "summary_batch_size": summary_batch_size, "fused": fused,
+                           "models": models}
+                jobs = []
+                for index, lead in run_leads():
+                    jobs.append((index, {"lead": lead, "user_offer": user_offer, "options": options}))
+                    if len(jobs) == LEADS_PAGE_SIZE:
+                        enqueue_jobs(run_id, jobs, list_id=list_id)
+                        jobs = []
+                enqueue_jobs(run_id, jobs, list_id=list_id)
+                add_run(run_id, "background", list_id)
+                st.session_state['run_id'] = run_id
+                st.session_state['run_done'] = False
+                if not is_pro:
+                    use_trial()
+                worker = st.session_state.get('local_worker')
+                if AUTOSTART_WORKER and (worker is None or worker.poll() is not None):
+                    st.session_state['local_worker'] = start_local_worker(openrouter_api_key, tavily_api_key)
+                st.success(f"Queued {len(run_indexes)} of {total_leads} leads for background workers.")
             else:
                 progress_bar = st.progress(0)
                 status_text = st.empty()
-                
-                for index, row in leads_df.iterrows():
-                    status_text.markdown(f"**Researching:** `{row['Founder Name']}` at `{row['Domain']}`...")
-                    
-                    # Phase 2: Research
-                    try:
-                        enriched_data = enrich_lead(row.to_dict(), openrouter_api_key, tavily_api_key)
-                        leads_df.at[index, 'Enriched Data'] = enriched_data
-                    except Exception as e:
-                        leads_df.at[index, 'Enriched Data'] = f"Error: {e}"
-                    
-                    # Phase 3: Personalization
-                    try:
-                        subject, opener, body, closing = generate_email_content(leads_df.iloc[index].to_dict(), openrouter_api_key, user_offer)
-                        leads_df.at[index, 'Subject'] = subject
-                        leads_df.at[index, 'Opener'] = opener
-                        leads_df.at[index, 'Body'] = body
-                        leads_df.at[index, 'Closing'] = closing
-                        leads_df.at[index, 'Status'] = 'Ready'
-                    except Exception as e:
-                        leads_df.at[index, 'Status'] = f"Error: {e}"
-                    
+                skipped = total_leads - len(run_indexes)
+                status_text.markdown(f"**Researching:** `{len(run_indexes)}` leads across `{len(companies)}` companies"
+                                     + (f" (`{skipped}` unchanged leads skipped)..." if skipped else "..."))
+
+                metrics.reset("search.")
+                metrics.reset("cache.")
+                metrics.reset("company.")
+                metrics.reset("summarize.")
+                metrics.reset("compact")
+                metrics.reset("llm.")
+                metrics.reset("model.")
+                metrics.reset("copywrite")
+                metrics.reset("ratelimit.")
+                stages = personalization_stages(openrouter_api_key, tavily_api_key, user_offer, concurrency, search_deadline,
+                                                force_refresh, group_by_domain, summary_batch_size, fused, models)
+                started = time.time()
+                done = 0
+                trace_run_id = uuid.uuid4().hex
+                add_run(trace_run_id, "run", list_id)
+
+                for index, lead, error in run_pipeline(run_leads(), stages, trace=lambda index: (trace_run_id, list_id, index)):
+                    # Each lead is written to the store as it lands
+                    if error is None:
+                        update_lead(list_id, index, {'Enriched Data': lead.get('Enriched Data', ''), 'Subject': lead['Subject'],
+                                                     'Opener': lead['Opener'], 'Body': lead['Body'],
+                                                     'Closing': lead['Closing'], 'Status': 'Ready'})
+                    else:
+                        update_lead(list_id, index, {'Enriched Data': lead.get('Enriched Data', ''), 'Status': f"Error: {error}"})
+
                     # Update progress
-                    progress_bar.progress((index + 1) / len(leads_df))
-                
+                    done += 1
+                    rate = done / max(time.time() - started, 1e-6) * 60
+                    progress_bar.progress(done / len(run_indexes))
+                    status_text.markdown(f"**Finished:** `{lead['Founder Name']}` at `{lead['Domain']}` | `{done}/{len(run_indexes)}` | `{rate:.1f}` leads/min")
+
                 status_text.success("Personalization Complete!")
+                with st.expander("📡 Provider & Model Latency", expanded=False):
+                    st.dataframe(pd.DataFrame.from_dict(metrics.snapshot("search."), orient="index"), use_container_width=True)
+                    cache_stats = metrics.snapshot("cache.")
+                    if cache_stats:
+                        st.caption(" | ".join(f"{name}: {s.get('hit', 0)} hits / {s.get('miss', 0)} misses" for name, s in cache_stats.items()))
+                    summarize_stats = metrics.snapshot("summarize.")
+                    if summarize_stats:
+                        st.dataframe(pd.DataFrame.from_dict(summarize_stats, orient="index"), use_container_width=True)
+                    llm_stats = metrics.snapshot("llm.")
+                    if llm_stats:
+                        st.dataframe(pd.DataFrame.from_dict(llm_stats, orient="index"), use_container_width=True)
+                    model_stats = metrics.snapshot("model.")
+                    if model_stats:
+                        # One row per (stage, model) so tiers can be compared on latency and cost
+                        rows = [{"stage": name[len("model."):].split("@", 1)[0], "model": name.split("@", 1)[1],
+                                 "calls": s["calls"], "p50": s["p50"], "p95": s["p95"],
+                                 "input_tokens": s.get("input_tokens", 0), "output_tokens": s.get("output_tokens", 0),
+                                 "cost_usd": round(s.get("cost_usd", 0), 4),
+                                 "cost_per_call_usd": round(s.get("cost_usd", 0) / max(s["ok"], 1), 5)}
+                                for name, s in model_stats.items()]
+                        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+                    compact_stats = metrics.snapshot("compact").get("compact")
+                    if compact_stats:
+                        st.caption(f"Search results compacted: {compact_stats['tokens_in']:,} → {compact_stats['tokens_out']:,} tokens")
+                    copy_stats = metrics.snapshot("copywrite").get("copywrite")
+                    if copy_stats and copy_stats.get('drafts'):
+                        drafts = copy_stats['drafts']
+                        st.caption(f"Email drafts: {drafts} | parse failures: {copy_stats.get('parse_failed', 0) / drafts:.0%} | "
+                                   f"repair calls: {copy_stats.get('repair_calls', 0) / drafts:.0%} | "
+                                   f"fields re-requested: {copy_stats.get('invalid_fields', 0)} | "
+                                   f"fields from fallback: {copy_stats.get('fallback_fields', 0)} | "
+                                   f"escalated repairs: {copy_stats.get('escalations', 0)}")
+                    limit_stats = metrics.snapshot("ratelimit.")
+                    if limit_stats:
+                        st.caption(" | ".join(f"{name.split('.', 1)[1]}: {s.get('throttled', 0)} throttled / {s.get('retry', 0)} retried / "
+                                              f"{s.get('rejected', 0)} circuit-open" for name, s in limit_stats.items()))
+                    company_stats = metrics.snapshot("company.")
+                    if company_stats:
+                        st.caption(" | ".join(f"{name}: {s['ok']} researched / {s.get('shared', 0)} shared" for name, s in company_stats.items()))
                 if not is_pro:
-                    increment_trial(MACHINE_ID)
-                st.session_state['leads_df'] = leads_df
-
-        if 'leads_df' in st.session_state and not st.session_state['leads_df'].empty:
-            leads_df = st.session_state['leads_df']
+                    use_trial()
+
+        if st.session_state.get('run_id'):
+            with st.container(border=True):
+                st.markdown("#### 🛰️ Background Run")
+                show_run_status(st.session_state['run_id'])
+                if st.button("▶️ Start a local worker", help="Launches `python worker.py` on this machine with the sidebar API keys."):
+                    st.session_state['local_worker'] = start_local_worker(openrouter_api_key, tavily_api_key)
+                    st.toast("Worker started.")
+
+        traced_runs = recent_runs(list_id) if total_leads else []
+        if traced_runs:
+            with st.expander("🩺 Run diagnostics", expanded=False):
+                show_run_diagnostics(traced_runs)
+
+        if total_leads:
+            ready_count = lead_counts(list_id).get('Ready', 0)
             st.divider()
             
             # --- PHASE 4: SENDING ---
@@ -434,10 +732,13 @@ def show_app(openrouter_api_key, tavily_api_key, is_pro):
             col1, col2 = st.columns(2)
             with col1:
                 st.markdown("#### 📧 Email Preview")
-                ready_leads = leads_df[leads_df['Status'] == 'Ready']
+                ready_leads = load_leads(list_id, limit=REVIEW_LIMIT, columns=REVIEW_COLUMNS, status='Ready')
                 if not ready_leads.empty:
-                    selected_lead_name = st.selectbox("Select a lead to preview", ready_leads['Founder Name'].tolist())
-                    lead_data = ready_leads[ready_leads['Founder Name'] == selected_lead_name].iloc[0]
+                    selected_index = st.selectbox("Select a lead to preview", ready_leads.index.tolist(),
+                                                  format_func=lambda i: ready_leads.at[i, 'Founder Name'])
+                    lead_data = ready_leads.loc[selected_index]
+                    if ready_count > len(ready_leads):
+                        st.caption(f"Showing the first {len(ready_leads)} of {ready_count} ready leads.")
                     
                     st.info(f"**Subject:** {lead_data['Subject']}")
                     preview_text = f"{lead_data['Opener']}\n\n{lead_data['Body']}\n\n{lead_data['Closing']}"
@@ -451,6 +752,8 @@ def show_app(openrouter_api_key, tavily_api_key, is_pro):
                 # Gmail Authentication
                 st.write("**Gmail Setup**")
                 if st.button("Authenticate Gmail"):
+                    from gmail_service import authenticate_gmail, get_user_email
+
                     try:
                         service = authenticate_gmail()
                         st.session_state['gmail_service'] = service
@@ -494,90 +797,28 @@ def show_app(openrouter_api_key, tavily_api_key, is_pro):
                     elif not sender_email:
                         st.error("Please provide the sender email.")
                     else:
-                        progress_bar = st.progress(0)
-                        status_text_send = st.empty()
-                        
-                        # Calculate total ready leads
-                        ready_leads_indices = [i for i, r in leads_df.iterrows() if r['Status'] == 'Ready']
-                        total_to_send = len(ready_leads_indices)
-                        
-                        if total_to_send == 0:
+                        if not ready_count:
                             st.warning("No leads are ready to send.")
                         else:
-                            sent_count = 0
-                            fail_count = 0
-                            
-                            # Panic Button Placeholder
-                            stop_placeholder = st.empty()
-                            
+                            # Sends are paced and capped by the dispatcher; this only queues them
                             from_header = f"{sender_name} <{sender_email}>" if sender_name else sender_email
-                            
-                            for i, index in enumerate(ready_leads_indices):
-                                # Check Daily Limit
-                                if sent_count >= daily_limit:
-                                    st.warning(f"🛑 Daily safe limit of {daily_limit} reached. Stopping campaign to protect your account.")
-                                    break
-                                
-                                # Check for Panic Stop (simulated via sidebar checkbox for stability in Streamlit loops)
-                                # Streamlit doesn't support a live "Stop" button well inside loops without rerun.
-                                # Relying on strict pacing limits instead.
-                                
-                                row = leads_df.loc[index]
-                                current_num = i + 1
-                                percentage = int((current_num / total_to_send) * 100)
-                                
-                                status_text_send.markdown(f"**⚡ Progress:** `{current_num} / {total_to_send}` ({percentage}%) | **Sending to:** `{row['Email']}`...")
-                                
-                                # Construct full message with professional footer
-                                footer = f"\n\n---\nSent via LeadFlow AI\nReply 'Unsubscribe' to stop."
-                                full_body = f"{row['Opener']}\n\n{row['Body']}\n\n{row['Closing']}{footer}"
-                                
-                                msg = create_message(from_header, row['Email'], row['Subject'], full_body)
-                                
-                                try:
-                                    result = send_email(st.session_state['gmail_service'], 'me', msg)
-                                    if result:
-                                        leads_df.at[index, 'Status'] = 'Sent'
-                                        sent_count += 1
-                                    else:
-                                        leads_df.at[index, 'Status'] = 'Failed'
-                                        fail_count += 1
-                                except Exception as e:
-                                    leads_df.at[index, 'Status'] = f"Error: {e}"
-                                    fail_count += 1
-                                
-                                # Update progress bar
-                                progress_bar.progress(current_num / total_to_send)
-                                
-                                # Human Jitter Delay (30s - 90s)
-                                if current_num < total_to_send and sent_count < daily_limit:
-                                    # Variable delay based on "reading time" simulation
-                                    base_delay = random.randint(30, 90)
-                                    # Add small jitter
-                                    final_delay = base_delay + random.randint(1, 5)
-                                    
-                                    for remaining in range(final_delay, 0, -1):
-                                        status_text_send.markdown(f"**✅ Sent:** `{current_num}/{total_to_send}` | **Human Jitter:** `{remaining}`s (Simulating reading time)...")
-                                        time.sleep(1)
-
-                            st.success(f"Campaign Finished! Sent: {sent_count}, Failed: {fail_count}")
-                            st.session_state['leads_df'] = leads_df
-                            st.dataframe(leads_df, use_container_width=True)
-
-    # Deliverability Shield Sidebar Section
-    with st.sidebar:
-        st.divider()
-        with st.expander("🛡️ Safety & Anti-Ban Monitor", expanded=True):
-            st.metric("Risk Level", "Low", "Safe Mode Active")
-            
-            daily_limit = st.slider("Daily Send Limit", min_value=1, max_value=50, value=20, help="Keep this under 50 to stay under Google's radar.")
-            
-            st.markdown("""
-            **Safety Protocols Active:**
-            - ✅ **Human Jitter**: Randomized delays [30s-90s].
-            - ✅ **Volume Cap**: Hard stop at limit.
-            - ✅ **Reply-First**: Whitelisting strategy.
-            """)
+                            campaign_id = uuid.uuid4().hex
+                            add_run(campaign_id, "campaign", list_id)
+                            # Queuing marks the leads Scheduled in the lead store
+                            last_send_at = schedule_campaign(
+                                campaign_id, from_header, iter_leads(list_id, ['Email', 'Subject', 'Opener', 'Body', 'Closing'], 'Ready'),
+                                paced=dispatcher_pacing_enabled(), list_id=list_id)
+                            st.session_state['campaign_id'] = campaign_id
+                            st.session_state['campaign_done'] = False
+                            get_dispatcher()
+                            st.success(f"Queued {ready_count} emails. The last one is planned for "
+                                       f"{time.strftime('%H:%M', time.localtime(last_send_at))}; you can close this tab.")
+
+                if 'campaign_id' in st.session_state:
+                    show_send_status(st.session_state['campaign_id'])
+
+    # Once the page is drawn, get the agent stack ready for the first run or preview
+    warm_agents()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,82 @@
+"""
+Cold-start benchmark.
+Times how long app.py takes to draw Home and the LeadFlow App page on its first
+run in a fresh interpreter (so every import is included), and lists which heavy
+libraries had been imported by the time the page was drawn.
+
+    python benchmarks/cold_start.py --repeat 3 --out cold_start.json
+
+Each run uses a temporary working directory, so its leadflow.db is throwaway.
+Once the App page is drawn it starts loading LangChain/LangGraph in the
+background, so those may show as loaded for that page.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "app.py")
+PAGES = ["Home", "LeadFlow App"]
+HEAVY_MODULES = ["pandas", "plotly", "langchain_openai", "langchain_community", "langgraph", "googleapiclient"]
+
+def first_paint(page):
+    """Runs in the child interpreter: one cold script run of app.py on page."""
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    streamlit_s = time.perf_counter() - started
+
+    sys.path.insert(0, ROOT)
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.session_state["page"] = page
+    at.run()
+    total_s = time.perf_counter() - started
+    return {
+        "first_paint_s": round(total_s, 3),
+        "streamlit_import_s": round(streamlit_s, 3),
+        "app_s": round(total_s - streamlit_s, 3),
+        "exceptions": [e.message for e in at.exception],
+        "loaded": [module for module in HEAVY_MODULES if module in sys.modules],
+    }
+
+def run_child(page):
+    workdir = tempfile.mkdtemp(prefix="leadflow-cold-")
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", page], cwd=workdir,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Time app.py's first paint of Home and the LeadFlow App page")
+    parser.add_argument("--repeat", type=int, default=3, help="Cold runs per page")
+    parser.add_argument("--out", help="Write the report as JSON to this file")
+    parser.add_argument("--child", choices=PAGES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(first_paint(args.child)))
+        return
+
+    report = {}
+    for page in PAGES:
+        runs = [run_child(page) for _ in range(args.repeat)]
+        errors = [message for run in runs for message in run["exceptions"]]
+        if errors:
+            raise SystemExit(f"[ERROR] {page} raised: {errors[0]}")
+        report[page] = {field: round(statistics.median(run[field] for run in runs), 3)
+                        for field in ("first_paint_s", "streamlit_import_s", "app_s")}
+        report[page]["loaded"] = runs[-1]["loaded"]
+        print(f"[OK] {page}: first paint {report[page]['first_paint_s']}s "
+              f"(streamlit {report[page]['streamlit_import_s']}s + app {report[page]['app_s']}s), "
+              f"loaded: {', '.join(report[page]['loaded']) or 'none of the heavy libraries'}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"repeat": args.repeat, "generated_at": time.time(), **report}, f, indent=2)
+        print(f"[OK] Report written to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Multi-session database load test.
+Simulates Streamlit sessions (threads) rerunning the app's database calls
+against one leadflow.db while background workers (processes) claim and finish
+jobs, then reports reruns per second, rerun latency, worker throughput and
+how many calls failed with 'database is locked'.
+
+    python benchmarks/db_load.py --sessions 16 --workers 2 --seconds 20 --out db_load.json
+
+Each mode runs on its own temporary database seeded with one lead list:
+  pooled  the connection manager in database.py (WAL, pooled connections,
+          BEGIN IMMEDIATE writes) with setup and user status read once per session
+  legacy  a new connection per call in rollback-journal mode, with init_db,
+          get_machine_id and check_user_status on every rerun, as app.py used to
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+LEADS = 2000
+PAGE_SIZE = 50
+# Share of reruns that also write: a lead edit, a cache entry, a used trial
+WRITE_SHARE = 0.2
+
+def use_legacy():
+    """Swaps the connection manager for the connect-per-call behaviour it replaced."""
+    @contextmanager
+    def connect():
+        conn = sqlite3.connect(database.DB_PATH, timeout=database.BUSY_TIMEOUT_S, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction():
+        # Deferred, like the implicit transactions sqlite3 opened before
+        with connect() as conn:
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.execute("COMMIT")
+
+    database.connect = connect
+    database.transaction = transaction
+
+def is_locked(error):
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+def seed(db_path, legacy):
+    database.DB_PATH = db_path
+    if legacy:
+        use_legacy()
+    database.init_db()
+    list_id = database.create_lead_list("load-test.csv")
+    database.insert_leads(list_id, [(f"Lead {i}", f"lead{i}@co{i % 300}.io", f"co{i % 300}.io", "", "CEO", "Remote")
+                                    for i in range(LEADS)])
+    return list_id
+
+def session(list_id, legacy, deadline, latencies, errors):
+    """One browser session clicking around until deadline."""
+    machine_id = f"session-{threading.get_ident()}"
+    status = None
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            if legacy:
+                database.init_db()
+                database.get_machine_id()
+            if legacy or status is None:
+                status = database.check_user_status(machine_id)
+            database.lead_counts(list_id)
+            database.get_leads(list_id, random.randrange(LEADS // PAGE_SIZE) * PAGE_SIZE, PAGE_SIZE,
+                               ['Founder Name', 'Email', 'Domain', 'Location', 'Status'])
+            database.cache_get("search", f"query-{random.randrange(500)}")
+            if random.random() < WRITE_SHARE:
+                action = random.randrange(3)
+                if action == 0:
+                    database.update_lead(list_id, random.randrange(LEADS), {'Status': 'Ready', 'Subject': 'Hi'})
+                elif action == 1:
+                    database.cache_put("search", f"query-{random.randrange(500)}", json.dumps(["result"] * 20))
+                else:
+                    database.increment_trial(machine_id)
+                    status = None
+        except sqlite3.OperationalError as e:
+            if not is_locked(e):
+                raise
+            errors.append(1)
+        latencies.append(time.perf_counter() - started)
+
+def worker(db_path, legacy, list_id, deadline, results):
+    """A background worker process claiming and finishing jobs until deadline."""
+    database.DB_PATH = db_path
+    if legacy:
+        use_legacy()
+    worker_id = f"worker-{os.getpid()}"
+    finished = locked = 0
+    while time.time() < deadline:
+        try:
+            jobs = database.claim_jobs(worker_id, 4)
+            if not jobs:
+                database.enqueue_jobs("load-test", [(random.randrange(LEADS), {"lead": {}}) for _ in range(50)],
+                                      list_id=list_id)
+                continue
+            for job_id, run_id, lead_index, payload in jobs:
+                database.finish_job(job_id, worker_id, {"Subject": "Hi", "Status": "Ready"})
+                finished += 1
+        except sqlite3.OperationalError as e:
+            if not is_locked(e):
+                raise
+            locked += 1
+    results.put((finished, locked))
+
+def run_mode(mode, sessions, workers, seconds):
+    legacy = mode == "legacy"
+    db_path = os.path.join(tempfile.mkdtemp(prefix=f"leadflow-load-{mode}-"), "leadflow.db")
+    list_id = seed(db_path, legacy)
+
+    # Spawned, not forked, so no worker inherits this process's open connections
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    deadline = time.time() + seconds + 2
+    processes = [context.Process(target=worker, args=(db_path, legacy, list_id, deadline, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    # Let the workers import before timing the sessions
+    time.sleep(2)
+
+    latencies, errors = [], []
+    threads = [threading.Thread(target=session, args=(list_id, legacy, deadline, latencies, errors)) for _ in range(sessions)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    worker_results = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies.sort()
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2) if latencies else None
+    return {
+        "reruns": len(latencies),
+        "reruns_per_s": round(len(latencies) / elapsed, 1),
+        "rerun_p50_ms": pick(0.5),
+        "rerun_p95_ms": pick(0.95),
+        "rerun_max_ms": pick(1.0),
+        "session_locked_errors": len(errors),
+        "worker_jobs_per_s": round(sum(r[0] for r in worker_results) / elapsed, 1),
+        "worker_locked_errors": sum(r[1] for r in worker_results),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test leadflow.db with concurrent sessions and workers")
+    parser.add_argument("--sessions", type=int, default=16, help="Concurrent app sessions (threads)")
+    parser.add_argument("--workers", type=int, default=2, help="Background worker processes")
+    parser.add_argument("--seconds", type=float, default=15, help="Duration per mode")
+    parser.add_argument("--mode", choices=["pooled", "legacy", "both"], default="both")
+    parser.add_argument("--out", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    modes = ["legacy", "pooled"] if args.mode == "both" else [args.mode]
+    report = {}
+    for mode in modes:
+        # Each mode in a fresh interpreter so legacy's patches can't leak into the pooled run
+        if args.mode == "both":
+            out = os.path.join(tempfile.mkdtemp(prefix="leadflow-load-"), f"{mode}.json")
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--mode", mode, "--sessions", str(args.sessions),
+                            "--workers", str(args.workers), "--seconds", str(args.seconds), "--out", out],
+                           check=True, stdout=subprocess.DEVNULL)
+            with open(out) as f:
+                report[mode] = json.load(f)[mode]
+        else:
+            report[mode] = run_mode(mode, args.sessions, args.workers, args.seconds)
+        print(f"[OK] {mode}: {report[mode]['reruns_per_s']} reruns/s, p95 {report[mode]['rerun_p95_ms']} ms, "
+              f"{report[mode]['session_locked_errors'] + report[mode]['worker_locked_errors']} locked errors")
+
+    if len(report) > 1:
+        print(f"\n{'':<24}{'legacy':>12}{'pooled':>12}")
+        for field in report["pooled"]:
+            print(f"{field:<24}{report['legacy'][field]:>12}{report['pooled'][field]:>12}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"sessions": args.sessions, "workers": args.workers, "seconds": args.seconds,
+                       "generated_at": time.time(), **report}, f, indent=2)
+        print(f"[OK] Report written to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Fused vs two-call benchmark.
+Runs the same leads through summarize + copywrite (two LLM calls) and through
+research_and_copy (one call), one lead at a time and alternating paths, then
+reports latency, LLM calls and tokens per lead for each.
+
+    export OPENROUTER_API_KEY="your-key-here"
+    python benchmarks/fused_vs_two_call.py --leads 6 --out fused.json
+
+Search results come from the fixtures below, so only the LLM side is measured.
+Set LEADFLOW_OPENROUTER_URL to benchmark another OpenAI-compatible endpoint.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import metrics
+from clients import get_stage_llm, get_escalation_llm, stage_model
+from research_agent import summarize_results
+from copywriter_agent import generate_email_content
+from fused_agent import research_and_copy
+
+OFFER = "I build AI agents that qualify inbound leads and book meetings automatically."
+
+FIXTURES = [
+    ("Ada Obi", "CEO", "Lagos", "paystackly.com", [
+        "Paystackly raises $12M Series A to expand merchant payments across West Africa",
+        "Paystackly is hiring 20 engineers and a Head of Sales for its new Nairobi office",
+        "Customers complain about slow onboarding and manual KYC reviews on Paystackly",
+    ]),
+    ("Tom Reyes", "Founder", "Austin", "shipgrid.io", [
+        "ShipGrid launches a self-serve freight quoting platform for mid-size retailers",
+        "ShipGrid founder Tom Reyes to speak at the LogiTech Summit on AI in logistics",
+        "ShipGrid migrates from legacy TMS to a new cloud platform after outages",
+    ]),
+    ("Mei Chen", "CTO", "Singapore", "clinicloop.sg", [
+        "ClinicLoop acquires a scheduling startup to add online booking for 300 clinics",
+        "ClinicLoop rebrands and announces a new patient engagement suite",
+        "Reviews mention missed appointment reminders and long support response times",
+    ]),
+    ("Liam Walsh", "Head of Growth", "Dublin", "ledgerly.ie", [
+        "Ledgerly doubles its paid ads budget ahead of the tax season push",
+        "Ledgerly appoints a new CEO from a Big Four firm",
+        "Ledgerly customers churn citing a dated reconciliation workflow",
+    ]),
+    ("Sara Haddad", "COO", "Dubai", "fleetnest.ae", [
+        "FleetNest closes seed funding led by regional logistics investors",
+        "FleetNest expands to Riyadh with a new operations hub",
+        "FleetNest is hiring dispatch coordinators to handle growing order volume",
+    ]),
+    ("Noah Berg", "Founder", "Berlin", "greenshelf.de", [
+        "GreenShelf launches a B2B marketplace for sustainable packaging",
+        "GreenShelf featured on a startup podcast about scaling wholesale sales",
+        "GreenShelf lists open roles for account executives and sales ops",
+    ]),
+]
+
+def fixture_leads(n):
+    leads = []
+    for i in range(n):
+        name, position, location, domain, snippets = FIXTURES[i % len(FIXTURES)]
+        lead = {'Founder Name': name, 'Position': position, 'Location': location, 'Domain': domain,
+                'Email': f"lead{i}@{domain}"}
+        results = [{"source": "fixture", "title": "", "text": text, "url": ""} for text in snippets]
+        leads.append((lead, results))
+    return leads
+
+def llm_usage():
+    """(LLM calls, input tokens, output tokens) recorded since the last metrics reset."""
+    stats = metrics.snapshot("llm.")
+    return (sum(s["calls"] for s in stats.values()),
+            sum(s.get("input_tokens", 0) for s in stats.values()),
+            sum(s.get("output_tokens", 0) for s in stats.values()))
+
+def two_call(lead, results, api_key):
+    lead = dict(lead)
+    llm = get_stage_llm(api_key, "summarize")
+    lead['Enriched Data'] = summarize_results(results, llm, escalate=get_escalation_llm(api_key, llm))
+    generate_email_content(lead, api_key, OFFER)
+
+def fused(lead, results, api_key):
+    research_and_copy(lead, results, api_key, OFFER, force_refresh=True)
+
+def measure(path, lead, results, api_key):
+    metrics.reset("llm.")
+    started = time.perf_counter()
+    path(lead, results, api_key)
+    return (time.perf_counter() - started, *llm_usage())
+
+def summarize_runs(runs):
+    latencies = sorted(r[0] for r in runs)
+    return {
+        "leads": len(runs),
+        "latency_avg_s": round(statistics.mean(latencies), 2),
+        "latency_p50_s": round(latencies[len(latencies) // 2], 2),
+        "latency_p95_s": round(latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))], 2),
+        "llm_calls_per_lead": round(statistics.mean(r[1] for r in runs), 2),
+        "input_tokens_per_lead": round(statistics.mean(r[2] for r in runs)),
+        "output_tokens_per_lead": round(statistics.mean(r[3] for r in runs)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fused research+copy against the two-call path")
+    parser.add_argument("--leads", type=int, default=6, help="Leads per path")
+    parser.add_argument("--out", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise SystemExit("[ERROR] Set OPENROUTER_API_KEY before running the benchmark.")
+
+    # Keep benchmark cache rows out of the real leadflow.db
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="leadflow-bench-"), "leadflow.db")
+    database.init_db()
+
+    runs = {"two_call": [], "fused": []}
+    for i, (lead, results) in enumerate(fixture_leads(args.leads)):
+        # Alternate which path goes first so provider warm-up and drift hit both equally
+        order = [("two_call", two_call), ("fused", fused)]
+        for name, path in (order if i % 2 == 0 else order[::-1]):
+            runs[name].append(measure(path, lead, results, api_key))
+        print(f"[OK] Lead {i + 1}/{args.leads}: two-call {runs['two_call'][-1][0]:.1f}s, fused {runs['fused'][-1][0]:.1f}s")
+
+    report = {name: summarize_runs(r) for name, r in runs.items()}
+    print(f"\n{'':<24}{'two-call':>12}{'fused':>12}")
+    for field in report["fused"]:
+        print(f"{field:<24}{report['two_call'][field]:>12}{report['fused'][field]:>12}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"models": {stage: stage_model(stage) for stage in ("summarize", "copywrite", "fused", "repair", "escalate")},
+                       "generated_at": time.time(), **report}, f, indent=2)
+        print(f"[OK] Report written to {args.out}")
+
+if __name__ == "__main__":
+    main()
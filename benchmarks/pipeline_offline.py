@@ -0,0 +1,305 @@
+"""
+Offline end-to-end benchmark.
+Runs a synthetic lead file through ingestion, research + copywriting and the
+send path with every provider replaced by the local stand-ins in stubs.py,
+so no OpenRouter/Tavily credits are spent and no email leaves the machine.
+Reports leads per minute, p50/p95 latency per stage and peak RSS for each
+list size, and appends the run to a history file keyed by git commit so
+regressions between versions show up.
+
+    python benchmarks/pipeline_offline.py --rows 10 100 1000
+    python benchmarks/pipeline_offline.py --rows 100000 --llm-latency 0.02 --tokens-per-s 5000 --concurrency 32
+    python benchmarks/pipeline_offline.py --path direct --throttle 0.1   # enrich_lead + generate_email_content
+
+Each size runs in a fresh interpreter with its own temporary leadflow.db.
+--path pipeline runs the staged executor the app uses; --path direct calls
+enrich_lead and generate_email_content per lead on a thread pool. Emails are
+sent unpaced, i.e. in Gmail batches under a daily limit as large as the list.
+Every provider's rate limit is raised to --provider-rate unless its
+LEADFLOW_RATE_<PROVIDER> is already set, so the stand-ins' latency is what
+bounds throughput. A run is compared with the last one in --history that used
+the same settings; --max-regression makes a drop in leads/minute fail it.
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import stubs
+
+OFFER = "I build AI agents that qualify inbound leads and book meetings automatically."
+PROVIDERS = ["OPENROUTER", "TAVILY", "DUCKDUCKGO", "RSS", "GMAIL"]
+DEFAULT_HISTORY = os.path.join(BENCH_DIR, "results", "pipeline_offline.jsonl")
+# Settings that must match for two runs to be compared
+COMPARED_SETTINGS = ["path", "fused", "concurrency", "leads_per_domain", "llm_latency", "tokens_per_s", "throttle",
+                     "retry_after", "search_latency", "send_latency", "provider_rate"]
+
+def write_leads(path, rows, leads_per_domain):
+    """A CSV of rows unique leads, leads_per_domain of them at each company."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["First Name", "Last Name", "Email", "Website", "Job Title", "City"])
+        for i in range(rows):
+            company = f"company{i // leads_per_domain}.io"
+            writer.writerow([f"Lead{i}", "Bench", f"lead{i}@{company}", f"https://www.{company}/", "Founder", "Lagos"])
+
+def percentiles(samples):
+    if not samples:
+        return {"p50": None, "p95": None}
+    ordered = sorted(samples)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * (len(ordered) - 1)))], 3)
+    return {"p50": pick(0.5), "p95": pick(0.95)}
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where the resource module is missing)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def timed(name, fn, samples):
+    def stage(payload):
+        started = time.perf_counter()
+        try:
+            return fn(payload)
+        finally:
+            samples.setdefault(name, []).append(time.perf_counter() - started)
+    return stage
+
+def generate(list_id, args, samples):
+    """Research + copy for every lead in the list; returns (leads written Ready, failed leads)."""
+    import concurrent.futures as cf
+    from database import update_lead
+    from ingest import iter_leads
+    from pipeline import run_pipeline, personalization_stages, Stage
+
+    api_key = os.environ["OPENROUTER_API_KEY"]
+    tavily_key = os.environ["TAVILY_API_KEY"]
+    ready = failed = 0
+
+    if args.path == "pipeline":
+        concurrency = {"search": args.concurrency, "summarize": args.concurrency, "copywrite": args.concurrency}
+        stages = [Stage(stage.name, timed(stage.name, stage.fn, samples), stage.workers)
+                  for stage in personalization_stages(api_key, tavily_key, OFFER, concurrency, fused=args.fused)]
+        results = run_pipeline(iter_leads(list_id), stages)
+    else:
+        from research_agent import enrich_lead
+        from copywriter_agent import generate_email_content
+
+        def enrich(lead):
+            lead['Enriched Data'] = enrich_lead(lead, api_key, tavily_key)
+            return lead
+
+        def copywrite(lead):
+            subject, opener, body, closing = generate_email_content(lead, api_key, OFFER)
+            lead.update({'Subject': subject, 'Opener': opener, 'Body': body, 'Closing': closing, 'Status': 'Ready'})
+            return lead
+
+        enrich, copywrite = timed("enrich", enrich, samples), timed("copywrite", copywrite, samples)
+        pool = cf.ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="leadflow-bench")
+
+        def run_one(item):
+            index, lead = item
+            try:
+                return index, copywrite(enrich(lead)), None
+            except Exception as e:
+                return index, lead, e
+        results = pool.map(run_one, iter_leads(list_id))
+
+    for index, lead, error in results:
+        if error is None:
+            update_lead(list_id, index, {'Enriched Data': lead.get('Enriched Data', ''), 'Subject': lead['Subject'],
+                                         'Opener': lead['Opener'], 'Body': lead['Body'],
+                                         'Closing': lead['Closing'], 'Status': 'Ready'})
+            ready += 1
+        else:
+            update_lead(list_id, index, {'Enriched Data': lead.get('Enriched Data', ''), 'Status': f"Error: {error}"})
+            failed += 1
+    return ready, failed
+
+def send(list_id, rows):
+    """Schedules every Ready lead unpaced and dispatches until the outbox is drained; returns emails sent."""
+    from google.oauth2.credentials import Credentials
+
+    import dispatcher
+    from database import set_setting, outbox_status
+    from gmail_service import build_service
+    from ingest import iter_leads
+
+    set_setting('daily_send_limit', rows)
+    campaign_id = "offline-benchmark"
+    dispatcher.schedule_campaign(campaign_id, "LeadFlow Bench <bench@example.com>", iter_leads(list_id, status='Ready'),
+                                 paced=False, list_id=list_id)
+    # A token the stand-in accepts; with no expiry it is never refreshed
+    service = build_service(Credentials(token="offline-benchmark"))
+    while outbox_status(campaign_id).get('scheduled'):
+        dispatcher.dispatch_once("offline-benchmark", service)
+    return outbox_status(campaign_id).get('sent', 0)
+
+def run_size(rows, args):
+    """Runs in the child interpreter (cwd is a fresh temporary directory)."""
+    import database
+    import metrics
+    from ingest import ingest_file
+
+    started = time.perf_counter()
+    database.init_db()
+    write_leads("leads.csv", rows, args.leads_per_domain)
+    with open("leads.csv", "rb") as f:
+        list_id, total, dropped = ingest_file(f, "leads.csv")
+    ingest_s = time.perf_counter() - started
+
+    samples = {}
+    started = time.perf_counter()
+    ready, failed = generate(list_id, args, samples)
+    generate_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    sent = send(list_id, rows)
+    send_s = time.perf_counter() - started
+
+    stats = metrics.snapshot()
+    stages = {name: percentiles(values) for name, values in samples.items()}
+    stages["send"] = {"p50": stats.get("send.gmail", {}).get("p50"), "p95": stats.get("send.gmail", {}).get("p95")}
+    llm = {name[len("llm."):]: {"calls": s["calls"], "p50": s["p50"], "p95": s["p95"]}
+           for name, s in stats.items() if name.startswith("llm.") and s["calls"]}
+    total_s = ingest_s + generate_s + send_s
+    return {
+        "leads": total,
+        "ready": ready,
+        "failed": failed,
+        "sent": sent,
+        "ingest_s": round(ingest_s, 3),
+        "generate_s": round(generate_s, 3),
+        "send_s": round(send_s, 3),
+        "generate_leads_per_min": round(ready / generate_s * 60, 1) if generate_s else None,
+        "send_leads_per_min": round(sent / send_s * 60, 1) if send_s else None,
+        "leads_per_min": round(sent / total_s * 60, 1) if total_s else None,
+        "stages": stages,
+        "llm": llm,
+        "llm_throttled": stats.get("ratelimit.openrouter", {}).get("throttled", 0),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_child(rows, args, env):
+    workdir = tempfile.mkdtemp(prefix=f"leadflow-offline-{rows}-")
+    out = os.path.join(workdir, "result.json")
+    command = [sys.executable, os.path.abspath(__file__), "--child", str(rows), "--child-out", out, "--path", args.path,
+               "--concurrency", str(args.concurrency), "--leads-per-domain", str(args.leads_per_domain)]
+    if args.fused:
+        command.append("--fused")
+    subprocess.run(command, cwd=workdir, env=env, check=True)
+    with open(out) as f:
+        return json.load(f)
+
+def git_version():
+    """Short commit of the tree being measured, marked -dirty when it has uncommitted changes."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True,
+                               text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def previous_run(history, settings):
+    """The last run in the history file made with the same settings, or None."""
+    if not os.path.exists(history):
+        return None
+    last = None
+    with open(history) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if all(entry["settings"].get(key) == settings[key] for key in COMPARED_SETTINGS):
+                last = entry
+    return last
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest -> research -> copy -> send against local stand-ins")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000], help="Lead list sizes to run")
+    parser.add_argument("--path", choices=["pipeline", "direct"], default="pipeline")
+    parser.add_argument("--fused", action="store_true", help="Research + copy in one LLM call (pipeline path)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Workers per stage (pipeline) or in total (direct)")
+    parser.add_argument("--leads-per-domain", type=int, default=3, help="Leads sharing each company")
+    parser.add_argument("--provider-rate", default="1000:1000", help="LEADFLOW_RATE_<PROVIDER> for every provider")
+    stubs.add_arguments(parser)
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON-lines file every run is appended to")
+    parser.add_argument("--max-regression", type=float,
+                        help="Fail if leads/min drops by more than this share (e.g. 0.15) against the previous run")
+    parser.add_argument("--out", help="Also write this run's report as JSON to this file")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--child-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_size(args.child, args)
+        with open(args.child_out, "w") as f:
+            json.dump(result, f)
+        return
+
+    server = stubs.serve(stubs.config_from(args, seed=0))
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    env = {**os.environ, **stubs.env(base_url)}
+    for provider in PROVIDERS:
+        env.setdefault(f"LEADFLOW_RATE_{provider}", args.provider_rate)
+
+    settings = {key: getattr(args, key) for key in COMPARED_SETTINGS}
+    previous = previous_run(args.history, settings)
+    results = {}
+    for rows in args.rows:
+        result = results[str(rows)] = run_child(rows, args, env)
+        stages = ", ".join(f"{name} {s['p50']}/{s['p95']}s" for name, s in result["stages"].items())
+        print(f"[OK] {rows} rows: {result['leads_per_min']} leads/min end to end "
+              f"(generate {result['generate_leads_per_min']}, send {result['send_leads_per_min']}), "
+              f"{result['failed']} failed, peak RSS {result['peak_rss_mb']} MB | p50/p95: {stages}")
+
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        requests = json.load(response)
+    server.shutdown()
+
+    entry = {"version": git_version(), "generated_at": time.time(), "settings": settings, "stub_requests": requests,
+             "results": results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    print(f"[OK] Run {entry['version']} appended to {args.history}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(entry, f, indent=2)
+        print(f"[OK] Report written to {args.out}")
+
+    if previous is None:
+        return
+    regressions = []
+    print(f"\nAgainst {previous['version']}:")
+    for rows, result in results.items():
+        before = previous["results"].get(rows)
+        if not before or not before["leads_per_min"]:
+            continue
+        change = result["leads_per_min"] / before["leads_per_min"] - 1
+        p95 = ", ".join(f"{name} {before['stages'][name]['p95']} -> {s['p95']}s"
+                        for name, s in result["stages"].items() if name in before["stages"])
+        print(f"  {rows} rows: {before['leads_per_min']} -> {result['leads_per_min']} leads/min ({change:+.1%}), "
+              f"peak RSS {before['peak_rss_mb']} -> {result['peak_rss_mb']} MB | p95: {p95}")
+        if args.max_regression is not None and change < -args.max_regression:
+            regressions.append(rows)
+    if regressions:
+        raise SystemExit(f"[ERROR] leads/min regressed by more than {args.max_regression:.0%} at {', '.join(regressions)} rows")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Access code redemption race.
+Mints a batch of codes, then has many machines (threads spread over several
+processes) try to redeem every code at the same moment. Each code must be
+redeemed exactly once, by the machine recorded in used_by, and every winner
+must be Pro. Exits non-zero if any code is redeemed twice or not at all.
+
+    python benchmarks/redeem_race.py --codes 200 --processes 4 --threads 8
+    python benchmarks/redeem_race.py --legacy   # the old SELECT-then-UPDATE, for comparison
+
+Runs against a temporary database.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+def legacy_validate(machine_id, code):
+    """validate_access_code as it was: check, then claim, in separate statements."""
+    with database.connect() as conn:
+        res = conn.execute("SELECT is_used FROM access_codes WHERE code = ?", (code,)).fetchone()
+        if res and res[0] == 0:
+            conn.execute("UPDATE access_codes SET is_used = 1, used_by = ?, used_at = ? WHERE code = ?",
+                         (machine_id, time.time(), code))
+            conn.execute("UPDATE users SET is_pro = 1 WHERE machine_id = ?", (machine_id,))
+            return True
+    return False
+
+def contender(db_path, codes, process_index, threads, start_at, legacy, results):
+    """One process of machines; each thread tries every code, all starting at start_at."""
+    database.DB_PATH = db_path
+    validate = legacy_validate if legacy else database.validate_access_code
+    wins = []
+
+    def machine(thread_index):
+        machine_id = f"machine-{process_index}-{thread_index}"
+        database.check_user_status(machine_id)
+        time.sleep(max(0.0, start_at - time.time()))
+        for code in codes:
+            if validate(machine_id, code):
+                wins.append((code, machine_id))
+
+    workers = [threading.Thread(target=machine, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put(wins)
+
+def main():
+    parser = argparse.ArgumentParser(description="Redeem the same access codes from many machines at once")
+    parser.add_argument("--codes", type=int, default=200)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8, help="Machines per process")
+    parser.add_argument("--legacy", action="store_true", help="Use the old select-then-update redemption")
+    args = parser.parse_args()
+
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="leadflow-redeem-"), "leadflow.db")
+    database.init_db()
+    codes = database.mint_access_codes(args.codes, "race")
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    start_at = time.time() + 3
+    processes = [context.Process(target=contender, args=(database.DB_PATH, codes, i, args.threads, start_at, args.legacy, results))
+                 for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    wins = [win for _ in processes for win in results.get()]
+    for process in processes:
+        process.join()
+
+    winners = {}
+    for code, machine_id in wins:
+        winners.setdefault(code, []).append(machine_id)
+    doubled = {code: machines for code, machines in winners.items() if len(machines) > 1}
+    missing = [code for code in codes if code not in winners]
+
+    with database.connect() as conn:
+        recorded = dict(conn.execute("SELECT code, used_by FROM access_codes WHERE description = 'race' AND is_used = 1"))
+        pro = {machine_id for (machine_id,) in conn.execute("SELECT machine_id FROM users WHERE is_pro = 1")}
+    mismatched = [code for code, machines in winners.items() if len(machines) == 1 and recorded.get(code) != machines[0]]
+    not_pro = {machines[0] for machines in winners.values()} - pro
+
+    print(f"{args.processes * args.threads} machines x {args.codes} codes: {len(wins)} successful redemptions")
+    print(f"codes redeemed more than once: {len(doubled)} | never redeemed: {len(missing)} | "
+          f"used_by mismatches: {len(mismatched)} | winners without Pro: {len(not_pro)}")
+    if doubled or missing or mismatched or not_pro:
+        raise SystemExit("[ERROR] Redemption is not atomic")
+    print("[OK] Every code was redeemed exactly once, by the machine recorded in used_by")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Local stand-ins for the providers LeadFlow talks to, for offline benchmarks.
+One HTTP server answers as:
+  OpenRouter  POST /v1/chat/completions (plain and streamed), with a fixed
+              latency, an output token rate and a share of requests answered 429
+  Tavily      POST /search
+  DuckDuckGo  GET  /ddg?q=...               (LEADFLOW_DDG_URL)
+  RSS         GET  /feed/<domain>           (LEADFLOW_RSS_URL)
+  Gmail       POST /gmail/v1/users/me/messages/send and /batch/gmail/v1
+and GET /stats returns request counts per route.
+
+    python benchmarks/stubs.py --port 18777 --llm-latency 0.3 --tokens-per-s 80 --throttle 0.05
+
+then point the app at it with the variables from env(), e.g.
+LEADFLOW_OPENROUTER_URL=http://127.0.0.1:18777/v1. Replies are canned, but
+each search result mentions its query, so research for different companies
+never shares a cache entry.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+EMAIL = {
+    "subject": "Quick question on your expansion",
+    "opener": "Hi there, congrats on the recent launch.",
+    "body": "We help teams like yours qualify inbound leads without adding headcount.",
+    "closing": "Would it be worth a short call next week to see if this fits?\n\nBest,",
+}
+SUMMARY = {
+    "reliability_score": "8",
+    "score_reason": "Recent funding and hiring",
+    "trigger": "Series A announced last month",
+    "pain": "Onboarding load on a small team",
+    "signal": "Hiring sales and support roles",
+}
+SUMMARY_TEXT = "\n".join(f"{field.upper()}: {value}" for field, value in SUMMARY.items())
+
+class StubConfig:
+    def __init__(self, llm_latency=0.3, tokens_per_s=80.0, throttle=0.0, retry_after=1.0,
+                 search_latency=0.2, send_latency=0.05, seed=None):
+        self.llm_latency = llm_latency
+        self.tokens_per_s = tokens_per_s
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.search_latency = search_latency
+        self.send_latency = send_latency
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, route, outcome="ok"):
+        with self.lock:
+            self.counts[f"{route}.{outcome}"] += 1
+
+    def throttled(self):
+        with self.lock:
+            return self.random.random() < self.throttle
+
+def llm_reply(prompt):
+    """Canned reply in the format the prompt asks for."""
+    batch = re.search(r"search results for (\d+) separate leads", prompt)
+    if batch:
+        return "\n".join(f"### LEAD {i}\n{SUMMARY_TEXT}\n" for i in range(1, int(batch.group(1)) + 1))
+    keys = re.search(r"containing exactly these keys: (\[.*?\])", prompt)
+    if keys:
+        return json.dumps({key: {**SUMMARY, **EMAIL}.get(key, "") for key in json.loads(keys.group(1))})
+    if '"reliability_score"' in prompt:
+        return json.dumps({**SUMMARY, **EMAIL})
+    if "JSON object" in prompt:
+        return json.dumps(EMAIL)
+    if "[SUBJECT]" in prompt:
+        return f"[SUBJECT]: {EMAIL['subject']}\n[MESSAGE]: {EMAIL['opener']}\n\n{EMAIL['body']}\n\n{EMAIL['closing']}"
+    return SUMMARY_TEXT
+
+def tokens(text):
+    return max(1, len(text) // 4)
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    config = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/stats":
+            with self.config.lock:
+                return self._send(200, dict(self.config.counts))
+        if url.path == "/ddg":
+            query = parse_qs(url.query).get("q", [""])[0]
+            time.sleep(self.config.search_latency)
+            self.config.count("ddg")
+            return self._send(200, [{"title": f"{query} - result {i}", "body": f"News about {query}: launch and hiring.",
+                                     "href": f"https://example.com/ddg/{i}"} for i in range(5)])
+        if url.path.startswith("/feed/"):
+            domain = url.path[len("/feed/"):]
+            time.sleep(self.config.search_latency)
+            self.config.count("rss")
+            items = "".join(f"<item><title>{domain} update {i}</title><link>https://{domain}/blog/{i}</link>"
+                            f"<description>{domain} shipped a new release.</description></item>" for i in range(3))
+            return self._send(200, f'<?xml version="1.0"?><rss version="2.0"><channel><title>{domain}</title>'
+                                   f'{items}</channel></rss>'.encode(), "application/rss+xml")
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path.endswith("/chat/completions"):
+            return self._chat(json.loads(self._body()))
+        if path == "/search":
+            query = json.loads(self._body()).get("query", "")
+            time.sleep(self.config.search_latency)
+            self.config.count("tavily")
+            return self._send(200, {"query": query, "results": [
+                {"title": f"{query} - story {i}", "url": f"https://example.com/tavily/{i}",
+                 "content": f"{query}: the company announced funding and is hiring.", "score": 0.9 - i / 10}
+                for i in range(3)]})
+        if path.endswith("/messages/send"):
+            self._body()
+            time.sleep(self.config.send_latency)
+            self.config.count("gmail")
+            return self._send(200, {"id": uuid.uuid4().hex[:16], "threadId": uuid.uuid4().hex[:16], "labelIds": ["SENT"]})
+        if path.endswith("/batch/gmail/v1"):
+            return self._batch(self._body())
+        self._send(404, {"error": "not found"})
+
+    def _chat(self, request):
+        if self.config.throttled():
+            self.config.count("llm", "throttled")
+            return self._send(429, {"error": {"message": "Rate limit exceeded", "code": 429}},
+                              headers={"Retry-After": str(self.config.retry_after)})
+        prompt = request["messages"][-1]["content"]
+        text = llm_reply(prompt)
+        usage = {"prompt_tokens": tokens(prompt), "completion_tokens": tokens(text),
+                 "total_tokens": tokens(prompt) + tokens(text)}
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": request["model"]}
+        self.config.count("llm")
+        time.sleep(self.config.llm_latency)
+
+        if not request.get("stream"):
+            time.sleep(usage["completion_tokens"] / self.config.tokens_per_s)
+            return self._send(200, {**base, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(payload):
+            data = f"data: {payload}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+        # Roughly one token (four characters) per chunk, at the configured rate; like
+        # OpenAI, the first delta also carries the role
+        pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+        for i, piece in enumerate(pieces):
+            time.sleep(1 / self.config.tokens_per_s)
+            delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+            event(json.dumps({**base, "object": "chat.completion.chunk", "choices": [
+                {"index": 0, "delta": delta, "finish_reason": None}]}))
+        event(json.dumps({**base, "object": "chat.completion.chunk", "choices": [
+            {"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        event(json.dumps({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}))
+        event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _batch(self, body):
+        # One send per part; answers each under its own Content-ID, as Gmail's batch endpoint does
+        content_ids = re.findall(rb"Content-ID: <([^>]+)>", body, re.I)
+        time.sleep(self.config.send_latency)
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for content_id in content_ids:
+            self.config.count("gmail")
+            payload = json.dumps({"id": uuid.uuid4().hex[:16], "threadId": uuid.uuid4().hex[:16], "labelIds": ["SENT"]})
+            parts.append(f"--{boundary}\r\nContent-Type: application/http\r\n"
+                         f"Content-ID: <response-{content_id.decode()}>\r\n\r\n"
+                         f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{payload}\r\n")
+        self.config.count("gmail_batch")
+        self._send(200, ("".join(parts) + f"--{boundary}--\r\n").encode(), f"multipart/mixed; boundary={boundary}")
+
+def serve(config, host="127.0.0.1", port=0):
+    """Starts the stand-ins on a daemon thread; returns the server (its port is server.server_port)."""
+    handler = type("Handler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="leadflow-stubs").start()
+    return server
+
+def env(base_url):
+    """Environment variables pointing every provider at the stand-ins at base_url."""
+    return {
+        "LEADFLOW_OPENROUTER_URL": f"{base_url}/v1",
+        "LEADFLOW_TAVILY_URL": base_url,
+        "LEADFLOW_DDG_URL": f"{base_url}/ddg",
+        "LEADFLOW_RSS_URL": f"{base_url}/feed/{{domain}}",
+        "LEADFLOW_GMAIL_API_URL": f"{base_url}/",
+        "OPENROUTER_API_KEY": "offline-benchmark",
+        "TAVILY_API_KEY": "offline-benchmark",
+    }
+
+def add_arguments(parser):
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-s", type=float, default=80.0, help="Output tokens per second after that")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Share of LLM requests answered 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on those 429s")
+    parser.add_argument("--search-latency", type=float, default=0.2, help="Seconds per Tavily/DuckDuckGo/RSS request")
+    parser.add_argument("--send-latency", type=float, default=0.05, help="Seconds per Gmail send or batch request")
+
+def config_from(args, seed=None):
+    return StubConfig(args.llm_latency, args.tokens_per_s, args.throttle, args.retry_after,
+                      args.search_latency, args.send_latency, seed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve local OpenRouter/Tavily/DuckDuckGo/RSS/Gmail stand-ins")
+    parser.add_argument("--port", type=int, default=18777)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(config_from(args), port=args.port)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    print(f"[OK] Stand-ins listening on {base_url}")
+    for name, value in env(base_url).items():
+        print(f"export {name}=\"{value}\"")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Persistent stage checkpoints for the personalization pipeline.
+LangGraph's SqliteSaver keeps them in leadflow.db, so a lead whose summarize
+call failed resumes after its search on the next run, across Streamlit reruns
+and process restarts. A thread is deleted once its stage is committed: finished
+summaries and emails live on in the content-addressed research_cache instead.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+
+from database import DB_PATH
+
+_saver = None
+_lock = threading.RLock()
+
+def get_checkpointer():
+    """Process-wide SqliteSaver on leadflow.db (its connection is shared across threads)."""
+    # LangGraph loads with the first checkpoint rather than with the app
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    global _saver
+    with _lock:
+        if _saver is None:
+            _saver = SqliteSaver(sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30))
+        return _saver
+
+def thread_config(kind, *parts):
+    """LangGraph config for the checkpoint thread identified by kind and the given key parts."""
+    digest = hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:24]
+    return {"configurable": {"thread_id": f"{kind}:{digest}"}}
+
+def load_stage(graph, config):
+    """Returns (values, next_nodes) of the thread's latest checkpoint; ({}, ()) if it has none."""
+    snapshot = graph.get_state(config)
+    return snapshot.values or {}, tuple(snapshot.next)
+
+def save_stage(graph, config, values, as_node):
+    """Records values as the output of as_node, so the thread resumes after that node."""
+    graph.update_state(config, values, as_node=as_node)
+
+def clear_stage(config):
+    """Deletes the thread's checkpoints and pending writes."""
+    get_checkpointer().delete_thread(config["configurable"]["thread_id"])
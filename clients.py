@@ -0,0 +1,226 @@
+"""
+Process-wide registry for LLM clients, search tools and compiled graphs.
+Each object is built once per (kind, API key, model) and shared by every
+lead, so HTTP connection pools stay warm for the whole run.
+"""
+import os
+import hashlib
+import threading
+import time
+
+import httpx
+
+import metrics
+import ratelimit
+import tracing
+from compaction import estimate_tokens
+
+# Any OpenAI-compatible endpoint works here (e.g. a local stand-in for benchmarks)
+OPENROUTER_BASE_URL = os.getenv("LEADFLOW_OPENROUTER_URL", "https://openrouter.ai/api/v1")
+TAVILY_API_URL = os.getenv("LEADFLOW_TAVILY_URL", "https://api.tavily.com")
+DEFAULT_MODEL = "meta-llama/llama-3.1-405b-instruct"
+
+# Model tiers, smallest first
+MODEL_TIERS = {
+    "small": "meta-llama/llama-3.1-8b-instruct",
+    "medium": "meta-llama/llama-3.1-70b-instruct",
+    "large": DEFAULT_MODEL,
+}
+
+# Model per LLM stage; override with LEADFLOW_MODEL_<STAGE> (a tier name or an OpenRouter model id).
+# "repair" re-requests fields that failed validation; "escalate" is the model a
+# failed summary or repair is retried on ("" turns escalation off).
+STAGE_MODELS = {
+    "summarize": "medium",
+    "copywrite": "large",
+    "fused": "large",
+    "repair": "medium",
+    "escalate": "large",
+}
+
+# USD per million (input, output) tokens, from openrouter.ai/models; used for the cost columns only
+MODEL_PRICES = {
+    "meta-llama/llama-3.1-405b-instruct": (0.80, 0.80),
+    "meta-llama/llama-3.1-70b-instruct": (0.10, 0.28),
+    "meta-llama/llama-3.1-8b-instruct": (0.02, 0.03),
+}
+
+# Context windows (tokens) used to size multi-lead requests
+MODEL_CONTEXT_TOKENS = {
+    "meta-llama/llama-3.1-405b-instruct": 131072,
+    "meta-llama/llama-3.1-70b-instruct": 131072,
+    "meta-llama/llama-3.1-8b-instruct": 131072,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+
+_registry = {}
+_lock = threading.RLock()
+
+def key_fingerprint(secret):
+    """Registry keys hold a digest of the API key, never the key itself."""
+    return hashlib.sha256((secret or "").encode()).hexdigest()[:16]
+
+def get_or_create(kind, key, factory):
+    """
+    Returns the cached object for (kind, key), building it with factory() on first use.
+    """
+    entry = (kind, key)
+    obj = _registry.get(entry)
+    if obj is None:
+        with _lock:
+            obj = _registry.get(entry)
+            if obj is None:
+                obj = factory()
+                _registry[entry] = obj
+    return obj
+
+def get_http_client():
+    """Shared keep-alive HTTP client for every OpenRouter-backed model."""
+    return get_or_create("http", "openrouter", lambda: httpx.Client(
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=120),
+        timeout=httpx.Timeout(120.0, connect=10.0),
+    ))
+
+def get_llm(openrouter_api_key, model=DEFAULT_MODEL):
+    """
+    Returns the shared ChatOpenAI client for this OpenRouter key and model.
+    """
+    # LangChain takes seconds to import, so it loads with the first client rather than with the app
+    from langchain_openai import ChatOpenAI
+
+    return get_or_create("llm", (key_fingerprint(openrouter_api_key), model), lambda: ChatOpenAI(
+        model=model,
+        openai_api_key=openrouter_api_key,
+        openai_api_base=OPENROUTER_BASE_URL,
+        http_client=get_http_client(),
+        # Retries and backoff happen in ratelimit.call, shared by every OpenRouter caller
+        max_retries=0,
+        # Report token usage on streamed replies too
+        stream_usage=True,
+        default_headers={
+            "HTTP-Referer": "https://leadflow-ai.streamlit.app", # Optional, but good practice
+            "X-Title": "LeadFlow AI"
+        }
+    ))
+
+def stage_model(stage, models=None):
+    """
+    Model id for an LLM stage: models[stage] if given (e.g. from Pipeline
+    Settings), else LEADFLOW_MODEL_<STAGE>, else STAGE_MODELS. Tier names resolve
+    through MODEL_TIERS.
+    """
+    model = (models or {}).get(stage)
+    if model is None:
+        model = os.getenv(f"LEADFLOW_MODEL_{stage.upper()}", STAGE_MODELS.get(stage, DEFAULT_MODEL))
+    return MODEL_TIERS.get(model, model)
+
+def get_stage_llm(openrouter_api_key, stage, models=None):
+    """Returns the shared ChatOpenAI client routed to this stage."""
+    return get_llm(openrouter_api_key, stage_model(stage, models))
+
+def get_escalation_llm(openrouter_api_key, llm, models=None):
+    """
+    Client to retry on when llm's output fails validation, or None when
+    escalation is off or llm already is the escalation model.
+    """
+    model = stage_model("escalate", models)
+    return get_llm(openrouter_api_key, model) if model and model != llm.model_name else None
+
+def get_tavily_tool(tavily_api_key):
+    """
+    Returns the shared Tavily search tool for this key.
+    The key is handed to the API wrapper directly instead of via os.environ.
+    """
+    from langchain_community.tools import TavilySearchResults
+    from langchain_community.utilities import tavily_search
+    from langchain_community.utilities.tavily_search import TavilySearchAPIWrapper
+
+    # The wrapper reads its endpoint from this module global on every call
+    tavily_search.TAVILY_API_URL = TAVILY_API_URL
+
+    return get_or_create("tavily", key_fingerprint(tavily_api_key), lambda: TavilySearchResults(
+        max_results=3,
+        api_wrapper=TavilySearchAPIWrapper(tavily_api_key=tavily_api_key),
+    ))
+
+def json_schema_format(name, fields):
+    """response_format for a reply that must be one JSON object with exactly these string fields."""
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": {
+        "type": "object", "properties": {field: {"type": "string"} for field in fields},
+        "required": list(fields), "additionalProperties": False}}}
+
+def complete(llm, prompt, stage, on_token=None, response_format=None):
+    """
+    Sends one prompt and returns the reply text.
+    With on_token, the reply is streamed and on_token(text_so_far) runs for
+    every chunk. response_format (e.g. json_schema_format(...)) is passed to
+    the API so the provider enforces the reply's structure. Latency goes to "llm.<stage>"; streamed calls also record
+    "llm.<stage>.ttft" (seconds to first token) and "llm.<stage>.tokens_per_s".
+    Token usage is added to the "input_tokens"/"output_tokens" counters of
+    "llm.<stage>" (estimated when the provider does not report it).
+    The same latency, tokens and "cost_usd" also go to "model.<stage>@<model>"
+    so routing tiers can be compared per stage. For a traced lead, the call is
+    also recorded as an "llm.<stage>" span with its token counts.
+    """
+    from langchain_core.messages import HumanMessage
+
+    messages = [HumanMessage(content=prompt)]
+    runner = llm.bind(response_format=response_format) if response_format else llm
+    started_at, started = time.time(), time.perf_counter()
+
+    def attempt():
+        if on_token is None:
+            reply = runner.invoke(messages)
+            return reply.content, None, 0, reply.usage_metadata
+        # A retried stream starts over, and on_token sees the new text from its first chunk
+        attempt_started = time.perf_counter()
+        first_token, parts, usage = None, [], None
+        for chunk in runner.stream(messages):
+            usage = chunk.usage_metadata or usage
+            if not chunk.content:
+                continue
+            if first_token is None:
+                first_token = time.perf_counter() - attempt_started
+            parts.append(chunk.content)
+            on_token("".join(parts))
+        return "".join(parts), first_token, len(parts), usage
+
+    try:
+        text, first_token, chunks, usage = ratelimit.call("openrouter", attempt)
+    except Exception:
+        metrics.record(f"llm.{stage}", time.perf_counter() - started, "error")
+        metrics.record(f"model.{stage}@{llm.model_name}", time.perf_counter() - started, "error")
+        tracing.span(f"llm.{stage}", started_at, time.perf_counter() - started, "error")
+        raise
+
+    elapsed = time.perf_counter() - started
+    input_tokens = (usage or {}).get("input_tokens") or estimate_tokens(prompt)
+    output_tokens = (usage or {}).get("output_tokens") or estimate_tokens(text)
+    for name in (f"llm.{stage}", f"model.{stage}@{llm.model_name}"):
+        metrics.record(name, elapsed, "ok")
+        metrics.add(name, "input_tokens", input_tokens)
+        metrics.add(name, "output_tokens", output_tokens)
+    tracing.span(f"llm.{stage}", started_at, elapsed, "ok", input_tokens, output_tokens)
+    price = MODEL_PRICES.get(llm.model_name)
+    if price:
+        metrics.add(f"model.{stage}@{llm.model_name}", "cost_usd",
+                    (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000)
+    if first_token is not None:
+        metrics.observe(f"llm.{stage}.ttft", first_token)
+        # One streamed chunk is roughly one token on OpenAI-compatible APIs
+        metrics.observe(f"llm.{stage}.tokens_per_s", chunks / max(elapsed - first_token, 1e-6))
+    return text
+
+def preload():
+    """Imports the LangChain client libraries now instead of on the first LLM or Tavily call."""
+    import langchain_openai
+    import langchain_community.tools
+    import langchain_community.utilities.tavily_search
+
+def clear_registry():
+    """Drops every cached client (e.g. after rotating API keys)."""
+    with _lock:
+        client = _registry.get(("http", "openrouter"))
+        _registry.clear()
+    if client is not None:
+        client.close()
@@ -0,0 +1,110 @@
+"""
+Compaction of raw search results before summarization.
+Dedups overlapping snippets across providers, strips noise (URLs, markup,
+provider error strings), ranks what is left by how strongly it hints at a
+H.E.A.T. trigger and fits it into a token budget.
+"""
+import os
+import re
+
+import metrics
+
+# Upper bound on search-result tokens pasted into one lead's summarize prompt
+COMPACT_BUDGET_TOKENS = int(os.getenv("LEADFLOW_COMPACT_TOKENS", "900"))
+
+# Snippets sharing at least this fraction of their words are treated as duplicates
+DUPLICATE_OVERLAP = 0.7
+
+# Keywords per trigger category from the summarize prompt (Growth / Problem / Change / Budget)
+TRIGGER_KEYWORDS = {
+    "growth": ("funding", "raised", "raises", "series", "seed", "investment", "hiring", "hires", "hired",
+               "expansion", "expands", "new office", "launch", "launches", "launched", "growth", "acquired",
+               "acquisition", "partnership", "revenue"),
+    "problem": ("review", "complaint", "outage", "layoff", "layoffs", "departure", "resigns", "steps down",
+                "lawsuit", "breach", "delay", "struggle", "decline", "legacy", "outdated", "churn"),
+    "change": ("rebrand", "rebrands", "new platform", "migration", "migrating", "migrated", "appointed", "joins as", "new ceo", "new cto",
+               "keynote", "speaker", "speaking", "conference", "summit", "podcast", "announces"),
+    "budget": ("ads", "advertising", "valuation", "profit", "budget", "pricing", "enterprise", "customers"),
+}
+
+_URL = re.compile(r"https?://\S+|www\.\S+")
+_TAG = re.compile(r"<[^>]+>")
+_SPACE = re.compile(r"\s+")
+_WORD = re.compile(r"[a-z0-9]+")
+_NOISE = re.compile(r"(Tavily|DuckDuckGo) Search Failed:.*|--- .*? ---")
+# Whole-word matches only, so "ads" does not count inside "leads"
+_TRIGGERS = [re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")\b")
+             for keywords in TRIGGER_KEYWORDS.values()]
+
+def estimate_tokens(text: str):
+    """Cheap token estimate (~4 characters per token) used for budget checks."""
+    return len(text) // 4 + 1
+
+def _clean(text):
+    text = _TAG.sub(" ", str(text or ""))
+    text = _URL.sub("", text)
+    return _SPACE.sub(" ", text).strip(" -|·")
+
+def _snippets(results):
+    """Normalizes provider output (snippet dicts, or legacy strings from older cache rows) into snippets."""
+    for item in results:
+        if isinstance(item, dict):
+            if "error" in item:
+                continue
+            text = _clean(item.get("text", ""))
+            title = _clean(item.get("title", ""))
+            if title and title.lower() not in text.lower():
+                text = f"{title}: {text}" if text else title
+            if text:
+                yield item.get("source", ""), text
+        else:
+            text = _clean(_NOISE.sub(" ", str(item)))
+            if text:
+                yield "search", text
+
+def _score(text):
+    lowered = text.lower()
+    categories = [len(pattern.findall(lowered)) for pattern in _TRIGGERS]
+    # Reward breadth across categories over repeating one keyword
+    return sum(1 for hits in categories if hits) * 2 + min(sum(categories), 6)
+
+def compact_results(results: list, budget_tokens: int = None):
+    """
+    Returns the search results as compact "- [source] text" lines that fit in budget_tokens.
+    """
+    budget_tokens = budget_tokens or COMPACT_BUDGET_TOKENS
+    kept = []
+    for source, text in _snippets(results):
+        words = set(_WORD.findall(text.lower()))
+        duplicate = None
+        for i, (_, other_text, other_words) in enumerate(kept):
+            overlap = len(words & other_words) / max(1, min(len(words), len(other_words)))
+            if overlap >= DUPLICATE_OVERLAP:
+                duplicate = i
+                break
+        if duplicate is None:
+            kept.append((source, text, words))
+        elif len(text) > len(kept[duplicate][1]):
+            kept[duplicate] = (source, text, words)
+
+    # Stable sort keeps provider order among equally relevant snippets
+    ranked = sorted(kept, key=lambda entry: _score(entry[1]), reverse=True)
+
+    lines, used = [], 0
+    for source, text, _ in ranked:
+        line = f"- [{source}] {text}"
+        cost = estimate_tokens(line)
+        if used + cost > budget_tokens:
+            room = (budget_tokens - used) * 4
+            if room > 120:
+                cut = line[:room]
+                cut = cut[:cut.rfind(". ") + 1] if ". " in cut else cut.rsplit(" ", 1)[0] + "..."
+                lines.append(cut)
+            break
+        lines.append(line)
+        used += cost
+
+    compacted = "\n".join(lines) or "No search results found."
+    metrics.add("compact", "tokens_in", estimate_tokens(str(results)))
+    metrics.add("compact", "tokens_out", estimate_tokens(compacted))
+    return compacted
@@ -1,22 +1,102 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
+import os
+import re
+import json
+import hashlib
+from clients import get_stage_llm, get_escalation_llm, stage_model, complete, json_schema_format
+from database import cache_get, cache_put
+import metrics
 
-def generate_email_content(lead_row: dict, openrouter_api_key: str = None, user_offer: str = ""):
+# Lead fields that shape the email; a change to any of them means a new draft
+COPY_INPUT_FIELDS = ('Email', 'Founder Name', 'Position', 'Domain', 'Location', 'Enriched Data')
+
+# "json" asks for the four email fields as one JSON object (enforced with a JSON schema
+# response_format) and re-requests only the fields that fail validation; "text" is the
+# original [SUBJECT]/[MESSAGE] format
+COPY_FORMAT = os.getenv("LEADFLOW_COPY_FORMAT", "json")
+
+EMAIL_FIELDS = ('subject', 'opener', 'body', 'closing')
+
+# Longest acceptable value per field, in characters
+FIELD_MAX_CHARS = {'subject': 90, 'opener': 400, 'body': 1200, 'closing': 300}
+
+# Follow-up calls allowed for fields that are still missing or invalid
+COPY_REPAIR_ATTEMPTS = 2
+
+# Part of every copy cache key: bump it when copy_brief or the reply formats change
+# so drafts written with the old prompt are regenerated
+COPY_PROMPT_VERSION = 2
+
+_PLACEHOLDER = re.compile(r"\[[A-Z][A-Z _]*\]|\{[a-z_]+\}|<[a-z_ ]+>|lorem ipsum", re.I)
+# '"field": "value' up to the closing quote if there is one (streamed drafts stop mid-value)
+_JSON_STRING = r'"(%s)"\s*:\s*"((?:[^"\\]|\\.)*)'
+_JSON_PARTIAL = re.compile(_JSON_STRING % "|".join(EMAIL_FIELDS), re.S)
+
+def _unescape(value):
+    try:
+        return json.loads(f'"{value.rstrip(chr(92))}"')
+    except ValueError:
+        return value
+
+def parse_json_fields(content: str, fields=EMAIL_FIELDS):
     """
-    Generates personalized email components using Llama 4 (405B) via OpenRouter.
+    Returns (values, parsed): the given fields found in a JSON reply, and whether
+    it parsed as JSON. Complete fields are salvaged from fenced, chatty or
+    truncated replies so only the rest needs re-requesting.
     """
-    api_key = openrouter_api_key or os.getenv("OPENROUTER_API_KEY")
-    llm = ChatOpenAI(
-        model="meta-llama/llama-3.1-405b-instruct", 
-        openai_api_key=api_key,
-        openai_api_base="https://openrouter.ai/api/v1",
-        default_headers={
-            "HTTP-Referer": "https://leadflow-ai.streamlit.app",
-            "X-Title": "LeadFlow AI"
-        }
-    )
-    
-    enriched_data = lead_row.get('Enriched Data', 'No specific context found.')
+    text = content.strip()
+    start, end = text.find('{'), text.rfind('}')
+    if start != -1 and end > start:
+        try:
+            data = json.loads(text[start:end + 1])
+            if isinstance(data, dict):
+                return {k: str(v).strip() for k, v in data.items()
+                        if k in fields and isinstance(v, (str, int, float))}, True
+        except ValueError:
+            pass
+    complete_values = re.compile(_JSON_STRING % "|".join(fields) + '"', re.S)
+    return {field: _unescape(value).strip() for field, value in complete_values.findall(text)}, False
+
+def validate_email(email: dict):
+    """Returns {field: problem} for every email field that is missing or unusable."""
+    problems = {}
+    for field in EMAIL_FIELDS:
+        value = email.get(field)
+        if not isinstance(value, str) or not value.strip():
+            problems[field] = "missing"
+        elif len(value) > FIELD_MAX_CHARS[field]:
+            problems[field] = f"longer than {FIELD_MAX_CHARS[field]} characters"
+        elif _PLACEHOLDER.search(value):
+            problems[field] = "contains a template placeholder"
+    if 'subject' not in problems and '\n' in email['subject']:
+        problems['subject'] = "must be a single line"
+    if 'closing' not in problems and '?' not in email['closing']:
+        problems['closing'] = "must contain the reply-first question"
+    return problems
+
+def _json_preview(on_token):
+    """Wraps on_token so a streamed JSON draft shows up in the same layout as text drafts."""
+    def preview(text):
+        fields = {field: _unescape(value) for field, value in _JSON_PARTIAL.findall(text)}
+        message = "\n\n".join(fields[f] for f in ('opener', 'body', 'closing') if f in fields)
+        on_token(f"[SUBJECT]: {fields.get('subject', '')}\n[MESSAGE]: {message}")
+    return preview
+
+def _fallback_email(founder_name, domain, location, my_offer):
+    # Ultra-human fallback
+    return {
+        'subject': f"question about {domain}",
+        'opener': f"Hi {founder_name}, was just looking into {domain} and noticed your team's expansion in {location}.",
+        'body': f"Usually, a move like that makes the lead gen side a bit messy. {my_offer.lower()}",
+        'closing': "Is this completely irrelevant to your priorities right now?\n\nBest,",
+    }
+
+def copy_brief(lead_row: dict, user_offer: str = "", research: str = None):
+    """
+    Returns (brief, fallback): the copywriting instructions for this lead, and
+    the canned email used for any field the model cannot get right.
+    research replaces the lead's Enriched Data in the brief.
+    """
+    enriched_data = research if research is not None else lead_row.get('Enriched Data', 'No specific context found.')
     founder_name = lead_row.get('Founder Name', 'there')
     position = lead_row.get('Position', 'Founder')
     domain = lead_row.get('Domain', 'your company')
@@ -25,9 +105,12 @@ def generate_email_content(lead_row: dict, openrouter_api_key: str = None, user_
     # Default offer if empty
     my_offer = user_offer if user_offer else "I help scaling companies automate their B2B systems and lead generation."
 
-    prompt = f"""
+    brief = f"""
     You are Lawrence Oladeji, a high-level AI and Automation Workflow Developer.
     MISSION: Write a high-impact, value-driven note to {founder_name} ({position}) at {domain}.
+
+    RESEARCH ON THIS LEAD:
+    {enriched_data}
     
     GUIDELINES:
     - BE BRIEF. Brevity is respect.
@@ -41,14 +124,91 @@ def generate_email_content(lead_row: dict, openrouter_api_key: str = None, user_
     2. Value/Win: Offer a specific insight related to your role as an AI developer.
     3. Proposal: Reframed logic: "If [Trigger] then [Pain]... I built [Solution] for [Outcome]."
     4. CTA (REPLY-FIRST): Ask a very simple, low-pressure "No-oriented" question that is easy to reply to (e.g., "Is this completely irrelevant to your priorities right now?" or "Would it be a waste of time to explore this?"). Getting a reply is our #1 priority for sender reputation.
+    """
+    return brief, _fallback_email(founder_name, domain, location, my_offer)
+
+# JSON reply format for the four email fields
+EMAIL_JSON_FORMAT = """
+    {"subject": "subject line, one line, under 60 characters",
+     "opener": "greeting plus the recognition sentence",
+     "body": "the value/win and the proposal",
+     "closing": "the reply-first question, then a sign-off"}
+"""
 
+def repair_fields(llm, brief: str, values: dict, validate, fallback: dict, stage: str = "copywrite", escalate=None):
+    """
+    Re-requests only the fields validate(values) rejects, showing the model the
+    ones that are fine, up to COPY_REPAIR_ATTEMPTS times; anything still
+    unusable is taken from fallback. After the first repair call on llm fails
+    validation, the rest go to escalate (a larger model's client) if given.
+    Counted under "copywrite" in metrics.
+    """
+    problems = validate(values)
+    for attempt in range(COPY_REPAIR_ATTEMPTS):
+        if not problems:
+            break
+        if attempt and escalate is not None:
+            llm = escalate
+            metrics.add("copywrite", "escalations")
+        metrics.add("copywrite", "repair_calls")
+        metrics.add("copywrite", "invalid_fields", len(problems))
+        keep = {field: value for field, value in values.items() if field not in problems}
+        issues = "\n".join(f"    - {field}: {problem}" for field, problem in problems.items())
+        repair_prompt = brief + f"""
+    You already drafted part of this: {json.dumps(keep)}
+    These fields are missing or unusable:
+{issues}
+    Respond with ONLY a JSON object containing exactly these keys: {json.dumps(list(problems))}
+    """
+        reply = complete(llm, repair_prompt, f"{stage}.repair", response_format=json_schema_format("repair", tuple(problems)))
+        fixed, _ = parse_json_fields(reply, tuple(problems))
+        values.update(fixed)
+        problems = validate(values)
+
+    if problems:
+        metrics.add("copywrite", "fallback_fields", len(problems))
+        for field in problems:
+            values[field] = fallback[field]
+    return values
+
+def generate_email_content(lead_row: dict, openrouter_api_key: str = None, user_offer: str = "", on_token=None,
+                           models: dict = None):
+    """
+    Generates personalized email components via OpenRouter, on the models routed
+    to copywrite and repair (models overrides clients.STAGE_MODELS).
+    on_token(text_so_far) streams the draft as it is generated.
+    Parse failures, re-requested fields and fallbacks are counted under "copywrite" in metrics.
+    """
+    api_key = openrouter_api_key or os.getenv("OPENROUTER_API_KEY")
+    llm = get_stage_llm(api_key, "copywrite", models)
+    brief, fallback = copy_brief(lead_row, user_offer)
+    metrics.add("copywrite", "drafts")
+
+    if COPY_FORMAT == "text":
+        return _generate_text_email(llm, brief, on_token, fallback)
+
+    prompt = brief + f"""
+    Respond with ONLY a JSON object (no code fences, no commentary) with these string fields:{EMAIL_JSON_FORMAT}"""
+    content = complete(llm, prompt, "copywrite", _json_preview(on_token) if on_token else None,
+                       json_schema_format("email", EMAIL_FIELDS))
+    email, parsed = parse_json_fields(content)
+    if not parsed:
+        metrics.add("copywrite", "parse_failed")
+
+    repair = get_stage_llm(api_key, "repair", models)
+    email = repair_fields(repair, brief, email, validate_email, fallback,
+                          escalate=get_escalation_llm(api_key, repair, models))
+    return email['subject'], email['opener'], email['body'], email['closing']
+
+def _generate_text_email(llm, brief, on_token, fallback):
+    """The original [SUBJECT]/[MESSAGE] format, parsed leniently; any failure returns the fallback email."""
+    prompt = brief + """
     Format your response EXACTLY as follows:
     [SUBJECT]: ...
     [MESSAGE]: ...
     """
 
-    response = llm.invoke([HumanMessage(content=prompt)])
-    content = response.content
+    content = complete(llm, prompt, "copywrite", on_token)
     
     # New fluid parsing
     try:
@@ -74,9 +234,52 @@ def generate_email_content(lead_row: dict, openrouter_api_key: str = None, user_
             
         return subject, opener, body, closing
     except Exception as e:
-        # Ultra-human fallback
-        subject = f"question about {domain}"
-        opener = f"Hi {founder_name}, was just looking into {domain} and noticed your team's expansion in {location}."
-        body = f"Usually, a move like that makes the lead gen side a bit messy. {my_offer.lower()}"
-        closing = "Is this completely irrelevant to your priorities right now?\n\nBest,"
-        return subject, opener, body, closing
+        metrics.add("copywrite", "parse_failed")
+        metrics.add("copywrite", "fallback_fields", len(EMAIL_FIELDS))
+        return fallback['subject'], fallback['opener'], fallback['body'], fallback['closing']
+
+def copy_key(lead_row: dict, user_offer: str = "", model: str = None):
+    """
+    Content address of one lead's email: a hash of the prompt version, reply
+    format, model, offer and COPY_INPUT_FIELDS (research included). model
+    defaults to the one routed to copywrite.
+    """
+    payload = json.dumps([COPY_PROMPT_VERSION, COPY_FORMAT, model or stage_model("copywrite"), user_offer,
+                          [str(lead_row.get(f, '')) for f in COPY_INPUT_FIELDS]])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def store_email(key: str, email: tuple):
+    """Caches (subject, opener, body, closing) under the "copy" level."""
+    cache_put("copy", key, json.dumps(dict(zip(EMAIL_FIELDS, email))))
+
+def cached_email(key: str):
+    """The cached (subject, opener, body, closing) for key, or None."""
+    hit = cache_get("copy", key)
+    return tuple(json.loads(hit)[field] for field in EMAIL_FIELDS) if hit is not None else None
+
+def copy_is_current(lead_row: dict, user_offer: str = "", model: str = None):
+    """
+    True if this lead's email was already written from exactly these inputs,
+    i.e. an incremental run can skip it.
+    """
+    return cache_get("copy", copy_key(lead_row, user_offer, model)) is not None
+
+def cached_email_content(lead_row: dict, openrouter_api_key: str = None, user_offer: str = "", on_token=None,
+                         force_refresh: bool = False, models: dict = None):
+    """
+    generate_email_content behind the "copy" cache level: an unchanged lead
+    under an unchanged offer, model and prompt is never sent to the model again,
+    whichever run or campaign drafted it first.
+    """
+    key = copy_key(lead_row, user_offer, stage_model("copywrite", models))
+    if not force_refresh:
+        email = cached_email(key)
+        metrics.record("cache.copy", 0.0, "hit" if email is not None else "miss")
+        if email is not None:
+            if on_token:
+                on_token(f"[SUBJECT]: {email[0]}\n[MESSAGE]: {email[1]}\n\n{email[2]}\n\n{email[3]}")
+            return email
+
+    email = generate_email_content(lead_row, openrouter_api_key, user_offer, on_token, models)
+    store_email(key, email)
+    return email
@@ -1,36 +1,241 @@
+import secrets
 import sqlite3
+import string
+import threading
 import uuid
 import hashlib
+import json
+import time
+from contextlib import contextmanager
 
 DB_PATH = "leadflow.db"
 
+# Connections are pooled per DB_PATH and reused, so each keeps its prepared
+# statement cache; WAL lets readers run alongside the one writer, and a
+# writer waits up to BUSY_TIMEOUT_S for the lock instead of failing.
+BUSY_TIMEOUT_S = 30
+POOL_SIZE = 8
+STATEMENT_CACHE_SIZE = 256
+
+# Research cache: "search" holds raw provider results keyed by normalized query,
+# "summary" holds summarize_node output keyed by a hash of those results,
+# "fused" holds single-call research + copy output, and "copy" holds finished
+# emails keyed by a hash of everything that shaped them.
+CACHE_TTL_SECONDS = {"search": 3 * 24 * 3600, "summary": 7 * 24 * 3600, "fused": 7 * 24 * 3600, "copy": 30 * 24 * 3600}
+CACHE_MAX_BYTES = {"search": 64 * 1024 * 1024, "summary": 16 * 1024 * 1024, "fused": 16 * 1024 * 1024,
+                   "copy": 16 * 1024 * 1024}
+# A level over its cap is trimmed to this share of it, so eviction runs in occasional batches
+CACHE_EVICT_TO = 0.9
+# Expired rows are purged (and the byte totals recounted) at most this often per process
+CACHE_PRUNE_SECONDS = 300
+# Hits refresh accessed_at in batches: with the next put, or once this many are pending
+CACHE_TOUCH_BATCH = 64
+
+# Enrichment job queue: a claimed job is leased to one worker until lease_expires;
+# heartbeats extend the lease, and an expired lease makes the job claimable again.
+JOB_LEASE_SECONDS = 120
+JOB_MAX_ATTEMPTS = 3
+
+# Outreach outbox: each message carries its own send_at, and the daily cap is a
+# rolling window over every session and process sharing leadflow.db.
+SEND_WINDOW_SECONDS = 24 * 3600
+# A message claimed this long ago without an outcome is failed, never resent
+SEND_STALE_SECONDS = 600
+# Due messages this far behind schedule (cap reached, dispatcher down) shift the
+# rest of the queue back instead of going out in a burst
+SEND_LATE_SECONDS = 15
+
+# Lead store: one row per uploaded lead, keyed by (list_id, lead_index). Keys are
+# the column labels used across the app, values the SQL column names.
+LEAD_COLUMNS = {
+    'Founder Name': 'founder_name', 'Email': 'email', 'Domain': 'domain', 'Linkedin': 'linkedin',
+    'Position': 'position', 'Location': 'location', 'Status': 'status', 'Enriched Data': 'enriched_data',
+    'Subject': 'subject', 'Opener': 'opener', 'Body': 'body', 'Closing': 'closing',
+}
+# Columns filled from the uploaded file; the rest start empty ('Pending' status)
+LEAD_INPUT_COLUMNS = ('Founder Name', 'Email', 'Domain', 'Linkedin', 'Position', 'Location')
+
+# Jobs and outbox rows carrying a list_id write their outcome through to that
+# lead's row, so the store stays current with no session open
+LEAD_TRIGGERS = (
+    '''CREATE TRIGGER IF NOT EXISTS jobs_to_leads AFTER UPDATE OF status ON jobs
+       WHEN NEW.list_id IS NOT NULL AND NEW.status IN ('done', 'failed')
+       BEGIN
+           UPDATE leads SET
+               enriched_data = COALESCE(json_extract(NEW.result, '$."Enriched Data"'), enriched_data),
+               subject = COALESCE(json_extract(NEW.result, '$.Subject'), subject),
+               opener = COALESCE(json_extract(NEW.result, '$.Opener'), opener),
+               body = COALESCE(json_extract(NEW.result, '$.Body'), body),
+               closing = COALESCE(json_extract(NEW.result, '$.Closing'), closing),
+               status = CASE NEW.status WHEN 'done' THEN COALESCE(json_extract(NEW.result, '$.Status'), 'Ready')
+                        ELSE 'Error: ' || COALESCE(NEW.error, 'Failed') END,
+               updated_at = NEW.updated_at
+           WHERE list_id = NEW.list_id AND lead_index = NEW.lead_index;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS outbox_scheduled_to_leads AFTER INSERT ON outbox
+       WHEN NEW.list_id IS NOT NULL
+       BEGIN
+           UPDATE leads SET status = 'Scheduled', updated_at = NEW.created_at
+           WHERE list_id = NEW.list_id AND lead_index = NEW.lead_index;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS outbox_to_leads AFTER UPDATE OF status ON outbox
+       WHEN NEW.list_id IS NOT NULL AND NEW.status IN ('sent', 'failed', 'cancelled')
+       BEGIN
+           UPDATE leads SET
+               status = CASE NEW.status WHEN 'sent' THEN 'Sent' WHEN 'cancelled' THEN 'Ready'
+                        ELSE 'Error: ' || COALESCE(NEW.error, 'Failed') END,
+               updated_at = NEW.updated_at
+           WHERE list_id = NEW.list_id AND lead_index = NEW.lead_index;
+       END''',
+)
+
+# Run diagnostics: one row per traced run or campaign, and timing spans
+# (searches, LLM calls, pipeline stages, sends) per lead, kept for SPAN_TTL_SECONDS
+SPAN_TTL_SECONDS = 14 * 24 * 3600
+
+# Access codes: one schema shared by the app and generate_access_code.py.
+# Columns older tables may lack, added on init_db.
+ACCESS_CODE_COLUMNS = {"is_used": "INTEGER DEFAULT 0", "used_by": "TEXT", "used_at": "REAL",
+                       "created_at": "REAL", "description": "TEXT"}
+ACCESS_CODE_ALPHABET = string.ascii_uppercase + string.digits
+# Random bytes from this value up are dropped, so every character is equally likely
+_CODE_BYTE_LIMIT = 256 - 256 % len(ACCESS_CODE_ALPHABET)
+_CODE_TABLE = bytes(ord(ACCESS_CODE_ALPHABET[b % len(ACCESS_CODE_ALPHABET)]) for b in range(256))
+_CODE_DROP = bytes(range(_CODE_BYTE_LIMIT, 256))
+
+_pool_lock = threading.Lock()
+_idle = {}
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S, isolation_level=None, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # Safe with WAL: a crash can't corrupt the database, only lose the last commits on power loss
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+@contextmanager
+def connect():
+    """
+    Borrows a pooled connection to DB_PATH (autocommit: each statement is its
+    own transaction unless run inside transaction()) and returns it afterwards.
+    """
+    path = DB_PATH
+    with _pool_lock:
+        idle = _idle.setdefault(path, [])
+        conn = idle.pop() if idle else None
+    if conn is None:
+        conn = _open(path)
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        with _pool_lock:
+            if len(idle) < POOL_SIZE:
+                idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+@contextmanager
+def transaction():
+    """
+    connect() inside BEGIN IMMEDIATE ... COMMIT, rolled back on error. Taking the
+    write lock up front means a read-then-write never fails to upgrade its lock.
+    """
+    with connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.execute("COMMIT")
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    with transaction() as conn:
+        _create_schema(conn.cursor())
+
+def _create_schema(c):
     # Users table: Tracks trial uses by machine_id
     c.execute('''CREATE TABLE IF NOT EXISTS users
                  (machine_id TEXT PRIMARY KEY, trial_uses INTEGER DEFAULT 0, is_pro INTEGER DEFAULT 0)''')
     
     # Access codes table
     c.execute('''CREATE TABLE IF NOT EXISTS access_codes
-                 (code TEXT PRIMARY KEY, is_used INTEGER DEFAULT 0)''')
+                 (code TEXT PRIMARY KEY, is_used INTEGER DEFAULT 0, used_by TEXT, used_at REAL,
+                  created_at REAL, description TEXT)''')
+    columns = [row[1] for row in c.execute("PRAGMA table_info(access_codes)")]
+    for column, kind in ACCESS_CODE_COLUMNS.items():
+        if column not in columns:
+            c.execute(f"ALTER TABLE access_codes ADD COLUMN {column} {kind}")
+    if 'used' in columns and 'is_used' not in columns:
+        # Made by the old generate_access_code.py: `used` flag and text timestamps
+        c.execute("UPDATE access_codes SET is_used = used")
+        c.execute("UPDATE access_codes SET created_at = CAST(strftime('%s', created_at) AS REAL) WHERE typeof(created_at) = 'text'")
+    
+    # Research cache (both levels share one table)
+    c.execute('''CREATE TABLE IF NOT EXISTS research_cache
+                 (level TEXT, cache_key TEXT, value TEXT, size INTEGER,
+                  created_at REAL, accessed_at REAL, PRIMARY KEY (level, cache_key))''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_research_cache_lru ON research_cache (level, accessed_at)")
+    # Running byte total per level, kept in step by cache_put
+    c.execute("CREATE TABLE IF NOT EXISTS research_cache_usage (level TEXT PRIMARY KEY, bytes INTEGER)")
+    c.execute("INSERT OR IGNORE INTO research_cache_usage SELECT level, SUM(size) FROM research_cache GROUP BY level")
+    
+    # Enrichment job queue (one row per lead per run)
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT, lead_index INTEGER, payload TEXT,
+                  status TEXT DEFAULT 'queued', attempts INTEGER DEFAULT 0, max_attempts INTEGER DEFAULT 3,
+                  lease_owner TEXT, lease_expires REAL, heartbeat_at REAL,
+                  result TEXT, error TEXT, created_at REAL, updated_at REAL, list_id TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, lease_expires)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_run ON jobs (run_id, status)")
+    
+    # Outreach outbox (one row per email) and app-wide settings such as the daily cap
+    c.execute('''CREATE TABLE IF NOT EXISTS outbox
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, campaign_id TEXT, lead_index INTEGER,
+                  sender TEXT, recipient TEXT, subject TEXT, body TEXT, send_at REAL,
+                  status TEXT DEFAULT 'scheduled', owner TEXT, message_id TEXT, error TEXT,
+                  sent_at REAL, created_at REAL, updated_at REAL, list_id TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, send_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_sent ON outbox (status, sent_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_campaign ON outbox (campaign_id, status)")
+    c.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+
+    # Uploaded lead lists and their leads
+    c.execute('''CREATE TABLE IF NOT EXISTS lead_lists
+                 (list_id TEXT PRIMARY KEY, name TEXT, rows INTEGER DEFAULT 0, created_at REAL)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS leads
+                 (list_id TEXT, lead_index INTEGER,
+                  founder_name TEXT DEFAULT '', email TEXT DEFAULT '', domain TEXT DEFAULT '',
+                  linkedin TEXT DEFAULT '', position TEXT DEFAULT '', location TEXT DEFAULT '',
+                  status TEXT DEFAULT 'Pending', enriched_data TEXT DEFAULT '', subject TEXT DEFAULT '',
+                  opener TEXT DEFAULT '', body TEXT DEFAULT '', closing TEXT DEFAULT '',
+                  updated_at REAL, PRIMARY KEY (list_id, lead_index))''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_leads_email ON leads (list_id, email)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_leads_status ON leads (list_id, status, lead_index)")
+    # Queues created before the lead store lack list_id
+    for table in ('jobs', 'outbox'):
+        if 'list_id' not in [row[1] for row in c.execute(f"PRAGMA table_info({table})")]:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN list_id TEXT")
+    for trigger in LEAD_TRIGGERS:
+        c.execute(trigger)
+
+    # Traced runs and their spans
+    c.execute("CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, kind TEXT, list_id TEXT, started_at REAL)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_runs_list ON runs (list_id, started_at)")
+    c.execute('''CREATE TABLE IF NOT EXISTS spans
+                 (run_id TEXT, list_id TEXT, lead_index INTEGER, name TEXT, started_at REAL, seconds REAL,
+                  outcome TEXT, input_tokens INTEGER DEFAULT 0, output_tokens INTEGER DEFAULT 0)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_spans_run ON spans (run_id, name, seconds)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_spans_started ON spans (started_at)")
     
     # Seed 5 secure, random codes if table is empty
     c.execute("SELECT COUNT(*) FROM access_codes")
     if c.fetchone()[0] == 0:
-        import secrets
-        import string
-        def gen_code():
-            alphabet = string.ascii_uppercase + string.digits
-            part1 = ''.join(secrets.choice(alphabet) for _ in range(4))
-            part2 = ''.join(secrets.choice(alphabet) for _ in range(4))
-            return f"LFLOW-{part1}-{part2}"
-            
-        for _ in range(5):
-            c.execute("INSERT INTO access_codes (code) VALUES (?)", (gen_code(),))
-    
-    conn.commit()
-    conn.close()
+        _insert_access_codes(c, new_access_codes(5))
 
 def get_machine_id():
     """Generates a stable machine ID based on environment footprint."""
@@ -40,34 +245,463 @@ def get_machine_id():
     return hashlib.sha256(fingerprint.encode()).hexdigest()
 
 def check_user_status(machine_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT trial_uses, is_pro FROM users WHERE machine_id = ?", (machine_id,))
-    res = c.fetchone()
-    if not res:
-        c.execute("INSERT INTO users (machine_id) VALUES (?)", (machine_id,))
-        conn.commit()
-        res = (0, 0)
-    conn.close()
+    with connect() as conn:
+        res = conn.execute("SELECT trial_uses, is_pro FROM users WHERE machine_id = ?", (machine_id,)).fetchone()
+        if not res:
+            conn.execute("INSERT OR IGNORE INTO users (machine_id) VALUES (?)", (machine_id,))
+            res = (0, 0)
     return res # (trial_uses, is_pro)
 
 def increment_trial(machine_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE users SET trial_uses = trial_uses + 1 WHERE machine_id = ?", (machine_id,))
-    conn.commit()
-    conn.close()
+    with connect() as conn:
+        conn.execute("UPDATE users SET trial_uses = trial_uses + 1 WHERE machine_id = ?", (machine_id,))
 
 def validate_access_code(machine_id, code):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT is_used FROM access_codes WHERE code = ?", (code,))
-    res = c.fetchone()
-    if res and res[0] == 0:
-        c.execute("UPDATE access_codes SET is_used = 1 WHERE code = ?", (code,))
-        c.execute("UPDATE users SET is_pro = 1 WHERE machine_id = ?", (machine_id,))
-        conn.commit()
-        conn.close()
+    """
+    Redeems code for machine_id if nobody has yet. The check and the claim are one
+    conditional UPDATE, so of any number of concurrent redemptions exactly one wins.
+    """
+    with transaction() as conn:
+        redeemed = conn.execute("UPDATE access_codes SET is_used = 1, used_by = ?, used_at = ? WHERE code = ? AND is_used = 0",
+                                (machine_id, time.time(), str(code).strip().upper())).rowcount == 1
+        if redeemed:
+            conn.execute('''INSERT INTO users (machine_id, is_pro) VALUES (?, 1)
+                            ON CONFLICT (machine_id) DO UPDATE SET is_pro = 1''', (machine_id,))
+    return redeemed
+
+def new_access_codes(count):
+    """count random codes like 'K7QD-2MXA-9ZPL', every character drawn uniformly from A-Z and 0-9."""
+    needed = count * 12
+    chars = b""
+    while len(chars) < needed:
+        # About 2% of bytes are dropped; ask for a little extra
+        chars += secrets.token_bytes((needed - len(chars)) * 51 // 50 + 16).translate(_CODE_TABLE, _CODE_DROP)
+    text = chars[:needed].decode()
+    return [f"{text[i:i + 4]}-{text[i + 4:i + 8]}-{text[i + 8:i + 12]}" for i in range(0, needed, 12)]
+
+def _insert_access_codes(conn, codes, description="", numbered=False):
+    now = time.time()
+    conn.executemany("INSERT INTO access_codes (code, created_at, description) VALUES (?, ?, ?)",
+                     ((code, now, f"{description} #{i}" if numbered else description) for i, code in enumerate(codes, 1)))
+
+def mint_access_codes(count, description="", numbered=False):
+    """
+    Stores count new access codes in one transaction and returns them. A clash
+    with an existing code (odds around 1 in 10^13 per code) rolls the batch back
+    and draws a new one. With numbered, each description gets " #<n>" appended.
+    """
+    while True:
+        codes = new_access_codes(count)
+        try:
+            with transaction() as conn:
+                _insert_access_codes(conn, codes, description, numbered)
+            return codes
+        except sqlite3.IntegrityError:
+            pass
+
+def add_access_code(code, description=""):
+    """Stores one chosen code. Returns False if it already exists."""
+    try:
+        with transaction() as conn:
+            _insert_access_codes(conn, [code], description)
         return True
-    conn.close()
-    return False
+    except sqlite3.IntegrityError:
+        return False
+
+def list_access_codes(limit=None):
+    """Returns [(code, is_used, used_by, used_at, created_at, description)], newest first."""
+    with connect() as conn:
+        return conn.execute('''SELECT code, is_used, used_by, used_at, created_at, description FROM access_codes
+                               ORDER BY created_at DESC, code LIMIT ?''', (-1 if limit is None else limit,)).fetchall()
+
+def create_lead_list(name):
+    """Registers a new, empty lead list and returns its id."""
+    list_id = uuid.uuid4().hex
+    with connect() as conn:
+        conn.execute("INSERT INTO lead_lists (list_id, name, created_at) VALUES (?, ?, ?)", (list_id, name, time.time()))
+    return list_id
+
+def delete_lead_list(list_id):
+    """Removes a lead list and its leads (e.g. an upload that failed part-way)."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM leads WHERE list_id = ?", (list_id,))
+        conn.execute("DELETE FROM lead_lists WHERE list_id = ?", (list_id,))
+
+def insert_leads(list_id, rows):
+    """
+    Appends LEAD_INPUT_COLUMNS value tuples to a lead list in one transaction,
+    skipping any whose Email is already in the list, and numbers them after
+    the list's existing leads. Returns how many were added.
+    """
+    rows = list(rows)
+    email_at = LEAD_INPUT_COLUMNS.index('Email')
+    now = time.time()
+    columns = ", ".join(LEAD_COLUMNS[label] for label in LEAD_INPUT_COLUMNS)
+    placeholders = ", ".join("?" * (len(LEAD_INPUT_COLUMNS) + 3))
+    with transaction() as conn:
+        seen = {email for (email,) in conn.execute(
+            "SELECT email FROM leads WHERE list_id = ? AND email IN (SELECT value FROM json_each(?))",
+            (list_id, json.dumps([row[email_at] for row in rows])))}
+        rows = [row for row in rows if row[email_at] not in seen]
+        start = conn.execute("SELECT rows FROM lead_lists WHERE list_id = ?", (list_id,)).fetchone()[0]
+        conn.executemany(f"INSERT INTO leads (list_id, lead_index, {columns}, updated_at) VALUES ({placeholders})",
+                         ((list_id, start + i, *row, now) for i, row in enumerate(rows)))
+        conn.execute("UPDATE lead_lists SET rows = rows + ? WHERE list_id = ?", (len(rows), list_id))
+    return len(rows)
+
+def get_leads(list_id, offset=0, limit=None, columns=None, status=None, after=None):
+    """
+    Returns (lead_indexes, {label: values}) for a page of a lead list, in upload
+    order: limit rows from offset, or following lead_index after (cheaper when
+    walking a whole list). columns (labels) and status narrow what is read.
+    """
+    labels = list(columns or LEAD_COLUMNS)
+    sql = f"SELECT lead_index, {', '.join(LEAD_COLUMNS[label] for label in labels)} FROM leads WHERE list_id = ?"
+    params = [list_id]
+    if status is not None:
+        sql += " AND status = ?"
+        params.append(status)
+    if after is not None:
+        sql += " AND lead_index > ?"
+        params.append(after)
+    with connect() as conn:
+        rows = conn.execute(sql + " ORDER BY lead_index LIMIT ? OFFSET ?",
+                            (*params, -1 if limit is None else limit, offset)).fetchall()
+    values = list(zip(*rows)) or [()] * (len(labels) + 1)
+    return list(values[0]), {label: list(column) for label, column in zip(labels, values[1:])}
+
+def update_lead(list_id, lead_index, fields):
+    """Writes {label: value} onto one lead."""
+    assignments = ", ".join(f"{LEAD_COLUMNS[label]} = ?" for label in fields)
+    with connect() as conn:
+        conn.execute(f"UPDATE leads SET {assignments}, updated_at = ? WHERE list_id = ? AND lead_index = ?",
+                     (*fields.values(), time.time(), list_id, lead_index))
+
+def lead_counts(list_id):
+    """Returns {status: count} for a lead list."""
+    with connect() as conn:
+        rows = conn.execute("SELECT status, COUNT(*) FROM leads WHERE list_id = ? GROUP BY status", (list_id,)).fetchall()
+    return dict(rows)
+
+def lead_lists(limit=20):
+    """Returns [(list_id, name, rows, created_at)] for the most recently uploaded lists."""
+    with connect() as conn:
+        rows = conn.execute("SELECT list_id, name, rows, created_at FROM lead_lists ORDER BY created_at DESC LIMIT ?",
+                            (limit,)).fetchall()
+    return rows
+
+_cache_lock = threading.Lock()
+_touched = {}
+_pruned = {}
+
+def _flush_touches(conn, path):
+    with _cache_lock:
+        pending = _touched.pop(path, None)
+    if pending:
+        conn.executemany("UPDATE research_cache SET accessed_at = ? WHERE level = ? AND cache_key = ?",
+                         [(at, level, cache_key) for (level, cache_key), at in pending.items()])
+
+def cache_get(level, cache_key):
+    """
+    Returns the cached value for (level, cache_key), or None if missing or past its TTL.
+    Hits refresh accessed_at later, in batches (see CACHE_TOUCH_BATCH).
+    """
+    now = time.time()
+    path = DB_PATH
+    with connect() as conn:
+        res = conn.execute("SELECT value, created_at FROM research_cache WHERE level = ? AND cache_key = ?",
+                           (level, cache_key)).fetchone()
+    if not res or now - res[1] > CACHE_TTL_SECONDS[level]:
+        return None
+    with _cache_lock:
+        pending = _touched.setdefault(path, {})
+        pending[(level, cache_key)] = now
+        full = len(pending) >= CACHE_TOUCH_BATCH
+    if full:
+        with transaction() as conn:
+            _flush_touches(conn, path)
+    return res[0]
+
+def cache_put(level, cache_key, value):
+    """
+    Stores a value and keeps the level's running byte total. Least-recently-used
+    rows are evicted only once the level is over its size cap, and expired rows
+    are purged every CACHE_PRUNE_SECONDS.
+    """
+    now = time.time()
+    path = DB_PATH
+    size = len(value.encode())
+    with _cache_lock:
+        prune = now - _pruned.get((path, level), 0) > CACHE_PRUNE_SECONDS
+        if prune:
+            _pruned[(path, level)] = now
+
+    with transaction() as conn:
+        _flush_touches(conn, path)
+        old = conn.execute("SELECT size FROM research_cache WHERE level = ? AND cache_key = ?", (level, cache_key)).fetchone()
+        conn.execute("INSERT OR REPLACE INTO research_cache VALUES (?, ?, ?, ?, ?, ?)",
+                     (level, cache_key, value, size, now, now))
+        conn.execute('''INSERT INTO research_cache_usage VALUES (?, ?)
+                        ON CONFLICT (level) DO UPDATE SET bytes = bytes + excluded.bytes''',
+                     (level, size - (old[0] if old else 0)))
+        if prune:
+            conn.execute("DELETE FROM research_cache WHERE level = ? AND created_at < ?", (level, now - CACHE_TTL_SECONDS[level]))
+            conn.execute('''UPDATE research_cache_usage SET bytes =
+                            (SELECT COALESCE(SUM(size), 0) FROM research_cache WHERE level = ?) WHERE level = ?''',
+                         (level, level))
+
+        used = conn.execute("SELECT bytes FROM research_cache_usage WHERE level = ?", (level,)).fetchone()[0]
+        if used <= CACHE_MAX_BYTES[level]:
+            return
+        # Walk the LRU index from the oldest row until the level is back under CACHE_EVICT_TO of its cap
+        target, evicted, freed = CACHE_MAX_BYTES[level] * CACHE_EVICT_TO, [], 0
+        oldest = conn.execute("SELECT cache_key, size FROM research_cache WHERE level = ? ORDER BY accessed_at", (level,))
+        for key, row_size in oldest:
+            if used - freed <= target:
+                break
+            evicted.append((level, key))
+            freed += row_size
+        oldest.close()
+        conn.executemany("DELETE FROM research_cache WHERE level = ? AND cache_key = ?", evicted)
+        conn.execute("UPDATE research_cache_usage SET bytes = bytes - ? WHERE level = ?", (freed, level))
+
+def enqueue_jobs(run_id, jobs, max_attempts=JOB_MAX_ATTEMPTS, list_id=None):
+    """
+    Queues (lead_index, payload dict) pairs for run_id in one transaction.
+    With list_id, finished jobs write their results onto those leads in the lead store.
+    """
+    now = time.time()
+    rows = [(run_id, lead_index, json.dumps(payload, default=str), max_attempts, now, now, list_id) for lead_index, payload in jobs]
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT INTO jobs (run_id, lead_index, payload, max_attempts, created_at, updated_at, list_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows)
+
+def claim_jobs(worker_id, limit, lease_seconds=JOB_LEASE_SECONDS):
+    """
+    Leases up to limit queued (or lease-expired) jobs to worker_id.
+    Returns [(job_id, run_id, lead_index, payload dict)]. Jobs whose lease ran
+    out on their last attempt are marked failed instead.
+    """
+    now = time.time()
+    with transaction() as conn:
+        conn.execute('''UPDATE jobs SET status = 'failed', error = 'Lease expired on final attempt', updated_at = ?
+                        WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts''', (now, now))
+        rows = conn.execute('''SELECT id, run_id, lead_index, payload FROM jobs
+                               WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?)
+                               ORDER BY id LIMIT ?''', (now, limit)).fetchall()
+        conn.executemany('''UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_owner = ?,
+                            lease_expires = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?''',
+                         [(worker_id, now + lease_seconds, now, now, row[0]) for row in rows])
+    return [(job_id, run_id, lead_index, json.loads(payload)) for job_id, run_id, lead_index, payload in rows]
+
+def heartbeat_jobs(worker_id, job_ids, lease_seconds=JOB_LEASE_SECONDS):
+    """Extends the lease on jobs still held by worker_id."""
+    if not job_ids:
+        return
+    now = time.time()
+    with transaction() as conn:
+        conn.executemany('''UPDATE jobs SET lease_expires = ?, heartbeat_at = ?
+                            WHERE id = ? AND lease_owner = ? AND status = 'running' ''',
+                         [(now + lease_seconds, now, job_id, worker_id) for job_id in job_ids])
+
+def finish_job(job_id, worker_id, result=None, error=None):
+    """
+    Stores a job's result, or its error. A failed job goes back to the queue
+    until it has used max_attempts. Ignored if the lease has moved to another worker.
+    """
+    now = time.time()
+    with connect() as conn:
+        if error is None:
+            conn.execute('''UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_owner = NULL, updated_at = ?
+                            WHERE id = ? AND lease_owner = ?''', (json.dumps(result), now, job_id, worker_id))
+        else:
+            conn.execute('''UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                            result = ?, error = ?, lease_owner = NULL, updated_at = ?
+                            WHERE id = ? AND lease_owner = ?''',
+                         (json.dumps(result) if result else None, str(error), now, job_id, worker_id))
+
+def run_status(run_id):
+    """Returns {status: count} for one run's jobs."""
+    with connect() as conn:
+        rows = conn.execute("SELECT status, COUNT(*) FROM jobs WHERE run_id = ? GROUP BY status", (run_id,)).fetchall()
+    return dict(rows)
+
+def get_setting(key, default=None):
+    with connect() as conn:
+        res = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+    return res[0] if res else default
+
+def set_setting(key, value):
+    with connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO settings VALUES (?, ?)", (key, str(value)))
+
+def last_scheduled_at():
+    """Returns the latest send_at still waiting in the outbox, or None."""
+    with connect() as conn:
+        res = conn.execute("SELECT MAX(send_at) FROM outbox WHERE status = 'scheduled'").fetchone()
+    return res[0]
+
+def schedule_sends(campaign_id, messages, list_id=None):
+    """
+    Queues (lead_index, sender, recipient, subject, body, send_at) tuples for
+    campaign_id in one transaction. With list_id, those leads are marked
+    Scheduled in the lead store and follow each message's outcome.
+    """
+    now = time.time()
+    rows = [(campaign_id, *message, now, now, list_id) for message in messages]
+    with transaction() as conn:
+        conn.executemany(
+            '''INSERT INTO outbox (campaign_id, lead_index, sender, recipient, subject, body, send_at, created_at, updated_at, list_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+
+def claim_due_sends(owner, daily_limit, limit=1):
+    """
+    Claims up to limit due messages for owner, as many as the rolling daily cap allows.
+    Returns ([message dict], None) when any were claimed, else ([], wake_at) with
+    the time the next message or cap slot frees up (None if nothing is queued).
+    """
+    now = time.time()
+    with transaction() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        c.execute('''UPDATE outbox SET status = 'failed', error = 'Interrupted while sending; not retried to avoid a duplicate',
+                     updated_at = ? WHERE status = 'sending' AND updated_at < ?''', (now, now - SEND_STALE_SECONDS))
+
+        c.execute('''SELECT COUNT(*), MIN(COALESCE(sent_at, updated_at)) FROM outbox
+                     WHERE (status = 'sent' AND sent_at > ?) OR status = 'sending' ''', (now - SEND_WINDOW_SECONDS,))
+        used, oldest = c.fetchone()
+        if used >= daily_limit:
+            return [], (oldest or now) + SEND_WINDOW_SECONDS
+
+        c.execute("SELECT MIN(send_at) FROM outbox WHERE status = 'scheduled'")
+        first = c.fetchone()[0]
+        if first is None:
+            return [], None
+        if first > now:
+            return [], first
+
+        late = now - first
+        if late > SEND_LATE_SECONDS:
+            c.execute("UPDATE outbox SET send_at = send_at + ? WHERE status = 'scheduled'", (late,))
+        # A second of slack keeps the (shifted) first message due despite float rounding
+        c.execute("SELECT * FROM outbox WHERE status = 'scheduled' AND send_at <= ? ORDER BY send_at, id LIMIT ?",
+                  (now + 1, min(limit, daily_limit - used)))
+        rows = c.fetchall()
+        c.executemany("UPDATE outbox SET status = 'sending', owner = ?, updated_at = ? WHERE id = ?",
+                      [(owner, now, row['id']) for row in rows])
+        return [dict(row) for row in rows], None
+
+def complete_send(message_id, owner, gmail_id=None, error=None):
+    """Marks a claimed message sent (with Gmail's message id) or failed. Ignored if owner no longer holds it."""
+    now = time.time()
+    with connect() as conn:
+        if error is None:
+            conn.execute('''UPDATE outbox SET status = 'sent', message_id = ?, sent_at = ?, updated_at = ?
+                            WHERE id = ? AND owner = ? AND status = 'sending' ''', (gmail_id, now, now, message_id, owner))
+        else:
+            conn.execute('''UPDATE outbox SET status = 'failed', error = ?, updated_at = ?
+                            WHERE id = ? AND owner = ? AND status = 'sending' ''', (str(error), now, message_id, owner))
+
+def release_sends(message_ids, owner):
+    """Puts claimed messages back in the queue unsent (e.g. while Gmail's circuit is open)."""
+    now = time.time()
+    with transaction() as conn:
+        conn.executemany('''UPDATE outbox SET status = 'scheduled', owner = NULL, updated_at = ?
+                            WHERE id = ? AND owner = ? AND status = 'sending' ''',
+                         [(now, message_id, owner) for message_id in message_ids])
+
+def cancel_sends(campaign_id=None):
+    """Cancels messages still waiting to go out, for one campaign or all of them. Returns how many."""
+    now = time.time()
+    with connect() as conn:
+        if campaign_id is None:
+            c = conn.execute("UPDATE outbox SET status = 'cancelled', updated_at = ? WHERE status = 'scheduled'", (now,))
+        else:
+            c = conn.execute("UPDATE outbox SET status = 'cancelled', updated_at = ? WHERE status = 'scheduled' AND campaign_id = ?",
+                             (now, campaign_id))
+    return c.rowcount
+
+def outbox_status(campaign_id=None):
+    """Returns {status: count} for one campaign's messages, or the whole outbox."""
+    with connect() as conn:
+        if campaign_id is None:
+            rows = conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        else:
+            rows = conn.execute("SELECT status, COUNT(*) FROM outbox WHERE campaign_id = ? GROUP BY status", (campaign_id,)).fetchall()
+    return dict(rows)
+
+def sends_in_window():
+    """Returns (emails sent in the rolling daily window, next send_at still scheduled or None)."""
+    now = time.time()
+    with connect() as conn:
+        sent = conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'sent' AND sent_at > ?",
+                            (now - SEND_WINDOW_SECONDS,)).fetchone()[0]
+        next_at = conn.execute("SELECT MIN(send_at) FROM outbox WHERE status = 'scheduled'").fetchone()[0]
+    return sent, next_at
+
+def add_run(run_id, kind, list_id=None):
+    """Registers a run or campaign so its spans can be found from the app ("run", "background" or "campaign")."""
+    with connect() as conn:
+        conn.execute("INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?)", (run_id, kind, list_id, time.time()))
+
+def recent_runs(list_id=None, limit=10):
+    """Returns [(run_id, kind, list_id, started_at)], newest first, for one lead list or all of them."""
+    with connect() as conn:
+        if list_id is None:
+            return conn.execute("SELECT * FROM runs ORDER BY started_at DESC LIMIT ?", (limit,)).fetchall()
+        return conn.execute("SELECT * FROM runs WHERE list_id = ? ORDER BY started_at DESC LIMIT ?",
+                            (list_id, limit)).fetchall()
+
+def record_spans(rows):
+    """
+    Stores (run_id, list_id, lead_index, name, started_at, seconds, outcome,
+    input_tokens, output_tokens) rows, then drops spans and runs past SPAN_TTL_SECONDS.
+    """
+    cutoff = time.time() - SPAN_TTL_SECONDS
+    with transaction() as conn:
+        conn.executemany("INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("DELETE FROM spans WHERE started_at < ?", (cutoff,))
+        conn.execute("DELETE FROM runs WHERE started_at < ?", (cutoff,))
+
+def get_spans(run_id):
+    """Every span of a run, in start order."""
+    with connect() as conn:
+        return conn.execute("SELECT * FROM spans WHERE run_id = ? ORDER BY started_at", (run_id,)).fetchall()
+
+def span_runs(limit=20):
+    """Returns [(run_id, first span, leads, spans, wall-clock seconds)] for the most recently started runs."""
+    with connect() as conn:
+        return conn.execute('''SELECT run_id, MIN(started_at), COUNT(DISTINCT lead_index), COUNT(*),
+                                       MAX(started_at + seconds) - MIN(started_at)
+                                FROM spans WHERE run_id IN (SELECT run_id FROM runs ORDER BY started_at DESC LIMIT ?)
+                                GROUP BY run_id ORDER BY MIN(started_at) DESC''', (limit,)).fetchall()
+
+def span_stages(run_id):
+    """
+    Per span name of a run: (name, spans, total seconds, p50, p95, failed,
+    input tokens, output tokens), busiest first.
+    """
+    with connect() as conn:
+        totals = conn.execute('''SELECT name, COUNT(*), SUM(seconds), SUM(outcome != 'ok'), SUM(input_tokens), SUM(output_tokens)
+                                  FROM spans WHERE run_id = ? GROUP BY name ORDER BY SUM(seconds) DESC''', (run_id,)).fetchall()
+        stages = []
+        for name, count, total, failed, input_tokens, output_tokens in totals:
+            # Percentiles straight off the (run_id, name, seconds) index
+            pick = lambda q: conn.execute("SELECT seconds FROM spans WHERE run_id = ? AND name = ? ORDER BY seconds LIMIT 1 OFFSET ?",
+                                          (run_id, name, int(q * (count - 1)))).fetchone()[0]
+            stages.append((name, count, total, pick(0.5), pick(0.95), failed, input_tokens, output_tokens))
+    return stages
+
+def lead_timings(run_id, names, limit=50):
+    """
+    The run's slowest leads: (lead_indexes, wall-clock seconds, {name: seconds per lead})
+    with each lead's seconds summed per span name in names.
+    """
+    sums = ", ".join("SUM(CASE WHEN name = ? THEN seconds ELSE 0 END)" for _ in names)
+    with connect() as conn:
+        rows = conn.execute(f'''SELECT lead_index, MAX(started_at + seconds) - MIN(started_at){", " + sums if names else ""}
+                                FROM spans WHERE run_id = ? GROUP BY lead_index ORDER BY 2 DESC LIMIT ?''',
+                            (*names, run_id, limit)).fetchall()
+    values = list(zip(*rows)) or [()] * (len(names) + 2)
+    return list(values[0]), list(values[1]), {name: list(column) for name, column in zip(names, values[2:])}
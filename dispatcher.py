@@ -0,0 +1,165 @@
+"""
+Send dispatcher for the outreach outbox.
+"Execute Outreach" only schedules messages in leadflow.db; a dispatcher thread
+(started by the app) or process (`python dispatcher.py`) sends each one when
+it falls due, under the rolling daily cap shared by every session. Any number
+of dispatchers can run against the same database without double-sending.
+"""
+import argparse
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+import metrics
+import ratelimit
+import tracing
+from database import (init_db, get_setting, last_scheduled_at, schedule_sends, claim_due_sends,
+                      complete_send, release_sends, outbox_status)
+
+DEFAULT_DAILY_LIMIT = 20
+# Human jitter between consecutive sends ("reading time" simulation)
+JITTER_SECONDS = (30, 90)
+# Longest the dispatcher sleeps before re-checking the outbox (new campaigns, cancellations)
+POLL_SECONDS = 5
+
+FOOTER = "\n\n---\nSent via LeadFlow AI\nReply 'Unsubscribe' to stop."
+
+def daily_limit():
+    """The daily send cap set from the app's Safety sidebar."""
+    return int(get_setting('daily_send_limit', DEFAULT_DAILY_LIMIT))
+
+def pacing_enabled():
+    """Whether new campaigns are spaced by human jitter (the default) or sent in Gmail batches."""
+    return get_setting('send_pacing', '1') == '1'
+
+def human_delay():
+    """Variable delay based on "reading time" simulation, plus a small jitter."""
+    return random.randint(*JITTER_SECONDS) + random.randint(1, 5)
+
+def schedule_campaign(campaign_id, from_header, leads, paced=True, list_id=None):
+    """
+    Queues one email per (lead_index, lead row), placed after anything already
+    waiting. Paced campaigns are spaced by human jitter; unpaced ones are all due
+    at once and go out in Gmail batches. With list_id, send outcomes are written
+    to those leads in the lead store. Returns the last send time.
+    """
+    send_at = max(time.time(), (last_scheduled_at() or 0) + (human_delay() if paced else 0))
+    messages = []
+    for lead_index, row in leads:
+        full_body = f"{row['Opener']}\n\n{row['Body']}\n\n{row['Closing']}{FOOTER}"
+        messages.append((lead_index, from_header, row['Email'], row['Subject'], full_body, send_at))
+        if paced:
+            send_at += human_delay()
+    schedule_sends(campaign_id, messages, list_id)
+    return messages[-1][5] if messages else None
+
+def _settle(owner, message, result, error, started_at, seconds):
+    if error is None and not result:
+        error = "Failed"
+    complete_send(message['id'], owner, gmail_id=result.get('id') if result else None, error=error)
+    metrics.record("send.gmail", seconds, "ok" if error is None else "error")
+    # Spans are filed under the campaign, one per lead
+    tracing.span("send.gmail", started_at, seconds, "ok" if error is None else "error",
+                 lead=(message['campaign_id'], message['list_id'], message['lead_index']))
+
+def dispatch_once(owner, service):
+    """
+    Sends the messages that are due: one at a time when paced, or in one Gmail
+    batch when several are due together. Returns when to check again (None if
+    nothing is scheduled).
+    """
+    # The Google API client loads on the first send, not with the app
+    from gmail_service import create_message, send_email, send_batch, GMAIL_BATCH_SIZE
+
+    messages, wake_at = claim_due_sends(owner, daily_limit(), GMAIL_BATCH_SIZE)
+    if not messages:
+        return wake_at
+
+    started = time.time()
+    raw = [create_message(m['sender'], m['recipient'], m['subject'], m['body']) for m in messages]
+    if len(messages) == 1:
+        try:
+            results = [(send_email(service, 'me', raw[0]), None)]
+        except Exception as e:
+            results = [(None, e)]
+    else:
+        results = send_batch(service, 'me', raw)
+
+    # Per-email cost of the round trip(s), comparable between both paths
+    seconds = (time.time() - started) / len(messages)
+    held, circuit_error = [], None
+    for message, (result, error) in zip(messages, results):
+        if isinstance(error, ratelimit.CircuitOpenError):
+            # Never attempted: keep it queued until Gmail recovers
+            held.append(message['id'])
+            circuit_error = error
+        else:
+            _settle(owner, message, result, error, started, seconds)
+    tracing.flush()
+    if held:
+        release_sends(held, owner)
+        raise circuit_error
+    return time.time()
+
+class SendDispatcher(threading.Thread):
+    """Daemon thread draining the outbox; last_error holds the most recent failure to reach Gmail."""
+
+    def __init__(self, poll=POLL_SECONDS):
+        super().__init__(daemon=True, name="leadflow-dispatcher")
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.poll = poll
+        self.last_error = None
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        from gmail_service import authenticate_gmail
+
+        while not self._stop_event.is_set():
+            wait = self.poll
+            try:
+                if outbox_status().get('scheduled'):
+                    # Cached, and refreshes the token ahead of expiry
+                    service = authenticate_gmail(interactive=False)
+                    wake_at = dispatch_once(self.owner, service)
+                    if wake_at is not None:
+                        wait = min(self.poll, max(0.0, wake_at - time.time()))
+                self.last_error = None
+            except Exception as e:
+                # A missing or revoked token, or Gmail's circuit being open; retried on the next poll
+                self.last_error = str(e)
+            self._stop_event.wait(wait)
+
+def main():
+    parser = argparse.ArgumentParser(description="LeadFlow AI send dispatcher")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="Longest wait between outbox checks")
+    parser.add_argument("--once", action="store_true", help="Exit when nothing is left to send")
+    args = parser.parse_args()
+
+    from gmail_service import authenticate_gmail
+
+    init_db()
+    tracing.start_exporter()
+    authenticate_gmail(interactive=False)
+    owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    print(f"[OK] Dispatcher {owner} started (daily limit {daily_limit()})")
+
+    while True:
+        try:
+            wake_at = dispatch_once(owner, authenticate_gmail(interactive=False))
+        except ratelimit.CircuitOpenError as e:
+            print(f"[ERROR] {e}")
+            wake_at = time.time() + args.poll
+        if wake_at is None:
+            if args.once:
+                break
+            wake_at = time.time() + args.poll
+        time.sleep(min(args.poll, max(0.0, wake_at - time.time())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Fused research + copy: one LLM request per lead takes the compacted search
+results and the offer and returns both the H.E.A.T. summary fields and the
+email fields, instead of a summarize call followed by a copywriting call.
+The summary half is written back in the two-call format, so 'Enriched Data'
+and the email columns look the same either way.
+"""
+import os
+import json
+import hashlib
+
+from clients import get_stage_llm, get_escalation_llm, complete, json_schema_format
+from compaction import compact_results, COMPACT_BUDGET_TOKENS
+from research_agent import HEAT_INSTRUCTIONS, personalize_company_research
+from copywriter_agent import (copy_brief, repair_fields, validate_email, parse_json_fields, _json_preview, copy_key,
+                              store_email, EMAIL_FIELDS, COPY_INPUT_FIELDS, COPY_PROMPT_VERSION)
+from database import cache_get, cache_put
+import metrics
+
+# JSON keys of the summary half, and their labels in the two-call summary format
+SUMMARY_FIELDS = {
+    "reliability_score": "RELIABILITY_SCORE",
+    "score_reason": "SCORE_REASON",
+    "trigger": "TRIGGER",
+    "pain": "PAIN",
+    "signal": "SIGNAL",
+}
+FUSED_FIELDS = tuple(SUMMARY_FIELDS) + EMAIL_FIELDS
+
+FUSED_JSON_FORMAT = """
+    {"reliability_score": "1-10, based on strength of trigger events",
+     "score_reason": "short justification for the score",
+     "trigger": "specific event/change",
+     "pain": "likely business pain following the trigger",
+     "signal": "summary of SLAM/HEAT findings",
+     "subject": "subject line, one line, under 60 characters",
+     "opener": "greeting plus the recognition sentence",
+     "body": "the value/win and the proposal",
+     "closing": "the reply-first question, then a sign-off"}
+"""
+
+SUMMARY_FALLBACK = {
+    "reliability_score": "1",
+    "score_reason": "No usable research",
+    "trigger": "Unknown",
+    "pain": "Unknown",
+    "signal": "Unknown",
+}
+
+def validate_fused(values: dict):
+    """
+    validate_email plus the summary fields the rest of the app reads. A whole
+    number score written as "7.0" or " 8" is accepted and normalized to "7"/"8".
+    """
+    problems = validate_email(values)
+    for field in ("trigger", "pain"):
+        if not values.get(field):
+            problems[field] = "missing"
+    try:
+        score = float(str(values.get("reliability_score", "")).strip())
+    except ValueError:
+        score = None
+    if score is None or not score.is_integer() or not 1 <= score <= 10:
+        problems["reliability_score"] = "must be a whole number from 1 to 10"
+    else:
+        values["reliability_score"] = str(int(score))
+    return problems
+
+def format_summary(values: dict):
+    """The summary half as 'RELIABILITY_SCORE: ...' lines, like summarize_results output."""
+    return "\n".join(f"{label}: {values.get(field, '')}" for field, label in SUMMARY_FIELDS.items())
+
+def research_and_copy(lead_row: dict, search_results: list, openrouter_api_key: str = None, user_offer: str = "",
+                      force_refresh: bool = False, on_token=None, models: dict = None, company_level: bool = False):
+    """
+    Returns (enriched_data, (subject, opener, body, closing)) from one LLM call.
+    With company_level (search_results are the shared company research for the
+    lead's domain), enriched_data starts with the same CONTACT line as
+    personalize_company_research on the two-call path.
+    Results are cached under the "fused" level, keyed by prompt version, model,
+    search results, lead fields and offer; only fields that fail validation are
+    re-requested, on the repair model (models overrides clients.STAGE_MODELS).
+    The email also goes to the "copy" level, so incremental runs see the lead as current.
+    """
+    openrouter_api_key = openrouter_api_key or os.getenv("OPENROUTER_API_KEY")
+    llm = get_stage_llm(openrouter_api_key, "fused", models)
+    lead_fields = [str(lead_row.get(f, '')) for f in COPY_INPUT_FIELDS if f != 'Enriched Data']
+    payload = json.dumps([COPY_PROMPT_VERSION, llm.model_name, COMPACT_BUDGET_TOKENS, search_results, lead_fields, user_offer],
+                         default=str)
+    key = hashlib.sha256(payload.encode()).hexdigest()
+
+    values = None
+    if not force_refresh:
+        hit = cache_get("fused", key)
+        metrics.record("cache.fused", 0.0, "hit" if hit is not None else "miss")
+        values = json.loads(hit) if hit is not None else None
+
+    fresh = values is None
+    if fresh:
+        brief, fallback = copy_brief(lead_row, user_offer, research="The H.E.A.T. findings you extract from the search results above.")
+        base = f"""{HEAT_INSTRUCTIONS}
+    Search Results:
+    {compact_results(search_results)}
+{brief}"""
+        prompt = base + f"""
+    Respond with ONLY a JSON object (no code fences, no commentary) with these string fields:{FUSED_JSON_FORMAT}"""
+        metrics.add("copywrite", "drafts")
+        reply = complete(llm, prompt, "fused", _json_preview(on_token) if on_token else None,
+                         json_schema_format("fused", FUSED_FIELDS))
+        values, parsed = parse_json_fields(reply, FUSED_FIELDS)
+        if not parsed:
+            metrics.add("copywrite", "parse_failed")
+        repair = get_stage_llm(openrouter_api_key, "repair", models)
+        values = repair_fields(repair, base, values, validate_fused, {**SUMMARY_FALLBACK, **fallback}, stage="fused",
+                               escalate=get_escalation_llm(openrouter_api_key, repair, models))
+
+    enriched = format_summary(values)
+    if company_level:
+        enriched = personalize_company_research(enriched, lead_row)
+    if fresh:
+        cache_put("fused", key, json.dumps(values))
+        store_email(copy_key({**lead_row, 'Enriched Data': enriched}, user_offer, llm.model_name),
+                    tuple(values[field] for field in EMAIL_FIELDS))
+    elif on_token:
+        on_token(f"[SUBJECT]: {values['subject']}\n[MESSAGE]: {values['opener']}\n\n{values['body']}\n\n{values['closing']}")
+
+    return enriched, tuple(values[field] for field in EMAIL_FIELDS)
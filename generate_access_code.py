@@ -2,134 +2,124 @@
 Access Code Generator for LeadFlow AI
 Generates unique access codes for Pro users
 """
-import sqlite3
-import secrets
-import string
+import csv
+import time
 
-def generate_code(length=12):
-    """Generate a secure random access code"""
-    alphabet = string.ascii_uppercase + string.digits
-    code = ''.join(secrets.choice(alphabet) for _ in range(length))
-    # Format as XXXX-XXXX-XXXX for readability
-    return f"{code[:4]}-{code[4:8]}-{code[8:]}"
+from database import (init_db, new_access_codes, mint_access_codes, add_access_code as store_access_code,
+                      list_access_codes as get_access_codes)
+
+CSV_FIELDS = ["code", "is_used", "used_by", "used_at", "created_at", "description"]
+
+def generate_code():
+    """Generate a secure random access code (XXXX-XXXX-XXXX)"""
+    return new_access_codes(1)[0]
 
 def add_access_code(code=None, description=""):
     """Add a new access code to the database"""
     if code is None:
-        code = generate_code()
-    
-    conn = sqlite3.connect('leadflow.db')
-    cursor = conn.cursor()
-    
-    # Create table if it doesn't exist
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS access_codes (
-            code TEXT PRIMARY KEY,
-            used INTEGER DEFAULT 0,
-            used_by TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            description TEXT
-        )
-    ''')
-    
-    try:
-        cursor.execute(
-            'INSERT INTO access_codes (code, description) VALUES (?, ?)',
-            (code, description)
-        )
-        conn.commit()
-        print(f"[OK] Access Code Generated: {code}")
-        if description:
-            print(f"   Description: {description}")
-        return code
-    except sqlite3.IntegrityError:
+        code = mint_access_codes(1, description)[0]
+    elif not store_access_code(code, description):
         print(f"[ERROR] Code already exists: {code}")
         return None
-    finally:
-        conn.close()
+    print(f"[OK] Access Code Generated: {code}")
+    if description:
+        print(f"   Description: {description}")
+    return code
+
+def _when(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)) if timestamp else ""
 
 def list_access_codes():
     """List all access codes and their status"""
-    conn = sqlite3.connect('leadflow.db')
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute('''
-            SELECT code, used, used_by, created_at, description 
-            FROM access_codes 
-            ORDER BY created_at DESC
-        ''')
-        codes = cursor.fetchall()
-        
-        if not codes:
-            print("No access codes found.")
-            return
-        
-        print("\n" + "="*80)
-        print("ACCESS CODES")
-        print("="*80)
-        for code, used, used_by, created_at, description in codes:
-            status = "[USED]" if used else "[AVAILABLE]"
-            print(f"\n{status} | {code}")
-            print(f"   Created: {created_at}")
-            if description:
-                print(f"   Description: {description}")
-            if used_by:
-                print(f"   Used by: {used_by}")
-        print("="*80 + "\n")
-    except sqlite3.OperationalError:
-        print("[ERROR] Access codes table doesn't exist yet.")
-    finally:
-        conn.close()
-
-def generate_multiple(count=5, description=""):
-    """Generate multiple access codes"""
+    codes = get_access_codes()
+    if not codes:
+        print("No access codes found.")
+        return
+
+    print("\n" + "="*80)
+    print("ACCESS CODES")
+    print("="*80)
+    for code, used, used_by, used_at, created_at, description in codes:
+        status = "[USED]" if used else "[AVAILABLE]"
+        print(f"\n{status} | {code}")
+        print(f"   Created: {_when(created_at)}")
+        if description:
+            print(f"   Description: {description}")
+        if used_by:
+            print(f"   Used by: {used_by} at {_when(used_at)}")
+    print("="*80 + "\n")
+
+def export_csv(path, codes=None):
+    """Write codes (all stored codes by default) to a CSV file"""
+    rows = get_access_codes() if codes is None else codes
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        for code, used, used_by, used_at, created_at, description in rows:
+            writer.writerow([code, used, used_by or "", _when(used_at), _when(created_at), description or ""])
+    print(f"[OK] {len(rows)} codes written to {path}")
+
+def generate_multiple(count=5, description="", csv_path=None):
+    """Generate multiple access codes in one transaction, optionally exporting them to CSV"""
     print(f"\nGenerating {count} access codes...\n")
-    codes = []
-    for i in range(count):
-        desc = f"{description} #{i+1}" if description else f"Batch code #{i+1}"
-        code = add_access_code(description=desc)
-        if code:
-            codes.append(code)
-    
-    print(f"\nGenerated {len(codes)} codes successfully!")
+    started = time.perf_counter()
+    codes = mint_access_codes(count, description or "Batch code", numbered=True)
+    elapsed = time.perf_counter() - started
+    now = time.time()
+
+    if csv_path:
+        export_csv(csv_path, [(code, 0, None, None, now, f"{description or 'Batch code'} #{i}")
+                              for i, code in enumerate(codes, 1)])
+    elif count <= 50:
+        for code in codes:
+            print(f"[OK] {code}")
+    else:
+        print(f"[OK] {count} codes stored; pass a CSV path to export them, or run `export`.")
+
+    print(f"\nGenerated {len(codes)} codes successfully in {elapsed:.2f}s ({len(codes) / max(elapsed, 1e-9):,.0f} codes/s)!")
     return codes
 
 if __name__ == "__main__":
     import sys
-    
+
+    init_db()
     print("\nLeadFlow AI - Access Code Generator\n")
-    
+
     if len(sys.argv) > 1:
         command = sys.argv[1].lower()
-        
+
         if command == "list":
             list_access_codes()
         elif command == "generate":
             count = int(sys.argv[2]) if len(sys.argv) > 2 else 1
             description = sys.argv[3] if len(sys.argv) > 3 else ""
-            if count == 1:
+            csv_path = sys.argv[4] if len(sys.argv) > 4 else None
+            if count == 1 and not csv_path:
                 add_access_code(description=description)
             else:
-                generate_multiple(count, description)
+                generate_multiple(count, description, csv_path)
+        elif command == "export" and len(sys.argv) > 2:
+            export_csv(sys.argv[2])
         else:
             print("Usage:")
             print("  python generate_access_code.py list")
-            print("  python generate_access_code.py generate [count] [description]")
+            print("  python generate_access_code.py generate [count] [description] [codes.csv]")
+            print("  python generate_access_code.py export codes.csv")
     else:
         # Interactive mode
         print("1. Generate single code")
         print("2. Generate multiple codes")
         print("3. List all codes")
         choice = input("\nSelect option (1-3): ").strip()
-        
+
         if choice == "1":
             desc = input("Description (optional): ").strip()
             add_access_code(description=desc)
         elif choice == "2":
             count = int(input("How many codes? ").strip())
             desc = input("Description (optional): ").strip()
-            generate_multiple(count, desc)
+            csv_path = input("Export to CSV file (optional): ").strip()
+            generate_multiple(count, desc, csv_path or None)
         elif choice == "3":
             list_access_codes()
         else:
@@ -1,37 +1,103 @@
 import os
 import base64
 import pickle
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urljoin
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.http import BatchHttpRequest
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from email.mime.text import MIMEText
+import metrics
+import ratelimit
 
 # If modifying these SCOPES, delete the file token.pickle.
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
-def authenticate_gmail():
+# Point this at a local stand-in to exercise sending without a Google account
+GMAIL_API_URL = os.getenv("LEADFLOW_GMAIL_API_URL", "https://gmail.googleapis.com/")
+
+# Refresh the access token this long before it expires, so no send waits on a refresh
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Gmail accepts up to 100 calls per batch request but recommends 50 at most
+GMAIL_BATCH_SIZE = 50
+
+HTTP_TIMEOUT_S = 30
+
+_lock = threading.RLock()
+_creds = None
+# httplib2 connections are not thread-safe, so each thread keeps its own service
+# (and the keep-alive connection inside it) on top of the shared credentials.
+_local = threading.local()
+
+def _save_token(creds):
+    with open('token.pickle', 'wb') as token:
+        pickle.dump(creds, token)
+
+def _expires_soon(creds):
+    if creds.expiry is None:
+        return not creds.valid
+    # google-auth stores expiry as naive UTC
+    return creds.expiry - TOKEN_REFRESH_MARGIN <= datetime.now(timezone.utc).replace(tzinfo=None)
+
+def get_credentials(interactive=True):
     """
-    Authenticates the user and returns the Gmail service.
-    Expects 'credentials.json' in the current directory.
+    Returns the process-wide Gmail credentials, loading token.pickle once and
+    refreshing ahead of expiry. With interactive=False (background senders)
+    there is no browser consent flow.
     """
-    creds = None
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+    global _creds
+    with _lock:
+        creds = _creds
+        if creds is None and os.path.exists('token.pickle'):
+            with open('token.pickle', 'rb') as token:
+                creds = pickle.load(token)
+
+        if creds and creds.refresh_token and _expires_soon(creds):
             creds.refresh(Request())
-        else:
+            _save_token(creds)
+
+        if not creds or not creds.valid:
+            if not interactive:
+                raise RuntimeError("Gmail is not authenticated. Click 'Authenticate Gmail' in the app first.")
             if not os.path.exists('credentials.json'):
                 raise FileNotFoundError("Missing 'credentials.json'. Please download it from Google Cloud Console.")
             flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
             creds = flow.run_local_server(port=0)
-        
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+            _save_token(creds)
+
+        _creds = creds
+        return creds
+
+def build_service(creds, api_url=None):
+    """Gmail client over a persistent connection, built from the bundled discovery document."""
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT_S))
+    return build('gmail', 'v1', http=http, static_discovery=True,
+                 client_options={'api_endpoint': api_url or GMAIL_API_URL})
 
-    return build('gmail', 'v1', credentials=creds)
+def authenticate_gmail(interactive=True):
+    """
+    Authenticates the user and returns the Gmail service.
+    Expects 'credentials.json' in the current directory.
+    Credentials and the service are cached, so repeated calls are cheap.
+    """
+    creds = get_credentials(interactive)
+    if getattr(_local, 'creds', None) is not creds:
+        _local.service = build_service(creds)
+        _local.creds = creds
+    return _local.service
+
+def reset_gmail():
+    """Forgets cached credentials and services (e.g. after token.pickle was replaced)."""
+    global _creds
+    with _lock:
+        _creds = None
+        _local.__dict__.clear()
 
 def get_user_email(service):
     """Get the authenticated user's email address."""
@@ -48,10 +114,61 @@ def create_message(sender, to, subject, message_text):
     return {'raw': raw_message}
 
 def send_email(service, user_id, message):
-    """Send an email message."""
+    """
+    Send an email message.
+    Only throttled sends are retried: after a 5xx the message may already be out.
+    """
     try:
-        response = service.users().messages().send(userId=user_id, body=message).execute()
+        request = service.users().messages().send(userId=user_id, body=message)
+        response = ratelimit.call("gmail", request.execute, retry_on=ratelimit.is_throttled)
         return response
     except Exception as e:
         print(f'An error occurred: {e}')
         raise e # Re-raise to be caught by the caller
+
+def send_batch(service, user_id, messages, api_url=None):
+    """
+    Sends messages through Gmail batch requests, up to GMAIL_BATCH_SIZE per HTTP round trip.
+    Each message takes a slot from the Gmail rate limit; throttled ones are
+    retried in a later batch. Returns [(response, error)] in the order of messages.
+    """
+    results = [(None, None)] * len(messages)
+
+    def collect(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    batch_uri = urljoin(api_url or GMAIL_API_URL, 'batch/gmail/v1')
+    pending = list(range(len(messages)))
+    for attempt in range(ratelimit.MAX_RETRIES + 1):
+        for start in range(0, len(pending), GMAIL_BATCH_SIZE):
+            chunk = pending[start:start + GMAIL_BATCH_SIZE]
+            batch = BatchHttpRequest(callback=collect, batch_uri=batch_uri)
+            added = []
+            for i in chunk:
+                try:
+                    ratelimit.check("gmail")
+                except ratelimit.CircuitOpenError as e:
+                    results[i] = (None, e)
+                    continue
+                batch.add(service.users().messages().send(userId=user_id, body=messages[i]), request_id=str(i))
+                added.append(i)
+            if not added:
+                continue
+            try:
+                batch.execute()
+            except Exception as e:
+                print(f'An error occurred: {e}')
+                for i in added:
+                    if results[i] == (None, None):
+                        results[i] = (None, e)
+            for i in added:
+                ratelimit.record_outcome("gmail", results[i][1])
+
+        pending = [i for i in pending if results[i][1] is not None and ratelimit.is_throttled(results[i][1])]
+        if not pending or attempt == ratelimit.MAX_RETRIES:
+            break
+        for i in pending:
+            results[i] = (None, None)
+        metrics.add("ratelimit.gmail", "retry", len(pending))
+        time.sleep(ratelimit.backoff(attempt))
+    return results
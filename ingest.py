@@ -0,0 +1,202 @@
+"""
+Lead list ingestion.
+Uploaded CSV, TXT/TSV and XLSX files are read in fixed-size chunks, cleaned
+chunk by chunk (emails and domains normalized, invalid and duplicate emails
+dropped) and written to the lead store in leadflow.db, so memory use stays
+flat however long the list is. The delimiter and encoding are sniffed
+from the first few KB instead of decoding the whole file. Lists are read
+back a page at a time.
+"""
+import codecs
+import csv
+import io
+import re
+
+import pandas as pd
+
+from database import create_lead_list, delete_lead_list, insert_leads, get_leads, LEAD_COLUMNS, LEAD_INPUT_COLUMNS
+
+# Rows read, cleaned and written per batch
+CHUNK_ROWS = 5000
+# Bytes inspected to pick the encoding and delimiter
+SNIFF_BYTES = 16 * 1024
+DELIMITERS = ",\t;|"
+
+def sniff_encoding(prefix: bytes):
+    """Encoding of a file starting with prefix: a BOM if there is one, else UTF-8, else Windows-1252."""
+    if prefix.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if prefix.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    for encoding in ("utf-8", "cp1252"):
+        try:
+            # Not final: the prefix may end partway through a character
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            pass
+    return "latin-1"
+
+def sniff_delimiter(sample: str):
+    """The delimiter used in sample (whole lines of the file), comma if it can't be told."""
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        return "\t" if "\t" in sample.split("\n", 1)[0] else ","
+
+def _xlsx_chunks(file, chunk_rows):
+    from openpyxl import load_workbook
+
+    # read_only streams rows from the sheet XML instead of loading the workbook
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(h) if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)]
+        chunk = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            chunk.append(["" if value is None else str(value) for value in row])
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+def read_chunks(file, name: str, chunk_rows: int = CHUNK_ROWS):
+    """Yields a lead file (binary file object) as DataFrames of up to chunk_rows rows, every value a string."""
+    if name.lower().endswith('.xlsx'):
+        yield from _xlsx_chunks(file, chunk_rows)
+        return
+
+    prefix = file.read(SNIFF_BYTES)
+    file.seek(0)
+    encoding = sniff_encoding(prefix)
+    text = prefix.decode(encoding, errors="ignore")
+    sep = sniff_delimiter(text[:text.rfind("\n")] if "\n" in text else text)
+
+    stream = io.TextIOWrapper(file, encoding=encoding, errors="replace", newline="")
+    try:
+        yield from pd.read_csv(stream, sep=sep, dtype=str, keep_default_na=False, chunksize=chunk_rows)
+    finally:
+        # Leave the caller's file object open
+        stream.detach()
+
+# Header aliases per target field, matched after normalize_header
+HEADER_PATTERNS = {
+    'first_name': ['first name', 'fname', 'first', 'given name', 'f.name'],
+    'last_name': ['last name', 'lname', 'last', 'surname', 'family name', 'l.name'],
+    'name': ['name', 'founder', 'contact', 'person', 'full name', 'founder name', 'lead name'],
+    'email': ['email', 'e-mail', 'mail', 'contact email', 'email address'],
+    'domain': ['domain', 'website', 'url', 'company website', 'company url', 'site'],
+    'linkedin': ['linkedin', 'linkedin url', 'profile', 'linkedin profile', 'li url'],
+    'position': ['position', 'title', 'job title', 'role', 'designation'],
+    'location': ['location', 'city', 'country', 'state', 'address', 'hq']
+}
+
+FIELD_LABELS = {'email': 'Email', 'domain': 'Domain', 'linkedin': 'Linkedin', 'position': 'Position', 'location': 'Location'}
+
+_SEPARATORS = re.compile(r"[\s_.\-]+")
+# local@domain.tld, no spaces or second @
+EMAIL_PATTERN = r"[^@\s]+@[^@\s]+\.[^@\s.]{2,}"
+
+def normalize_header(header):
+    """'E-Mail_Address ' -> 'e mail address'; the alias index uses the same form."""
+    return _SEPARATORS.sub(" ", str(header).lower()).strip()
+
+# alias -> target field, built once
+HEADER_ALIASES = {normalize_header(alias): target for target, aliases in HEADER_PATTERNS.items() for alias in aliases}
+
+def map_headers(columns):
+    """{target field: position of the first column whose header is one of its aliases}."""
+    positions = {}
+    for position, header in enumerate(columns):
+        positions.setdefault(HEADER_ALIASES.get(normalize_header(header)), position)
+    positions.pop(None, None)
+    return positions
+
+def normalize_domains(domains: pd.Series):
+    """Vectorized research_agent.normalize_domain: 'https://www.Acme.io/about' -> 'acme.io'."""
+    domains = domains.str.strip().str.lower().str.replace(r"^[a-z][a-z0-9+.\-]*://", "", regex=True)
+    return domains.str.replace(r"[/?#:].*$", "", regex=True).str.replace(r"^www\.", "", regex=True)
+
+def clean_data(df):
+    """
+    Maps a raw chunk onto the lead columns, normalizes emails (trimmed,
+    lowercase) and domains, and drops rows without a valid email or repeating
+    one earlier in the chunk. Returns (cleaned_df, {"invalid": n, "duplicate": n}).
+    """
+    positions = map_headers(df.columns)
+    column = lambda target: df.iloc[:, positions[target]].fillna('').astype(str).str.strip()
+
+    cleaned_df = pd.DataFrame(index=df.index)
+
+    # Logic for Founder Name (Flexible)
+    if 'first_name' in positions and 'last_name' in positions:
+        # Combine if both exist
+        cleaned_df['Founder Name'] = (column('first_name') + " " + column('last_name')).str.strip()
+    elif 'name' in positions:
+        cleaned_df['Founder Name'] = column('name')
+    elif 'first_name' in positions:
+        cleaned_df['Founder Name'] = column('first_name')
+    else:
+        cleaned_df['Founder Name'] = ""
+
+    # Map other fields with default empty values if not found
+    for key, label in FIELD_LABELS.items():
+        cleaned_df[label] = column(key) if key in positions else ""
+    cleaned_df['Email'] = cleaned_df['Email'].str.lower()
+    cleaned_df['Domain'] = normalize_domains(cleaned_df['Domain'])
+
+    valid = cleaned_df['Email'].str.fullmatch(EMAIL_PATTERN)
+    duplicate = valid & cleaned_df['Email'].duplicated()
+    stats = {"invalid": int((~valid).sum()), "duplicate": int(duplicate.sum())}
+    return cleaned_df[valid & ~duplicate].reset_index(drop=True), stats
+
+def ingest_file(file, name: str, chunk_rows: int = CHUNK_ROWS):
+    """
+    Streams a lead file into a new list in the lead store, one cleaned chunk
+    per transaction; an email already stored from an earlier chunk counts as a
+    duplicate. Returns (list_id, rows written, {"invalid": n, "duplicate": n}).
+    The list is created only once the first chunk has been read and cleaned, and
+    removed again if a later chunk fails; raises ValueError if no lead is usable.
+    """
+    list_id = None
+    total, dropped = 0, {"invalid": 0, "duplicate": 0}
+    try:
+        for chunk in read_chunks(file, name, chunk_rows):
+            cleaned, stats = clean_data(chunk)
+            if list_id is None:
+                list_id = create_lead_list(name)
+            added = insert_leads(list_id, zip(*(cleaned[label] for label in LEAD_INPUT_COLUMNS)))
+            dropped["invalid"] += stats["invalid"]
+            dropped["duplicate"] += stats["duplicate"] + len(cleaned) - added
+            total += added
+        if not total:
+            raise ValueError(f"No usable leads in {name} ({dropped['invalid']} invalid, {dropped['duplicate']} duplicate rows)")
+    except BaseException:
+        if list_id is not None:
+            delete_lead_list(list_id)
+        raise
+    return list_id, total, dropped
+
+def load_leads(list_id: str, offset: int = 0, limit: int = None, columns=None, status: str = None):
+    """A page of a lead list (only the given column labels) as a DataFrame indexed by lead_index."""
+    index, values = get_leads(list_id, offset, limit, columns, status)
+    return pd.DataFrame(values, index=index, columns=list(columns or LEAD_COLUMNS))
+
+def iter_leads(list_id: str, columns=None, status: str = None, page_rows: int = CHUNK_ROWS):
+    """Yields (lead_index, lead dict) for a whole lead list, reading page_rows leads at a time."""
+    after = -1
+    while True:
+        index, values = get_leads(list_id, limit=page_rows, columns=columns, status=status, after=after)
+        if not index:
+            return
+        for i, lead_index in enumerate(index):
+            yield lead_index, {label: column[i] for label, column in values.items()}
+        after = index[-1]
@@ -0,0 +1,67 @@
+"""
+In-process latency and outcome counters for tuning the pipeline.
+Names are dotted, e.g. "search.tavily" or "search.rss".
+"""
+import threading
+from collections import defaultdict, deque
+
+# Keep the most recent samples per name so long runs don't grow memory
+MAX_SAMPLES = 2000
+
+_lock = threading.Lock()
+_counters = defaultdict(lambda: defaultdict(int))
+_latencies = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+
+def record(name, seconds, outcome="ok"):
+    """Records one call under name with its wall-clock seconds and outcome label."""
+    with _lock:
+        _counters[name]["calls"] += 1
+        _counters[name][outcome] += 1
+        _latencies[name].append(seconds)
+
+def observe(name, value):
+    """Adds a sample under name without counting a call (e.g. time-to-first-token, tokens/second)."""
+    with _lock:
+        _latencies[name].append(value)
+        _counters[name]
+
+def add(name, outcome, n=1):
+    """Adds n to a counter under name without recording a latency sample (e.g. token counts)."""
+    with _lock:
+        _counters[name][outcome] += n
+
+def _percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def snapshot(prefix=""):
+    """
+    Returns {name: {calls, ok, error, timeout, <other outcomes>, avg, p50, p95}}
+    for names starting with prefix.
+    """
+    with _lock:
+        names = [n for n in _counters if n.startswith(prefix)]
+        stats = {}
+        for name in sorted(names):
+            samples = list(_latencies[name])
+            counts = _counters[name]
+            stats[name] = {
+                "calls": counts["calls"],
+                "ok": counts["ok"],
+                "error": counts["error"],
+                "timeout": counts["timeout"],
+                **{outcome: n for outcome, n in counts.items() if outcome != "calls"},
+                "avg": round(sum(samples) / len(samples), 3) if samples else 0.0,
+                "p50": round(_percentile(samples, 50), 3),
+                "p95": round(_percentile(samples, 95), 3),
+            }
+        return stats
+
+def reset(prefix=""):
+    """Clears every counter whose name starts with prefix."""
+    with _lock:
+        for name in [n for n in _counters if n.startswith(prefix)]:
+            del _counters[name]
+            _latencies.pop(name, None)
@@ -0,0 +1,226 @@
+"""
+Staged executor for the "Generate Personalization" run.
+Search, summarization and copywriting each get their own worker pool,
+so lead N+1 can be searching while lead N is being summarized.
+"""
+import concurrent.futures as cf
+import itertools
+import time
+from collections import namedtuple
+
+import tracing
+
+from research_agent import (search_lead, summarize_lead, normalize_domain, build_query,
+                            CompanyResearch, BatchSummarizer, personalize_company_research, get_research_state_graph,
+                            reserve_search_workers)
+from clients import get_stage_llm, get_escalation_llm, stage_model, preload
+from copywriter_agent import cached_email_content, copy_is_current
+from fused_agent import research_and_copy
+
+# name: label used for thread names, fn: payload -> payload, workers: pool size
+Stage = namedtuple("Stage", ["name", "fn", "workers"])
+
+DEFAULT_CONCURRENCY = {"search": 4, "summarize": 2, "copywrite": 2}
+
+def _traced(stage, lead):
+    """stage.fn run under tracing.lead, recording its wait for a worker ("queue.<name>") and its own time ("stage.<name>")."""
+    submitted_at = time.time()
+
+    def run(payload):
+        started_at, started = time.time(), time.perf_counter()
+        tracing.span(f"queue.{stage.name}", submitted_at, started_at - submitted_at, lead=lead)
+        with tracing.lead(*lead), tracing.timed(f"stage.{stage.name}"):
+            return stage.fn(payload)
+    return run
+
+def run_pipeline(items, stages, max_in_flight=None, trace=None):
+    """
+    Pushes every (key, payload) pair through the stages in order.
+    Yields (key, payload, error) as soon as an item leaves the last stage
+    or fails in one of them, so callers can write results back as they land.
+    On failure, payload is what the failing stage was given.
+    items is consumed lazily: at most max_in_flight (by default four per
+    worker) are in the pipeline at once, so memory doesn't grow with the list.
+    With trace (key -> (run_id, list_id, lead_index)), every stage runs as that
+    lead in tracing, and spans are flushed to leadflow.db as the run goes.
+    """
+    pools = [
+        cf.ThreadPoolExecutor(max_workers=max(1, stage.workers), thread_name_prefix=f"leadflow-{stage.name}")
+        for stage in stages
+    ]
+    items = iter(items)
+    max_in_flight = max_in_flight or 4 * sum(max(1, stage.workers) for stage in stages)
+    pending = {}
+
+    def submit(step, key, payload):
+        fn = _traced(stages[step], trace(key)) if trace else stages[step].fn
+        pending[pools[step].submit(fn, payload)] = (key, step, payload)
+
+    def feed():
+        for key, payload in itertools.islice(items, max(0, max_in_flight - len(pending))):
+            submit(0, key, payload)
+
+    try:
+        feed()
+        while pending:
+            done, _ = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+            for future in done:
+                key, step, payload = pending.pop(future)
+                try:
+                    payload = future.result()
+                except Exception as e:
+                    yield key, payload, e
+                    continue
+
+                if step + 1 < len(stages):
+                    submit(step + 1, key, payload)
+                else:
+                    yield key, payload, None
+            feed()
+    finally:
+        for pool in pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if trace:
+            tracing.flush()
+
+def warm_up():
+    """
+    Imports LangChain and LangGraph and compiles the checkpoint graph, so the
+    first run or preview doesn't wait for them.
+    """
+    preload()
+    get_research_state_graph()
+
+def needs_processing(lead, user_offer="", models=None, fused=False):
+    """
+    Incremental runs: Pending and failed leads always run; Ready ones only if
+    their email was written from other inputs (offer, research, lead fields,
+    model or prompt). Scheduled and Sent leads are left alone.
+    """
+    status = str(lead.get('Status') or 'Pending')
+    if status == 'Pending' or status.startswith('Error'):
+        return True
+    if status == 'Ready':
+        return not copy_is_current(lead, user_offer, stage_model("fused" if fused else "copywrite", models))
+    return False
+
+def personalization_stages(openrouter_api_key, tavily_api_key, user_offer="", concurrency=None, search_deadline=None,
+                           force_refresh=False, group_by_domain=True, summary_batch_size=1, fused=False, models=None):
+    """
+    Builds the search -> summarize -> copywrite stages for lead dicts.
+    force_refresh bypasses the research cache for this run. With group_by_domain,
+    leads sharing a normalized Domain reuse one company-level search and summary;
+    leads without a domain fall back to per-person research.
+    With summary_batch_size > 1, up to that many leads share one summarize request;
+    the summarize pool grows to match so each worker still carries one request.
+    Research failures are recorded in 'Enriched Data' and the lead still gets
+    copy, matching the sequential loop; copywriting failures are raised.
+    Searches are checkpointed to leadflow.db until the summary is stored, and
+    finished summaries and emails are cached, so a retry resumes a lead at the
+    first stage that did not complete.
+    With fused, summarize and copywrite collapse into one "fused" stage making a
+    single LLM call per lead (searches are still shared per domain); it gets
+    both stages' workers.
+    models ({stage: tier or model id}) overrides clients.STAGE_MODELS for this run.
+    """
+    limits = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+    reserve_search_workers(limits["search"])
+    summarizer = None
+    if summary_batch_size > 1:
+        llm = get_stage_llm(openrouter_api_key, "summarize", models)
+        batcher = BatchSummarizer(llm, summary_batch_size, escalate=get_escalation_llm(openrouter_api_key, llm, models))
+        summarizer = batcher.summarize
+        limits["summarize"] *= batcher.batch_size
+    company = CompanyResearch(openrouter_api_key, tavily_api_key, search_deadline, force_refresh, summarizer, models)
+
+    def company_domain(lead):
+        return normalize_domain(lead.get('Domain')) if group_by_domain else ''
+
+    def search(lead):
+        domain = company_domain(lead)
+        try:
+            if domain:
+                lead['search_results'] = company.search(domain)
+            else:
+                lead['search_results'] = search_lead(lead, tavily_api_key, search_deadline, force_refresh)
+        except Exception as e:
+            lead['Enriched Data'] = f"Error: {e}"
+        return lead
+
+    def summarize(lead):
+        if 'search_results' in lead:
+            domain = company_domain(lead)
+            try:
+                if domain:
+                    summary = company.summarize(domain, lead.pop('search_results'))
+                    lead['Enriched Data'] = personalize_company_research(summary, lead)
+                else:
+                    lead['Enriched Data'] = summarize_lead(lead.pop('search_results'), openrouter_api_key, force_refresh, summarizer,
+                                                           query=build_query(lead), models=models)
+            except Exception as e:
+                lead['Enriched Data'] = f"Error: {e}"
+        return lead
+
+    def copywrite(lead):
+        subject, opener, body, closing = cached_email_content(lead, openrouter_api_key, user_offer,
+                                                              force_refresh=force_refresh, models=models)
+        lead.update({'Subject': subject, 'Opener': opener, 'Body': body, 'Closing': closing, 'Status': 'Ready'})
+        return lead
+
+    def research_copy(lead):
+        if 'search_results' not in lead:
+            # Search failed: the error is already in 'Enriched Data'
+            return copywrite(lead)
+        enriched, (subject, opener, body, closing) = research_and_copy(
+            lead, lead.pop('search_results'), openrouter_api_key, user_offer, force_refresh, models=models,
+            company_level=bool(company_domain(lead)))
+        lead.update({'Enriched Data': enriched, 'Subject': subject, 'Opener': opener, 'Body': body,
+                     'Closing': closing, 'Status': 'Ready'})
+        return lead
+
+    if fused:
+        return [
+            Stage("search", search, limits["search"]),
+            Stage("fused", research_copy, limits["summarize"] + limits["copywrite"]),
+        ]
+    return [
+        Stage("search", search, limits["search"]),
+        Stage("summarize", summarize, limits["summarize"]),
+        Stage("copywrite", copywrite, limits["copywrite"]),
+    ]
+
+def preview_lead(lead, openrouter_api_key, tavily_api_key, user_offer="", search_deadline=None, force_refresh=False,
+                 group_by_domain=True, on_summary_token=None, on_email_token=None, fused=False, models=None):
+    """
+    Runs one lead through search, summarize and copywriting on the caller's
+    thread, streaming both LLM replies through the on_*_token callbacks.
+    Used by the single-lead live preview. With fused, the single call streams
+    through on_email_token and the summary is handed to on_summary_token at the end.
+    """
+    domain = normalize_domain(lead.get('Domain')) if group_by_domain else ''
+    if fused:
+        if domain:
+            results = CompanyResearch(openrouter_api_key, tavily_api_key, search_deadline, force_refresh, models=models).search(domain)
+        else:
+            results = search_lead(lead, tavily_api_key, search_deadline, force_refresh)
+        enriched, (subject, opener, body, closing) = research_and_copy(lead, results, openrouter_api_key, user_offer,
+                                                                       force_refresh, on_email_token, models, bool(domain))
+        if on_summary_token:
+            on_summary_token(enriched)
+        lead.update({'Enriched Data': enriched, 'Subject': subject, 'Opener': opener, 'Body': body,
+                     'Closing': closing, 'Status': 'Ready'})
+        return lead
+
+    if domain:
+        company = CompanyResearch(openrouter_api_key, tavily_api_key, search_deadline, force_refresh, models=models)
+        summary = company.summarize(domain, company.search(domain), on_summary_token)
+        lead['Enriched Data'] = personalize_company_research(summary, lead)
+    else:
+        results = search_lead(lead, tavily_api_key, search_deadline, force_refresh)
+        lead['Enriched Data'] = summarize_lead(results, openrouter_api_key, force_refresh, on_token=on_summary_token,
+                                               query=build_query(lead), models=models)
+
+    subject, opener, body, closing = cached_email_content(lead, openrouter_api_key, user_offer, on_email_token,
+                                                          force_refresh, models)
+    lead.update({'Subject': subject, 'Opener': opener, 'Body': body, 'Closing': closing, 'Status': 'Ready'})
+    return lead
@@ -0,0 +1,255 @@
+"""
+Shared, provider-aware rate limiting for every external call (OpenRouter,
+Tavily, DuckDuckGo, RSS feeds, Gmail).
+Each provider gets a token bucket, throttling errors (429, Retry-After, Gmail
+rateLimitExceeded) are retried with exponential backoff and jitter, and a
+circuit breaker stops calling a provider that keeps failing outright.
+Counters go to metrics under "ratelimit.<provider>".
+"""
+import os
+import random
+import re
+import threading
+import time
+
+import metrics
+
+# (requests per second, burst) per provider; override with LEADFLOW_RATE_<PROVIDER>="rate:burst".
+# Scoped names such as "rss:acme.com" get their own bucket and breaker with the "rss" limits.
+PROVIDER_LIMITS = {
+    "openrouter": (5.0, 10),
+    "tavily": (1.5, 5),
+    "duckduckgo": (1.0, 2),
+    "rss": (2.0, 4),
+    # 250 quota units per second per user, 100 units per send
+    "gmail": (2.5, 5),
+}
+
+MAX_RETRIES = 4
+BACKOFF_BASE_S = 1.0
+BACKOFF_MAX_S = 30.0
+
+# Consecutive outright failures (5xx, timeouts, auth or quota errors) that open a
+# provider's circuit, and how long it stays open before one probe call is let through
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN_S = 60.0
+
+# Status codes that mean "bad request", not "provider in trouble"
+CLIENT_ERROR_CODES = (400, 404, 409, 422)
+
+_THROTTLED = re.compile(r"\b429\b|too many requests|rate.?limit|ratelimitexceeded|userratelimitexceeded", re.I)
+_TRANSIENT = re.compile(r"time.?out|timed out|temporarily unavailable|connection (reset|aborted|refused)", re.I)
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a provider whose circuit is open."""
+
+class TokenBucket:
+    """Allows rate calls per second on average, with bursts of up to capacity."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Holds every caller for seconds (the provider asked us to back off)."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.updated = self.paused_until
+            self.tokens = 0.0
+
+    def acquire(self, timeout=None):
+        """Takes one token, waiting as needed. Returns False if that would take longer than timeout."""
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.updated = self.paused_until
+                    wait = self.paused_until - now
+            if timeout is not None and now - started + wait > timeout:
+                return False
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """Opens after BREAKER_FAILURES consecutive failures; lets one probe through after the cooldown."""
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN_S):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.cooldown and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = time.time()
+            self.probing = False
+
+    def release(self):
+        """Ends a probe that neither succeeded nor failed (e.g. a throttled call)."""
+        with self._lock:
+            self.probing = False
+
+    @property
+    def retry_at(self):
+        return (self.opened_at or 0) + self.cooldown
+
+_limiters = {}
+_lock = threading.Lock()
+
+def limiter(provider):
+    """Returns the shared (TokenBucket, CircuitBreaker) for provider."""
+    with _lock:
+        if provider not in _limiters:
+            base = provider.split(":", 1)[0]
+            rate, burst = PROVIDER_LIMITS.get(base, (5.0, 10))
+            override = os.getenv(f"LEADFLOW_RATE_{base.upper()}")
+            if override:
+                rate, _, burst = override.partition(":")
+                rate, burst = float(rate), int(burst or max(1, float(rate)))
+            _limiters[provider] = (TokenBucket(rate, burst), CircuitBreaker())
+        return _limiters[provider]
+
+def status_code(exc):
+    """HTTP status of a provider exception (openai, requests, httpx, googleapiclient), or None."""
+    for candidate in (getattr(exc, "status_code", None),
+                      getattr(getattr(exc, "response", None), "status_code", None),
+                      getattr(getattr(exc, "resp", None), "status", None)):
+        if candidate is not None:
+            try:
+                return int(candidate)
+            except (TypeError, ValueError):
+                pass
+    return None
+
+def retry_after(exc):
+    """Seconds from the exception's Retry-After header, or None."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or getattr(exc, "resp", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError, AttributeError):
+        # HTTP-date form; fall back to our own backoff
+        return None
+
+def is_throttled(exc):
+    """True for "slow down" answers: 429, Gmail's 403 rateLimitExceeded, DuckDuckGo's RatelimitException."""
+    code = status_code(exc)
+    if code == 429:
+        return True
+    if code is not None and code != 403:
+        return False
+    return bool(_THROTTLED.search(f"{type(exc).__name__} {exc}"))
+
+def is_retryable(exc):
+    """Throttling, 5xx and transient network errors are worth another attempt."""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if is_throttled(exc):
+        return True
+    code = status_code(exc)
+    if code is not None:
+        return code >= 500
+    return bool(_TRANSIENT.search(f"{type(exc).__name__} {exc}"))
+
+def backoff(attempt, exc=None):
+    """Delay before retry number attempt+1: Retry-After when given, else exponential with jitter."""
+    hinted = retry_after(exc) if exc is not None else None
+    if hinted is not None:
+        return hinted + random.uniform(0, 1)
+    ceiling = min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+def record_outcome(provider, exc=None):
+    """Feeds one call's outcome to provider's breaker (and pauses its bucket when throttled)."""
+    bucket, breaker = limiter(provider)
+    if exc is None:
+        breaker.success()
+    elif is_throttled(exc):
+        # Throttling means "slower", not "down": hold the whole provider instead of opening the circuit
+        bucket.pause(retry_after(exc) or BACKOFF_BASE_S)
+        breaker.release()
+        metrics.add(f"ratelimit.{provider.split(':', 1)[0]}", "throttled")
+    elif status_code(exc) in CLIENT_ERROR_CODES:
+        breaker.release()
+    else:
+        breaker.failure()
+
+def check(provider, deadline=None):
+    """
+    Waits for a slot under provider's rate limit. Raises CircuitOpenError while
+    the circuit is open, or TimeoutError if no slot frees up before deadline
+    (a time.time() value).
+    """
+    bucket, breaker = limiter(provider)
+    name = provider.split(":", 1)[0]
+    # Breaker first, so calls rejected while it is open don't use up the bucket's tokens
+    if not breaker.allow():
+        metrics.add(f"ratelimit.{name}", "rejected")
+        raise CircuitOpenError(f"{provider} is failing repeatedly; paused until "
+                               f"{time.strftime('%H:%M:%S', time.localtime(breaker.retry_at))}")
+    if not bucket.acquire(timeout=None if deadline is None else max(0.0, deadline - time.time())):
+        # A probe that never got to run must not hold the breaker half-open
+        breaker.release()
+        metrics.add(f"ratelimit.{name}", "deadline")
+        raise TimeoutError(f"{provider}: no rate-limit slot before the deadline")
+
+def call(provider, fn, *args, deadline=None, retries=MAX_RETRIES, retry_on=is_retryable, **kwargs):
+    """
+    Runs fn(*args, **kwargs) under provider's rate limit, retrying failures that
+    retry_on accepts (throttled and transient ones by default) with backoff.
+    Gives up early rather than sleep past deadline (a time.time() value).
+    """
+    name = provider.split(":", 1)[0]
+    for attempt in range(retries + 1):
+        check(provider, deadline)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            record_outcome(provider, e)
+            if not retry_on(e) or attempt == retries:
+                raise
+            delay = backoff(attempt, e)
+            if deadline is not None and time.time() + delay > deadline:
+                raise
+            metrics.add(f"ratelimit.{name}", "retry")
+            time.sleep(delay)
+            continue
+        record_outcome(provider)
+        return result
+
+def reset():
+    """Drops every bucket and breaker (e.g. after changing limits)."""
+    with _lock:
+        _limiters.clear()
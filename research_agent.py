@@ -1,106 +1,383 @@
 import os
+import re
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import TypedDict, List
-from langgraph.graph import StateGraph, END
-from langchain_community.tools import TavilySearchResults
-from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
+from clients import (get_or_create, get_stage_llm, get_escalation_llm, get_tavily_tool, get_http_client,
+                     key_fingerprint, complete, MODEL_CONTEXT_TOKENS, DEFAULT_CONTEXT_TOKENS)
+import metrics
+import ratelimit
+import tracing
+from compaction import compact_results, estimate_tokens, COMPACT_BUDGET_TOKENS
+from database import cache_get, cache_put, DB_PATH
+from checkpoints import get_checkpointer, thread_config, load_stage, save_stage, clear_stage
+
+# Per-lead budget for the parallel provider fan-out in run_search
+SEARCH_DEADLINE_S = float(os.getenv("LEADFLOW_SEARCH_DEADLINE", "12"))
+# Stand-ins for benchmarks: a JSON endpoint answering ?q=&max_results= with DDGS.text-style
+# rows ({title, body, href}) replaces DuckDuckGo, and feeds are fetched from this template
+DDG_URL = os.getenv("LEADFLOW_DDG_URL")
+RSS_FEED_URL = os.getenv("LEADFLOW_RSS_URL", "https://{domain}/feed")
 
 # Define the state for the research graph
 class AgentState(TypedDict):
     query: str
     search_results: list
     summary: str
+    force_refresh: bool
 
-def create_research_graph(openrouter_api_key: str = None, tavily_api_key: str = None):
+def build_query(lead_row: dict):
+    """Builds the per-lead research query from the mapped lead columns."""
+    location = lead_row.get('Location', '')
+    return f"{lead_row['Founder Name']} {lead_row['Domain']} {lead_row['Position']} {location} recent news funding achievements"
+
+def normalize_domain(domain):
+    """Reduces 'https://www.Acme.io/about' style values to 'acme.io'."""
+    domain = str(domain or '').strip().lower()
+    domain = domain.split('://', 1)[-1].split('/', 1)[0].split('?', 1)[0].split(':', 1)[0]
+    return domain[4:] if domain.startswith('www.') else domain
+
+def build_company_query(domain: str):
+    """Builds the company-level research query shared by every lead at a domain."""
+    return f"{domain} company recent news funding launches hiring achievements"
+
+def create_research_tools(openrouter_api_key: str = None, tavily_api_key: str = None):
     """
-    Creates a LangGraph for lead research using OpenRouter, Tavily, and DuckDuckGo.
+    Returns the shared Tavily search tool and the OpenRouter LLM routed to summarize.
     """
     # Prefer arguments, fallback to env vars
     tavily_api_key = tavily_api_key or os.getenv("TAVILY_API_KEY")
     openrouter_api_key = openrouter_api_key or os.getenv("OPENROUTER_API_KEY")
-    
-    if tavily_api_key:
-        os.environ["TAVILY_API_KEY"] = tavily_api_key
-    
-    # Initialize tools and model (OpenRouter)
-    tavily_tool = TavilySearchResults(max_results=3)
-    llm = ChatOpenAI(
-        model="meta-llama/llama-3.1-405b-instruct", 
-        openai_api_key=openrouter_api_key,
-        openai_api_base="https://openrouter.ai/api/v1",
-        default_headers={
-            "HTTP-Referer": "https://leadflow-ai.streamlit.app", # Optional, but good practice
-            "X-Title": "LeadFlow AI"
-        }
-    )
 
-    def search_node(state: AgentState):
-        query = state['query']
-        import feedparser
-        from duckduckgo_search import DDGS
-        # Combine results from multiple tools for 100% reliability
-        results = []
-        
-        # 1. Tavily Search
-        try:
-            t_results = tavily_tool.invoke({"query": query})
-            results.append(f"--- Tavily Results ---\n{t_results}")
-        except Exception as e:
-            results.append(f"Tavily Search Failed: {e}")
-            
-        # 2. DuckDuckGo (Free & Reliable - Direct Library Use)
-        try:
-            with DDGS() as ddgs:
-                ddg_results = [r for r in ddgs.text(query, max_results=5)]
-            results.append(f"--- DuckDuckGo Results ---\n{ddg_results}")
-        except Exception as e:
-            results.append(f"DuckDuckGo Search Failed: {e}")
+    return get_tavily_tool(tavily_api_key), get_stage_llm(openrouter_api_key, "summarize")
 
-        # 3. Dynamic RSS Check (Optional but powerful)
-        try:
-            # Try to find common RSS feeds if domain is in query
-            domain_parts = [p for p in query.split() if '.' in p and 'http' not in p]
-            if domain_parts:
-                domain = domain_parts[0]
-                rss_url = f"https://{domain}/feed"
-                feed = feedparser.parse(rss_url)
-                if feed.entries:
-                    latest = [e.title for e in feed.entries[:3]]
-                    results.append(f"--- RSS News ({domain}) ---\n{latest}")
-        except:
-            pass
-            
-        return {"search_results": results}
+def _search_tavily(query: str, tavily_tool, timeout: float):
+    # Call the API wrapper directly: the tool turns HTTP errors (429s included) into a plain string
+    raw = ratelimit.call("tavily", tavily_tool.api_wrapper.raw_results, query, tavily_tool.max_results,
+                         tavily_tool.search_depth, deadline=time.time() + timeout)
+    t_results = tavily_tool.api_wrapper.clean_results(raw["results"])
+    return [{"source": "tavily", "title": r.get("title", ""), "text": r.get("content", ""), "url": r.get("url", "")}
+            for r in t_results]
 
-    def summarize_node(state: AgentState):
-        results = state['search_results']
-        prompt = f"""
-        You are a Deep Research Agent specializing in the "H.E.A.T." System (Hot, Engaged, Able, Targetable).
-        Based on the following search results, identify the "Trigger Events" or "Digital Signals" that make this lead a prime target.
-        
-        Look for:
-        1. Growth Triggers: Funding, new hires, office expansion, new launches.
-        2. Problem Triggers: Bad reviews, failed launches, outdated tech, recent departures.
-        3. Change Triggers: Rebrands, new platforms, speaking at events.
-        
-        Apply the SLAM Filter:
-        - Specific Need: What pain is visible?
-        - Attribute: Does it look like they have money/budget (funding, paid ads)?
-
-        Search Results:
-        {results}
-
-        Format your summary as:
-        RELIABILITY_SCORE: [1-10] (Based on strength of trigger events)
-        SCORE_REASON: [Short justification for the score]
-        TRIGGER: [Specific Event/Change]
-        PAIN: [Likely business pain following the trigger]
-        SIGNAL: [Summary of SLAM/HEAT findings]
-        """
-        response = llm.invoke([HumanMessage(content=prompt)])
-        return {"summary": response.content}
+def _search_ddg(query: str, tavily_tool, timeout: float):
+    # DuckDuckGo (Free & Reliable - Direct Library Use)
+    from duckduckgo_search import DDGS
+
+    def fetch():
+        if DDG_URL:
+            response = get_http_client().get(DDG_URL, params={"q": query, "max_results": 5}, timeout=timeout)
+            response.raise_for_status()
+            return response.json()
+        with DDGS(timeout=max(1, int(timeout))) as ddgs:
+            return [r for r in ddgs.text(query, max_results=5)]
+
+    ddg_results = ratelimit.call("duckduckgo", fetch, deadline=time.time() + timeout)
+    return [{"source": "ddg", "title": r.get("title", ""), "text": r.get("body", ""), "url": r.get("href", "")}
+            for r in ddg_results]
+
+def _search_rss(query: str, tavily_tool, timeout: float):
+    # Dynamic RSS Check (Optional but powerful)
+    import feedparser
+    # Try to find common RSS feeds if domain is in query
+    domain_parts = [p for p in query.split() if '.' in p and 'http' not in p]
+    if not domain_parts:
+        return []
+    domain = domain_parts[0]
+    # feedparser.parse(url) has no timeout, so fetch the bytes ourselves. Feeds are
+    # optional, so no retries; each site gets its own bucket and breaker.
+    response = ratelimit.call(f"rss:{domain}", get_http_client().get, RSS_FEED_URL.format(domain=domain),
+                              timeout=timeout, follow_redirects=True, deadline=time.time() + timeout, retries=0)
+    feed = feedparser.parse(response.content)
+    return [{"source": f"rss:{domain}", "title": e.get("title", ""), "text": e.get("summary", ""), "url": e.get("link", "")}
+            for e in feed.entries[:3]]
+
+# (source, fetcher, whether a failure is kept as an error entry in the results)
+SEARCH_PROVIDERS = [
+    ("tavily", _search_tavily, True),
+    ("ddg", _search_ddg, True),
+    ("rss", _search_rss, False),
+]
+
+# One thread per provider call a run can have in flight; see reserve_search_workers
+_provider_workers = 48
+_provider_pool = ThreadPoolExecutor(max_workers=_provider_workers, thread_name_prefix="leadflow-provider")
+_provider_lock = threading.Lock()
+
+def reserve_search_workers(workers: int):
+    """
+    Grows the shared provider pool to fit workers concurrent run_search calls
+    (one thread per provider each), so no provider call waits in its queue
+    while the per-lead deadline runs out. The pool never shrinks.
+    """
+    global _provider_pool, _provider_workers
+    needed = workers * len(SEARCH_PROVIDERS)
+    with _provider_lock:
+        if needed > _provider_workers:
+            # Calls already queued on the old pool still run; it winds down once they finish
+            old, _provider_pool = _provider_pool, ThreadPoolExecutor(max_workers=needed, thread_name_prefix="leadflow-provider")
+            _provider_workers = needed
+            old.shutdown(wait=False)
+
+def _timed(fetch, query, tavily_tool, timeout):
+    started = time.perf_counter()
+    try:
+        return fetch(query, tavily_tool, timeout), None, time.perf_counter() - started
+    except Exception as e:
+        return None, e, time.perf_counter() - started
+
+def run_search(query: str, tavily_tool, deadline: float = None):
+    """
+    Queries Tavily, DuckDuckGo and the company RSS feed in parallel.
+    Returns snippet dicts ({source, title, text, url}); a failed provider adds
+    {source, error} instead. Sources that have not answered within the deadline
+    are dropped and the summary goes ahead with whatever came back.
+    Per-source latency and outcomes are recorded under "search.<source>" in metrics,
+    and as "search.<source>" spans for a traced lead.
+    """
+    deadline = deadline or SEARCH_DEADLINE_S
+    started_at = time.time()
+    futures = {
+        source: _provider_pool.submit(_timed, fetch, query, tavily_tool, deadline)
+        for source, fetch, _ in SEARCH_PROVIDERS
+    }
+    wait(futures.values(), timeout=deadline)
+
+    # Combine results from multiple tools for 100% reliability
+    results = []
+    for source, _, reports_failure in SEARCH_PROVIDERS:
+        future = futures[source]
+        if not future.done():
+            # A call that never got a thread is a capacity problem, not a slow provider
+            outcome = "queued" if future.cancel() else "timeout"
+            metrics.record(f"search.{source}", deadline, outcome)
+            tracing.span(f"search.{source}", started_at, deadline, outcome)
+            continue
+
+        value, error, elapsed = future.result()
+        metrics.record(f"search.{source}", elapsed, "error" if error else "ok")
+        tracing.span(f"search.{source}", started_at, elapsed, "error" if error else "ok")
+        if error is not None:
+            if reports_failure:
+                results.append({"source": source, "error": str(error)})
+        else:
+            results.extend(value)
+
+    return results
+
+HEAT_INSTRUCTIONS = """
+    You are a Deep Research Agent specializing in the "H.E.A.T." System (Hot, Engaged, Able, Targetable).
+    Based on the following search results, identify the "Trigger Events" or "Digital Signals" that make this lead a prime target.
+
+    Look for:
+    1. Growth Triggers: Funding, new hires, office expansion, new launches.
+    2. Problem Triggers: Bad reviews, failed launches, outdated tech, recent departures.
+    3. Change Triggers: Rebrands, new platforms, speaking at events.
+
+    Apply the SLAM Filter:
+    - Specific Need: What pain is visible?
+    - Attribute: Does it look like they have money/budget (funding, paid ads)?
+"""
+
+SUMMARY_FORMAT = """
+    RELIABILITY_SCORE: [1-10] (Based on strength of trigger events)
+    SCORE_REASON: [Short justification for the score]
+    TRIGGER: [Specific Event/Change]
+    PAIN: [Likely business pain following the trigger]
+    SIGNAL: [Summary of SLAM/HEAT findings]
+"""
+
+# Fields a summary must contain to be usable downstream
+REQUIRED_SUMMARY_FIELDS = ("RELIABILITY_SCORE:", "TRIGGER:", "PAIN:")
+
+# Rough completion size of one summary, reserved per lead when packing batches
+SUMMARY_OUTPUT_TOKENS = 350
+
+def is_complete_summary(summary: str):
+    """True if the summary has every field the rest of the app reads."""
+    return all(field in summary for field in REQUIRED_SUMMARY_FIELDS)
+
+def summarize_results(results: list, llm, on_token=None, escalate=None):
+    """
+    Runs the H.E.A.T./SLAM summarization prompt over a lead's search results.
+    on_token(text_so_far) streams the summary as it is generated.
+    A summary missing required fields is requested once more from escalate
+    (a larger model's client), if given.
+    """
+    prompt = f"""{HEAT_INSTRUCTIONS}
+    Search Results:
+    {compact_results(results)}
+
+    Format your summary as:{SUMMARY_FORMAT}"""
+    summary = complete(llm, prompt, "summarize", on_token)
+    if escalate is not None and not is_complete_summary(summary):
+        summary = complete(escalate, prompt, "summarize.escalate", on_token)
+    return summary
+
+def max_batch_size(model: str, requested: int, tokens_per_lead: int = None):
+    """
+    Largest batch size <= requested whose prompt and replies fit the model's
+    context window, assuming tokens_per_lead of search results per lead
+    (the compaction budget by default).
+    """
+    tokens_per_lead = tokens_per_lead or COMPACT_BUDGET_TOKENS
+    window = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    room = window - estimate_tokens(HEAT_INSTRUCTIONS + SUMMARY_FORMAT) - 200
+    return max(1, min(requested, room // (tokens_per_lead + SUMMARY_OUTPUT_TOKENS)))
+
+def summarize_batch(batch: list, llm, escalate=None):
+    """
+    Summarizes several leads' search results in one request.
+    Returns one summary per entry in batch; any lead whose section comes back
+    missing or malformed is retried on its own (escalating as summarize_results does).
+    """
+    if len(batch) == 1:
+        return [summarize_results(batch[0], llm, escalate=escalate)]
+
+    sections = "\n".join(f"### LEAD {i}\n{compact_results(results)}\n" for i, results in enumerate(batch, 1))
+    prompt = f"""{HEAT_INSTRUCTIONS}
+    Below are search results for {len(batch)} separate leads, each under a "### LEAD <n>" header.
+    Research each lead independently; never mix findings between leads.
+
+    {sections}
+    Reply with exactly one section per lead, in order. Start each section with its
+    "### LEAD <n>" header on its own line, followed by:{SUMMARY_FORMAT}"""
+    reply = complete(llm, prompt, "summarize_batch")
+
+    parsed = {}
+    for match in re.finditer(r"^\s*#{2,}\s*LEAD\s+(\d+)\s*$(.*?)(?=^\s*#{2,}\s*LEAD\s+\d+\s*$|\Z)",
+                             reply, re.MULTILINE | re.DOTALL):
+        parsed[int(match.group(1))] = match.group(2).strip()
+
+    summaries = []
+    for i, results in enumerate(batch, 1):
+        section = parsed.get(i, "")
+        if is_complete_summary(section):
+            metrics.record("summarize.batch_lead", 0.0, "ok")
+            summaries.append(section)
+        else:
+            metrics.record("summarize.batch_lead", 0.0, "retry")
+            summaries.append(summarize_results(results, llm, escalate=escalate))
+    return summaries
+
+class BatchSummarizer:
+    """
+    Micro-batches concurrent summarize calls into multi-lead requests.
+    Callers block in summarize() until their batch is sent; a batch goes out
+    when batch_size leads are waiting or linger seconds after the first one
+    arrived. Batches are split further if they would overflow the context window.
+    """
+    def __init__(self, llm, batch_size: int, linger: float = 0.5, escalate=None):
+        self.llm = llm
+        self.escalate = escalate
+        self.batch_size = max_batch_size(llm.model_name, batch_size)
+        self.linger = linger
+        self.window = MODEL_CONTEXT_TOKENS.get(llm.model_name, DEFAULT_CONTEXT_TOKENS)
+        self._waiting = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def summarize(self, results: list):
+        future = Future()
+        with self._lock:
+            self._waiting.append((results, future))
+            if len(self._waiting) >= self.batch_size:
+                batch = self._take()
+            else:
+                batch = None
+                if self._timer is None:
+                    self._timer = threading.Timer(self.linger, self._flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if batch:
+            self._run(batch)
+        return future.result()
+
+    def _take(self):
+        batch, self._waiting = self._waiting[:self.batch_size], self._waiting[self.batch_size:]
+        if self._timer is not None and not self._waiting:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self):
+        with self._lock:
+            self._timer = None
+            batch = self._take()
+        if batch:
+            self._run(batch)
+
+    def _run(self, batch):
+        # Pack by actual size so one oversized lead can't overflow the window
+        budget = self.window - estimate_tokens(HEAT_INSTRUCTIONS + SUMMARY_FORMAT) - 200
+        chunks, chunk, used = [], [], 0
+        for results, future in batch:
+            cost = estimate_tokens(compact_results(results)) + SUMMARY_OUTPUT_TOKENS
+            if chunk and used + cost > budget:
+                chunks.append(chunk)
+                chunk, used = [], 0
+            chunk.append((results, future))
+            used += cost
+        chunks.append(chunk)
+
+        for chunk in chunks:
+            try:
+                summaries = summarize_batch([results for results, _ in chunk], self.llm, self.escalate)
+                for (_, future), summary in zip(chunk, summaries):
+                    future.set_result(summary)
+            except Exception as e:
+                for _, future in chunk:
+                    future.set_exception(e)
+
+def normalize_query(query: str):
+    """Cache key for raw search results: case and whitespace don't change the answer."""
+    return " ".join(query.lower().split())
+
+def cached_search(query: str, tavily_tool, deadline: float = None, force_refresh: bool = False):
+    """
+    run_search behind the "search" cache level. Results with a failed provider
+    are not cached, so a transient outage isn't replayed for the whole TTL.
+    """
+    key = normalize_query(query)
+    if not force_refresh:
+        hit = cache_get("search", key)
+        if hit is not None:
+            metrics.record("cache.search", 0.0, "hit")
+            return json.loads(hit)
+        metrics.record("cache.search", 0.0, "miss")
+
+    results = run_search(query, tavily_tool, deadline)
+    if results and not any("error" in r for r in results):
+        cache_put("search", key, json.dumps(results))
+    return results
+
+def cached_summary(results: list, llm, force_refresh: bool = False, summarizer=None, on_token=None, escalate=None):
+    """
+    summarize_results behind the "summary" cache level, keyed by model and a hash of the results.
+    summarizer (e.g. BatchSummarizer.summarize) replaces the single-lead call on a miss.
+    on_token streams a fresh summary; a cache hit is handed to it in one piece.
+    """
+    payload = json.dumps([llm.model_name, COMPACT_BUDGET_TOKENS, results])
+    key = hashlib.sha256(payload.encode()).hexdigest()
+    if not force_refresh:
+        hit = cache_get("summary", key)
+        if hit is not None:
+            metrics.record("cache.summary", 0.0, "hit")
+            if on_token:
+                on_token(hit)
+            return hit
+        metrics.record("cache.summary", 0.0, "miss")
+
+    summary = summarizer(results) if summarizer else summarize_results(results, llm, on_token, escalate)
+    cache_put("summary", key, summary)
+    return summary
+
+def build_research_workflow(search_node, summarize_node):
+    """Search -> summarize layout shared by the research graph and its checkpoint view."""
+    from langgraph.graph import StateGraph, END
 
-    # Build the graph
     workflow = StateGraph(AgentState)
     workflow.add_node("search", search_node)
     workflow.add_node("summarize", summarize_node)
@@ -108,16 +385,175 @@ def create_research_graph(openrouter_api_key: str = None, tavily_api_key: str =
     workflow.set_entry_point("search")
     workflow.add_edge("search", "summarize")
     workflow.add_edge("summarize", END)
+    return workflow
 
-    return workflow.compile()
+def create_research_graph(openrouter_api_key: str = None, tavily_api_key: str = None):
+    """
+    Creates a LangGraph for lead research using OpenRouter, Tavily, and DuckDuckGo.
+    Checkpoints go to leadflow.db, one thread per normalized query.
+    """
+    tavily_tool, llm = create_research_tools(openrouter_api_key, tavily_api_key)
+    escalate = get_escalation_llm(openrouter_api_key or os.getenv("OPENROUTER_API_KEY"), llm)
 
-def enrich_lead(lead_row: dict, groq_api_key: str, tavily_api_key: str):
+    def search_node(state: AgentState):
+        return {"search_results": cached_search(state['query'], tavily_tool, force_refresh=state.get('force_refresh', False))}
+
+    def summarize_node(state: AgentState):
+        return {"summary": cached_summary(state['search_results'], llm, state.get('force_refresh', False), escalate=escalate)}
+
+    # Build the graph
+    return build_research_workflow(search_node, summarize_node).compile(checkpointer=get_checkpointer())
+
+def get_research_state_graph():
     """
-    Enriches a single lead row.
+    Checkpoint view of the research graph: same layout and checkpointer, no API
+    clients. The pipeline stages read and write research checkpoints through it.
     """
-    location = lead_row.get('Location', '')
-    query = f"{lead_row['Founder Name']} {lead_row['Domain']} {lead_row['Position']} {location} recent news funding achievements"
-    graph = create_research_graph(groq_api_key, tavily_api_key)
-    
-    result = graph.invoke({"query": query})
+    return get_or_create("research_state_graph", DB_PATH, lambda: build_research_workflow(
+        lambda state: {}, lambda state: {}).compile(checkpointer=get_checkpointer()))
+
+def research_config(query: str):
+    """Checkpoint thread for a research query."""
+    return thread_config("research", normalize_query(query))
+
+def checkpointed_search(query: str, search, force_refresh: bool = False):
+    """
+    Calls search() unless the query's checkpoint already holds results still
+    waiting to be summarized (i.e. the summarize stage failed last time).
+    """
+    graph, config = get_research_state_graph(), research_config(query)
+    values, pending = load_stage(graph, config)
+    if not force_refresh and pending == ("summarize",) and "search_results" in values:
+        metrics.record("checkpoint.search", 0.0, "resumed")
+        return values["search_results"]
+
+    results = search()
+    # Start the thread afresh, so it never holds more than this one checkpoint
+    clear_stage(config)
+    save_stage(graph, config, {"query": query, "search_results": results}, "search")
+    return results
+
+def checkpointed_summary(query: str, summarize):
+    """
+    Calls summarize(), then deletes the query's research thread: the summary
+    cache already keeps the result, so there is nothing left to resume.
+    """
+    summary = summarize()
+    clear_stage(research_config(query))
+    return summary
+
+def get_research_graph(openrouter_api_key: str = None, tavily_api_key: str = None):
+    """
+    Returns the compiled research graph for these keys, compiling it only once per process.
+    """
+    tavily_api_key = tavily_api_key or os.getenv("TAVILY_API_KEY")
+    openrouter_api_key = openrouter_api_key or os.getenv("OPENROUTER_API_KEY")
+    key = (key_fingerprint(openrouter_api_key), key_fingerprint(tavily_api_key))
+    return get_or_create("research_graph", key, lambda: create_research_graph(openrouter_api_key, tavily_api_key))
+
+def search_lead(lead_row: dict, tavily_api_key: str, deadline: float = None, force_refresh: bool = False):
+    """
+    Search stage of the personalization pipeline: raw results for one lead.
+    """
+    query = build_query(lead_row)
+    tavily_tool = get_tavily_tool(tavily_api_key or os.getenv("TAVILY_API_KEY"))
+    return checkpointed_search(query, lambda: cached_search(query, tavily_tool, deadline, force_refresh), force_refresh)
+
+def summarize_lead(search_results: list, openrouter_api_key: str, force_refresh: bool = False, summarizer=None,
+                   on_token=None, query: str = None, models: dict = None):
+    """
+    Summarization stage of the personalization pipeline.
+    With query, the lead's research checkpoint is deleted afterwards.
+    models overrides the stage routing in clients.STAGE_MODELS.
+    """
+    openrouter_api_key = openrouter_api_key or os.getenv("OPENROUTER_API_KEY")
+    llm = get_stage_llm(openrouter_api_key, "summarize", models)
+    escalate = get_escalation_llm(openrouter_api_key, llm, models)
+    summarize = lambda: cached_summary(search_results, llm, force_refresh, summarizer, on_token, escalate)
+    return checkpointed_summary(query, summarize) if query else summarize()
+
+def enrich_lead(lead_row: dict, groq_api_key: str, tavily_api_key: str, force_refresh: bool = False):
+    """
+    Enriches a single lead row. Cached search results and summaries are used
+    before any network I/O unless force_refresh is set, and a lead whose last
+    run stopped after search resumes at summarize. The lead's checkpoint thread
+    is deleted once the summary is stored.
+    """
+    query = build_query(lead_row)
+    graph = get_research_graph(groq_api_key, tavily_api_key)
+    config = research_config(query)
+
+    _, pending = load_stage(graph, config)
+    if pending and not force_refresh:
+        result = graph.invoke(None, config)
+    else:
+        result = graph.invoke({"query": query, "force_refresh": force_refresh}, config)
+    if result.get('summary'):
+        clear_stage(config)
     return result.get('summary', 'No summary generated.')
+
+def personalize_company_research(company_summary: str, lead_row: dict):
+    """
+    Cheap person-specific step on top of shared company research: no network
+    calls, just anchors the company findings to this contact.
+    """
+    name = lead_row.get('Founder Name', '') or 'Unknown contact'
+    position = lead_row.get('Position', '') or 'Unknown role'
+    location = lead_row.get('Location', '')
+    contact = f"CONTACT: {name} ({position})" + (f", {location}" if location else "")
+    return f"{contact}\n{company_summary}"
+
+class CompanyResearch:
+    """
+    Per-run memo that researches each normalized domain once.
+    Concurrent callers for the same domain wait on the first caller's result
+    instead of issuing their own search and summarize calls.
+    """
+    def __init__(self, openrouter_api_key: str, tavily_api_key: str, deadline: float = None, force_refresh: bool = False,
+                 summarizer=None, models: dict = None):
+        self.openrouter_api_key = openrouter_api_key
+        self.models = models
+        self.tavily_api_key = tavily_api_key
+        self.deadline = deadline
+        self.force_refresh = force_refresh
+        self.summarizer = summarizer
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _once(self, key, compute):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if not owner:
+            metrics.record(f"company.{key[0]}", 0.0, "shared")
+            return future.result()
+
+        started = time.perf_counter()
+        try:
+            value = compute()
+        except Exception as e:
+            future.set_exception(e)
+            metrics.record(f"company.{key[0]}", time.perf_counter() - started, "error")
+            raise
+        future.set_result(value)
+        metrics.record(f"company.{key[0]}", time.perf_counter() - started, "ok")
+        return value
+
+    def search(self, domain: str):
+        """Raw search results for the company at this domain."""
+        query = build_company_query(domain)
+        tavily_tool = get_tavily_tool(self.tavily_api_key or os.getenv("TAVILY_API_KEY"))
+        return self._once(("search", domain), lambda: checkpointed_search(
+            query, lambda: cached_search(query, tavily_tool, self.deadline, self.force_refresh), self.force_refresh))
+
+    def summarize(self, domain: str, search_results: list, on_token=None):
+        """H.E.A.T. summary for the company at this domain."""
+        openrouter_api_key = self.openrouter_api_key or os.getenv("OPENROUTER_API_KEY")
+        llm = get_stage_llm(openrouter_api_key, "summarize", self.models)
+        escalate = get_escalation_llm(openrouter_api_key, llm, self.models)
+        summarizer = None if on_token else self.summarizer
+        return self._once(("summarize", domain), lambda: checkpointed_summary(
+            build_company_query(domain), lambda: cached_summary(search_results, llm, self.force_refresh, summarizer, on_token,
+                                                                escalate)))
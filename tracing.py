@@ -0,0 +1,215 @@
+"""
+Per-lead timing spans for pipeline runs and sends.
+While a lead is traced (see lead()), searches, LLM calls and pipeline stages
+record spans: name, start, seconds, outcome and token counts. Spans are
+buffered and written to the spans table in leadflow.db, where the app's
+"Run diagnostics" panel reads them back.
+
+Optional exports:
+  LEADFLOW_OTLP_ENDPOINT  OTLP/HTTP traces endpoint (e.g. http://localhost:4318/v1/traces);
+                          every flushed batch is also posted there as OTLP JSON
+  LEADFLOW_METRICS_PORT   serves this process's metrics.snapshot() at /metrics
+                          in the Prometheus text format
+
+    python tracing.py runs                   # recent traced runs
+    python tracing.py export RUN_ID run.json # one run as OTLP JSON
+"""
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import metrics
+from database import record_spans, get_spans, span_runs
+
+OTLP_ENDPOINT = os.getenv("LEADFLOW_OTLP_ENDPOINT")
+METRICS_PORT = os.getenv("LEADFLOW_METRICS_PORT")
+# Spans buffered per process before they are written out
+SPAN_FLUSH_ROWS = 200
+
+_local = threading.local()
+_lock = threading.Lock()
+_buffer = []
+
+@contextmanager
+def lead(run_id, list_id, lead_index):
+    """Attributes spans recorded on this thread to one lead of run_id until the block exits."""
+    previous = getattr(_local, "lead", None)
+    _local.lead = (run_id, list_id, lead_index)
+    try:
+        yield
+    finally:
+        _local.lead = previous
+
+def current():
+    """(run_id, list_id, lead_index) being traced on this thread, or None."""
+    return getattr(_local, "lead", None)
+
+def span(name, started_at, seconds, outcome="ok", input_tokens=0, output_tokens=0, lead=None):
+    """
+    Records one span for the lead traced on this thread, or for lead
+    ((run_id, list_id, lead_index)) when given. A no-op outside a traced lead.
+    """
+    lead = lead or current()
+    if lead is None:
+        return
+    with _lock:
+        _buffer.append((*lead, name, started_at, seconds, outcome, input_tokens, output_tokens))
+        full = len(_buffer) >= SPAN_FLUSH_ROWS
+    if full:
+        flush()
+
+@contextmanager
+def timed(name):
+    """Records the block as a span named name; outcome "error" if it raises."""
+    started_at, started = time.time(), time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        span(name, started_at, time.perf_counter() - started, outcome)
+
+def flush():
+    """Writes buffered spans to leadflow.db (and the OTLP endpoint, if set). Never raises."""
+    with _lock:
+        rows = _buffer[:]
+        del _buffer[:]
+    if not rows:
+        return
+    try:
+        record_spans(rows)
+    except sqlite3.Error as e:
+        # Diagnostics must never fail a run
+        metrics.add("tracing", "dropped", len(rows))
+        print(f"[ERROR] Could not store {len(rows)} spans: {e}")
+    if OTLP_ENDPOINT:
+        post_otlp(rows)
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def to_otlp(rows, service_name="leadflow"):
+    """
+    Span rows as an OTLP/JSON ExportTraceServiceRequest: one trace per run
+    (trace id derived from run_id), lead and token counts as attributes.
+    """
+    spans = []
+    for run_id, list_id, lead_index, name, started_at, seconds, outcome, input_tokens, output_tokens in rows:
+        attributes = {"leadflow.run_id": run_id, "leadflow.lead_index": lead_index, "leadflow.outcome": outcome}
+        if list_id:
+            attributes["leadflow.list_id"] = list_id
+        if input_tokens or output_tokens:
+            attributes["gen_ai.usage.input_tokens"] = input_tokens
+            attributes["gen_ai.usage.output_tokens"] = output_tokens
+        spans.append({
+            "traceId": hashlib.md5(run_id.encode()).hexdigest(),
+            "spanId": secrets.token_hex(8),
+            "name": name,
+            "kind": 3 if name.startswith(("search.", "llm.", "send.")) else 1,
+            "startTimeUnixNano": str(int(started_at * 1e9)),
+            "endTimeUnixNano": str(int((started_at + seconds) * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()],
+            "status": {"code": 1 if outcome == "ok" else 2, "message": "" if outcome == "ok" else outcome},
+        })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{"scope": {"name": "leadflow.tracing"}, "spans": spans}],
+    }]}
+
+def post_otlp(rows):
+    import httpx
+
+    try:
+        httpx.post(OTLP_ENDPOINT, json=to_otlp(rows), timeout=5).raise_for_status()
+    except httpx.HTTPError as e:
+        metrics.add("tracing", "export_failed", len(rows))
+        print(f"[ERROR] OTLP export to {OTLP_ENDPOINT} failed: {e}")
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def prometheus_text(prefix=""):
+    """metrics.snapshot(prefix) in the Prometheus text exposition format."""
+    lines, events = ["# TYPE leadflow_latency_seconds summary"], ["# TYPE leadflow_events_total counter"]
+    for name, stats in metrics.snapshot(prefix).items():
+        label = _label(name)
+        for quantile, field in (("0.5", "p50"), ("0.95", "p95")):
+            lines.append(f'leadflow_latency_seconds{{name="{label}",quantile="{quantile}"}} {stats[field]}')
+        lines.append(f'leadflow_latency_seconds_count{{name="{label}"}} {stats["calls"]}')
+        for outcome, value in stats.items():
+            if outcome not in ("calls", "avg", "p50", "p95") and value:
+                events.append(f'leadflow_events_total{{name="{label}",outcome="{_label(outcome)}"}} {value}')
+    return "\n".join(lines + events) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_exporter(port=None):
+    """
+    Serves /metrics on port (LEADFLOW_METRICS_PORT by default) from a daemon
+    thread. Returns the server, or None when no port is configured.
+    """
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="leadflow-metrics").start()
+    return server
+
+def main():
+    import argparse
+    from database import init_db
+
+    parser = argparse.ArgumentParser(description="LeadFlow AI run traces")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("runs", help="List recent traced runs")
+    export = sub.add_parser("export", help="Write one run's spans as OTLP JSON")
+    export.add_argument("run_id")
+    export.add_argument("path", nargs="?", help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "runs":
+        for run_id, started_at, leads, spans, seconds in span_runs():
+            print(f"{run_id}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started_at))}  "
+                  f"{leads} leads  {spans} spans  {seconds:.1f}s")
+        return
+
+    rows = get_spans(args.run_id)
+    if not rows:
+        raise SystemExit(f"[ERROR] No spans for run {args.run_id}")
+    payload = json.dumps(to_otlp(rows), indent=2)
+    if args.path:
+        with open(args.path, "w") as f:
+            f.write(payload)
+        print(f"[OK] {len(rows)} spans written to {args.path}")
+    else:
+        print(payload)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Background worker for queued "Generate Personalization" jobs.
+Claims leads from the jobs table in leadflow.db, runs them through the staged
+pipeline and writes the results back for the app to pick up. Start as many as
+you need, on one host or several sharing the database file.
+
+API keys are read from OPENROUTER_API_KEY and TAVILY_API_KEY.
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+import tracing
+from database import init_db, claim_jobs, heartbeat_jobs, finish_job, JOB_LEASE_SECONDS
+from pipeline import run_pipeline, personalization_stages
+
+# Lead columns a job writes back
+RESULT_FIELDS = ['Enriched Data', 'Subject', 'Opener', 'Body', 'Closing', 'Status']
+
+def run_jobs(worker_id, jobs, openrouter_api_key, tavily_api_key):
+    """Runs claimed jobs through the pipeline, heartbeating their leases until each one finishes."""
+    in_flight = {job_id for job_id, _, _, _ in jobs}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(JOB_LEASE_SECONDS / 3):
+            with lock:
+                job_ids = list(in_flight)
+            heartbeat_jobs(worker_id, job_ids)
+
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+
+    # Jobs from different runs can carry different offers and settings
+    groups = {}
+    for job in jobs:
+        payload = job[3]
+        key = json.dumps([payload.get('user_offer', ''), payload.get('options', {})], sort_keys=True)
+        groups.setdefault(key, []).append(job)
+
+    try:
+        for group in groups.values():
+            payload = group[0][3]
+            options = payload.get('options', {})
+            stages = personalization_stages(
+                openrouter_api_key, tavily_api_key, payload.get('user_offer', ''),
+                options.get('concurrency'), options.get('search_deadline'), options.get('force_refresh', False),
+                options.get('group_by_domain', True), options.get('summary_batch_size', 1), options.get('fused', False),
+                options.get('models'))
+            items = ((job_id, job_payload['lead']) for job_id, _, _, job_payload in group)
+            # Spans are filed under the app's run, per lead
+            leads = {job_id: (run_id, None, lead_index) for job_id, run_id, lead_index, _ in group}
+
+            for job_id, lead, error in run_pipeline(items, stages, trace=leads.get):
+                result = {field: lead[field] for field in RESULT_FIELDS if field in lead}
+                finish_job(job_id, worker_id, result, error)
+                with lock:
+                    in_flight.discard(job_id)
+    finally:
+        stop.set()
+
+def main():
+    parser = argparse.ArgumentParser(description="LeadFlow AI enrichment worker")
+    parser.add_argument("--batch", type=int, default=16, help="Jobs to claim per poll")
+    parser.add_argument("--poll", type=float, default=2.0, help="Seconds to wait when the queue is empty")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+    args = parser.parse_args()
+
+    openrouter_api_key = os.getenv("OPENROUTER_API_KEY")
+    tavily_api_key = os.getenv("TAVILY_API_KEY")
+    if not openrouter_api_key or not tavily_api_key:
+        raise SystemExit("[ERROR] Set OPENROUTER_API_KEY and TAVILY_API_KEY before starting a worker.")
+
+    init_db()
+    tracing.start_exporter()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    print(f"[OK] Worker {worker_id} started")
+
+    while True:
+        jobs = claim_jobs(worker_id, args.batch)
+        if not jobs:
+            if args.once:
+                break
+            time.sleep(args.poll)
+            continue
+        started = time.time()
+        run_jobs(worker_id, jobs, openrouter_api_key, tavily_api_key)
+        print(f"[OK] Finished {len(jobs)} jobs in {time.time() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()